@@ -5,7 +5,10 @@ import sys
 import time
 import os
 import decimal
-from datetime import datetime, date, time as dt_time
+import gzip
+import json
+import hashlib
+from datetime import datetime, date, timedelta, time as dt_time
 
 # --- CONFIGURAÇÕES DE PERFORMANCE ---
 DELAY_OCIOSO = 60       # Segundos quando não há nada para enviar
@@ -39,6 +42,21 @@ try:
     DB_HOST = config.get(DB_SEC, 'host', fallback="localhost")
     DB_PORT = config.get(DB_SEC, 'port', fallback="3050")
 
+    # Vendas enviadas como documento único (capa + itens + pagamentos) em /api/sync/vendas
+    VENDAS_DOCUMENTO = config.getboolean('CONFIG', 'vendas_documento', fallback=True)
+
+    # gzip: lotes enviados como NDJSON comprimido (o servidor lê em streaming)
+    # nenhuma: JSON array puro (servidores antigos)
+    COMPRESSAO = config.get('CONFIG', 'compressao', fallback="gzip").strip().lower()
+
+    # Lote gravado na fila durável do servidor e confirmado com 202, sem
+    # esperar a aplicação no banco
+    MODO_ASSINCRONO = config.getboolean('CONFIG', 'modo_assincrono', fallback=False)
+
+    # Reconciliação com a nuvem por digestos (0 desliga) e quantos dias para trás ela cobre
+    RECONCILIAR_HORAS = config.getint('CONFIG', 'reconciliar_horas', fallback=24)
+    RECONCILIAR_DIAS = config.getint('CONFIG', 'reconciliar_dias', fallback=365)
+
     if not TOKEN: raise Exception("Token (token_loja) não configurado.")
 except Exception as e:
     print(f"ERRO CONFIG: {e}")
@@ -67,14 +85,15 @@ TABELAS_SYNC = [
     {"nome": "PRODUTO", "endpoint": "/api/sync/cadastros/produto", "sql": "ID, NOME, PRECO_VENDA, CUSTO_TOTAL, ID_GRUPO, ID_FABRICANTE, ID_FORNECEDOR, ID_FAMILIA, ATIVO"},
     
     # SAIDA: Incluído NORMAL e ELIMINADO para tratamento no Back
-    {"nome": "SAIDA", "endpoint": "/api/sync/saida", "sql": "ID, ID_FILIAL, DATA, HORA, TOTAL, ID_CLIENTE, TERMINAL, USUARIO AS ID_USUARIO, ELIMINADO, NORMAL, NUMERO, SERIE, TIPOSAIDA, TIPO, CHAVENFE"},
+    {"nome": "SAIDA", "endpoint": "/api/sync/saida", "sql": "ID, ID_FILIAL, DATA, HORA, TOTAL, ID_CLIENTE, TERMINAL, USUARIO AS ID_USUARIO, ELIMINADO, NORMAL, NUMERO, SERIE, TIPOSAIDA, TIPO, CHAVENFE", "venda": True},
     
     # SAIDA_PRODUTO: ADICIONADO CAMPO ID
-    {"nome": "SAIDA_PRODUTO", "endpoint": "/api/sync/saida_produto", "sql": "ID, ID_SAIDA, ID_PRODUTO, ID_VENDEDOR, QUANT, TOTAL"},
+    {"nome": "SAIDA_PRODUTO", "endpoint": "/api/sync/saida_produto", "sql": "ID, ID_SAIDA, ID_PRODUTO, ID_VENDEDOR, QUANT, TOTAL", "venda": True},
     
     # SAIDA_FORMAPAG: Segue sem ID (usa DB_KEY conforme estrutura do Firebird)
-    {"nome": "SAIDA_FORMAPAG", "endpoint": "/api/sync/saida_formapag", "sql": "ID_SAIDA, ID_FORMAPAG, VALOR"},
+    {"nome": "SAIDA_FORMAPAG", "endpoint": "/api/sync/saida_formapag", "sql": "ID_SAIDA, ID_FORMAPAG, VALOR", "venda": True},
 ]
+SQL_VENDA = {t['nome']: t['sql'] for t in TABELAS_SYNC if t.get('venda')}
 
 def limpar_valor(val):
     if val is None: return None
@@ -114,19 +133,122 @@ def row_to_dict(row, col_names, db_key):
         
     return data
 
-def enviar_lote(endpoint, payload, tabela_origem, db_keys):
+# Idempotency-Key: o mesmo conteúdo reenviado (timeout depois do commit no
+# servidor, ou o agente reiniciado no meio do envio) gera a mesma chave e o
+# servidor devolve o resultado já gravado. A chave é o sequencial do endpoint
+# (gravado em disco, avança a cada lote aceito) + hash do endpoint e do
+# conteúdo: reenviar o mesmo conteúdo depois de aceito é um lote novo.
+ARQUIVO_SEQUENCIAS = os.path.join(diretorio_base, 'idempotencia.json')
+_chaves_pendentes = {}   # endpoint -> (hash do conteúdo, chave)
+
+def _ler_sequencias():
     try:
-        headers = {"Authorization": f"Bearer {TOKEN}", "Content-Type": "application/json"}
-        r = requests.post(f"{API_URL}{endpoint}", json=payload, headers=headers, timeout=TIMEOUT_API)
+        with open(ARQUIVO_SEQUENCIAS, encoding="utf-8") as f: return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+_sequencias = _ler_sequencias()   # endpoint -> lotes aceitos
+
+def avancar_sequencia(endpoint):
+    _sequencias[endpoint] = _sequencias.get(endpoint, 0) + 1
+    temporario = ARQUIVO_SEQUENCIAS + ".tmp"
+    try:
+        with open(temporario, "w", encoding="utf-8") as f: json.dump(_sequencias, f)
+        os.replace(temporario, ARQUIVO_SEQUENCIAS)
+    except OSError as e:
+        print(f"\n   [AVISO] Sequencial de idempotência não gravado: {e}")
+
+def chave_idempotencia(endpoint, corpo):
+    resumo = hashlib.sha256(corpo).hexdigest()
+    pendente = _chaves_pendentes.get(endpoint)
+    if pendente and pendente[0] == resumo: return pendente[1]
+    origem = hashlib.sha256(f"{endpoint}\n{resumo}".encode("utf-8")).hexdigest()
+    chave = f"{_sequencias.get(endpoint, 0)}-{origem[:32]}"
+    _chaves_pendentes[endpoint] = (resumo, chave)
+    return chave
+
+def postar(endpoint, payload):
+    headers = {"Authorization": f"Bearer {TOKEN}"}
+    if MODO_ASSINCRONO: headers["Prefer"] = "respond-async"
+    if COMPRESSAO == "gzip":
+        corpo = "\n".join(json.dumps(item, ensure_ascii=False) for item in payload).encode("utf-8")
+        headers.update({"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"})
+    else:
+        corpo = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        headers["Content-Type"] = "application/json"
+    headers["Idempotency-Key"] = chave_idempotencia(endpoint, corpo)
+    if COMPRESSAO == "gzip": corpo = gzip.compress(corpo)
+    r = requests.post(f"{API_URL}{endpoint}", data=corpo, headers=headers, timeout=TIMEOUT_API)
+    if r.status_code in (200, 202):
+        r.chave_idempotencia = _chaves_pendentes.pop(endpoint, None)
+        avancar_sequencia(endpoint)
+    return r
+
+def marcar_enviados(chaves):
+    """ SYNK_DASH_PEND = 'N' nos registros já gravados na nuvem. chaves: {tabela: [RDB$DB_KEY]} """
+    conn = get_connection()
+    if not conn: return False
+    cursor = conn.cursor()
+    for tabela, db_keys in chaves.items():
+        if db_keys:
+            cursor.executemany(f"UPDATE {tabela} SET SYNK_DASH_PEND = 'N' WHERE RDB$DB_KEY = ?", [(x,) for x in db_keys])
+    conn.commit()
+    conn.close()
+    return True
+
+# --- LOTES NA FILA DO SERVIDOR (MODO ASSÍNCRONO) ---
+# O 202 só diz que o lote foi guardado: as marcas continuam 'S' até o status
+# do lote ser 'aplicado'. Com 'erro' (ou lote desconhecido) elas ficam 'S' e
+# o ciclo normal reenvia. Enquanto isso os registros do lote não são lidos
+# de novo (em_transito).
+MAX_LOTES_NA_FILA = 10
+_lotes_na_fila = {}   # id_lote -> {"endpoint", "chave": (hash, Idempotency-Key), "chaves": {tabela: [db_keys]}}
+
+def em_transito(tabela):
+    return {k for lote in _lotes_na_fila.values() for k in lote["chaves"].get(tabela, [])}
+
+def concluir_envio(r, endpoint, chaves):
+    """ 200: marca como enviados; 202: acompanha o lote até ser aplicado. """
+    if r.status_code == 200:
+        return marcar_enviados(chaves)
+    id_lote = r.json().get("id_lote")
+    _lotes_na_fila[id_lote] = {"endpoint": endpoint, "chave": r.chave_idempotencia, "chaves": chaves}
+    return True
 
+def acompanhar_fila():
+    """ Consulta os lotes aceitos com 202 e baixa as marcas dos aplicados. """
+    for id_lote, lote in list(_lotes_na_fila.items()):
+        try:
+            r = requests.get(f"{API_URL}/api/sync/lotes/{id_lote}",
+                             headers={"Authorization": f"Bearer {TOKEN}"}, timeout=TIMEOUT_API)
+        except Exception as e:
+            print(f"\n   [ERRO FILA]: {e}")
+            return
         if r.status_code == 200:
-            conn = get_connection()
-            if conn:
-                cursor = conn.cursor()
-                cursor.executemany(f"UPDATE {tabela_origem} SET SYNK_DASH_PEND = 'N' WHERE RDB$DB_KEY = ?", [(x,) for x in db_keys])
-                conn.commit()
-                conn.close()
-                return True
+            status = r.json()
+            if status["status"] == "pendente": continue
+            if status["status"] == "aplicado":
+                if not marcar_enviados(lote["chaves"]): continue
+            else:
+                print(f"\n   [LOTE {id_lote} COM ERRO NO SERVIDOR]: {(status.get('erro') or '')[:150]} (será reenviado)")
+        elif r.status_code == 404:
+            # Expirou no servidor sem status conhecido: reenvia com a mesma chave,
+            # que devolve o resultado guardado se ele chegou a ser aplicado
+            if lote["chave"]: _chaves_pendentes[lote["endpoint"]] = lote["chave"]
+        else:
+            continue
+        del _lotes_na_fila[id_lote]
+
+def enviar_lote(endpoint, payload, tabela_origem, db_keys):
+    try:
+        r = postar(endpoint, payload)
+
+        if r.status_code in (200, 202):
+            return concluir_envio(r, endpoint, {tabela_origem: db_keys})
+        elif r.status_code == 429:
+            espera = int(r.headers.get("Retry-After", "30"))
+            print(f"\n   [SERVIDOR OCUPADO] aguardando {espera}s")
+            time.sleep(espera)
         else:
             print(f"\n   [ERRO API {r.status_code}]: {r.text[:150]}")
     except Exception as e:
@@ -138,13 +260,15 @@ def executar_ciclo_sync():
     hora_atual = datetime.now().strftime("%H:%M:%S")
 
     for config_tbl in TABELAS_SYNC:
+        if VENDAS_DOCUMENTO and config_tbl.get('venda'): continue
         conn = get_connection()
         if not conn: return False
         cursor = conn.cursor()
         tabela = config_tbl['nome']
         
         try:
-            sql = f"SELECT FIRST {TAMANHO_LOTE} RDB$DB_KEY, {config_tbl['sql']}, SYNK_DASH_PEND FROM {tabela} WHERE SYNK_DASH_PEND = 'S'"
+            transito = em_transito(tabela)
+            sql = f"SELECT FIRST {TAMANHO_LOTE + len(transito)} RDB$DB_KEY, {config_tbl['sql']}, SYNK_DASH_PEND FROM {tabela} WHERE SYNK_DASH_PEND = 'S'"
             
             # Filtro apenas por DATA_CORTE (Removido filtros de ELIMINADO/NORMAL)
             if tabela == "SAIDA":
@@ -158,7 +282,7 @@ def executar_ciclo_sync():
                 )"""
 
             cursor.execute(sql)
-            rows = cursor.fetchall()
+            rows = [r for r in cursor.fetchall() if r[0] not in transito][:TAMANHO_LOTE]
             col_names = [d[0] for d in cursor.description][1:-1]
             conn.close()
 
@@ -178,6 +302,232 @@ def executar_ciclo_sync():
             print(f"Erro ao ler {tabela}: {e}")
     return encontrou_dados
 
+def enviar_vendas(payload, chaves):
+    """
+    Envia os documentos e, com 200, marca capa, itens e pagamentos como
+    enviados (com 202, quando o lote for aplicado; ver acompanhar_fila).
+    """
+    try:
+        r = postar("/api/sync/vendas", payload)
+
+        if r.status_code in (200, 202):
+            return concluir_envio(r, "/api/sync/vendas", chaves)
+        elif r.status_code == 429:
+            espera = int(r.headers.get("Retry-After", "30"))
+            print(f"\n   [SERVIDOR OCUPADO] aguardando {espera}s")
+            time.sleep(espera)
+        else:
+            print(f"\n   [ERRO API {r.status_code}]: {r.text[:150]}")
+    except Exception as e:
+        print(f"\n   [ERRO ENVIO]: {e}")
+    return False
+
+def executar_ciclo_vendas():
+    """
+    Monta documentos completos de venda numa única leitura do Firebird:
+    vendas pendentes (ou com item/pagamento pendente) + todos os seus itens e pagamentos.
+    """
+    hora_atual = datetime.now().strftime("%H:%M:%S")
+    conn = get_connection()
+    if not conn: return False
+    cursor = conn.cursor()
+
+    try:
+        transito = em_transito("SAIDA")
+        cursor.execute(f"""
+            SELECT FIRST {TAMANHO_LOTE + len(transito)} RDB$DB_KEY, {SQL_VENDA['SAIDA']} FROM SAIDA S
+            WHERE S.DATA >= '{DATA_CORTE}' AND (
+                S.SYNK_DASH_PEND = 'S'
+                OR EXISTS (SELECT 1 FROM SAIDA_PRODUTO SP WHERE SP.ID_SAIDA = S.ID AND SP.SYNK_DASH_PEND = 'S')
+                OR EXISTS (SELECT 1 FROM SAIDA_FORMAPAG SF WHERE SF.ID_SAIDA = S.ID AND SF.SYNK_DASH_PEND = 'S')
+            )
+        """)
+        vendas = [r for r in cursor.fetchall() if r[0] not in transito][:TAMANHO_LOTE]
+        if not vendas:
+            conn.close()
+            return False
+        cols_venda = [d[0] for d in cursor.description][1:]
+
+        documentos = {}
+        chaves = {"SAIDA": [], "SAIDA_PRODUTO": [], "SAIDA_FORMAPAG": []}
+        for r in vendas:
+            capa = row_to_dict(r[1:], cols_venda, r[0])
+            documentos[capa['id_original']] = {"saida": capa, "itens": [], "pagamentos": []}
+            chaves["SAIDA"].append(r[0])
+
+        ids = [r[1] for r in vendas]
+        marcadores = ", ".join(["?"] * len(ids))
+        for tabela, destino in (("SAIDA_PRODUTO", "itens"), ("SAIDA_FORMAPAG", "pagamentos")):
+            cursor.execute(f"SELECT RDB$DB_KEY, {SQL_VENDA[tabela]} FROM {tabela} WHERE ID_SAIDA IN ({marcadores})", ids)
+            linhas = cursor.fetchall()
+            cols = [d[0] for d in cursor.description][1:]
+            for r in linhas:
+                filho = row_to_dict(r[1:], cols, r[0])
+                doc = documentos.get(filho.get('id_saida'))
+                if doc is None: continue
+                doc[destino].append(filho)
+                chaves[tabela].append(r[0])
+        conn.close()
+
+        payload = list(documentos.values())
+        qtd_itens = sum(len(d["itens"]) for d in payload)
+        print(f"[{hora_atual}] Sincronizando {len(payload)} vendas ({qtd_itens} itens)...", end=" ", flush=True)
+        if enviar_vendas(payload, chaves):
+            print("✅")
+        else:
+            print("❌")
+        time.sleep(DELAY_ENTRE_LOTES)
+        return True
+    except Exception as e:
+        if conn: conn.close()
+        print(f"Erro ao ler vendas: {e}")
+    return False
+
+# --- RECONCILIAÇÃO (DIGESTOS POR FAIXA) ---
+# Mesma assinatura de venda do servidor (server/reconciliacao.py):
+#   id:eliminado:normal:total:qtd_itens:itens:qtd_pagamentos:pagamentos
+# valores em centavos a partir do texto que o agente envia (limpar_valor).
+# A leitura é uma só no Firebird local; para a nuvem vão só os digestos
+# (mes -> dia -> venda) e voltam só as chaves que não batem.
+
+RECONCILIAR_MAX_VENDAS = 2000   # Digestos de venda por requisição (o servidor aceita até 5000)
+
+def centavos(val):
+    val = limpar_valor(val)
+    if val is None: return 0
+    return int((decimal.Decimal(str(val).replace(',', '.')) * 100).quantize(decimal.Decimal(1), rounding=decimal.ROUND_HALF_UP))
+
+def texto(val):
+    val = limpar_valor(val)
+    return "" if val is None else str(val)
+
+def vendas_locais(cursor, inicio, fim):
+    """ [(id, id do Firebird, dia, centavos, assinatura)] das vendas do período, em ordem de id. """
+    filhos = {}
+    for tabela, coluna in (("SAIDA_PRODUTO", "TOTAL"), ("SAIDA_FORMAPAG", "VALOR")):
+        soma = filhos[tabela] = {}
+        cursor.execute(f"""
+            SELECT F.ID_SAIDA, F.{coluna} FROM {tabela} F
+            JOIN SAIDA S ON S.ID = F.ID_SAIDA
+            WHERE S.DATA >= ? AND S.DATA < ?
+        """, (inicio, fim + timedelta(days=1)))
+        for id_saida, valor in cursor.fetchall():
+            atual = soma.setdefault(texto(id_saida), [0, 0])
+            atual[0] += 1
+            atual[1] += centavos(valor)
+
+    cursor.execute("SELECT ID, DATA, ELIMINADO, NORMAL, TOTAL FROM SAIDA WHERE DATA >= ? AND DATA < ?",
+                   (inicio, fim + timedelta(days=1)))
+    vendas = []
+    for id_fb, data, eliminado, normal, total in cursor.fetchall():
+        id_venda = texto(id_fb)
+        itens = filhos["SAIDA_PRODUTO"].get(id_venda, [0, 0])
+        pagamentos = filhos["SAIDA_FORMAPAG"].get(id_venda, [0, 0])
+        valor = centavos(total)
+        assinatura = ":".join(str(x) for x in (id_venda, texto(eliminado), texto(normal), valor, *itens, *pagamentos))
+        dia = data.date() if isinstance(data, datetime) else data
+        vendas.append((id_venda, id_fb, dia, valor, assinatura))
+    vendas.sort(key=lambda v: v[0])
+    return vendas
+
+def digestos(vendas, nivel):
+    """ {chave: [vendas, centavos, md5]} no nível; a lista já vem em ordem de id. """
+    faixas = {}
+    for v in vendas:
+        chave = {"mes": v[2].strftime("%Y-%m"), "dia": v[2].isoformat(), "venda": v[0]}[nivel]
+        faixas.setdefault(chave, []).append(v)
+    return {chave: [len(lista), sum(v[3] for v in lista), hashlib.md5("\n".join(v[4] for v in lista).encode("utf-8")).hexdigest()]
+            for chave, lista in faixas.items()}
+
+def consultar_reconciliacao(nivel, inicio, fim, vendas, id_de=None, id_ate=None):
+    """ Resposta do servidor ({divergentes, ausentes, sobrando}) ou None se falhou. """
+    corpo = {"nivel": nivel, "data_inicio": inicio.isoformat(), "data_fim": fim.isoformat(), "digestos": digestos(vendas, nivel)}
+    if id_de is not None: corpo["id_de"] = id_de
+    if id_ate is not None: corpo["id_ate"] = id_ate
+    try:
+        r = requests.post(f"{API_URL}/api/sync/reconciliar", json=corpo,
+                          headers={"Authorization": f"Bearer {TOKEN}"}, timeout=TIMEOUT_API)
+        if r.status_code == 200: return r.json()
+        print(f"\n   [RECONCILIAÇÃO {r.status_code}]: {r.text[:150]}")
+    except Exception as e:
+        print(f"\n   [ERRO RECONCILIAÇÃO]: {e}")
+    return None
+
+def remarcar(cursor, ids_fb):
+    """ SYNK_DASH_PEND = 'S' na venda, itens e pagamentos: o ciclo normal reenvia. """
+    parametros = [(x,) for x in ids_fb]
+    cursor.executemany("UPDATE SAIDA SET SYNK_DASH_PEND = 'S' WHERE ID = ?", parametros)
+    cursor.executemany("UPDATE SAIDA_PRODUTO SET SYNK_DASH_PEND = 'S' WHERE ID_SAIDA = ?", parametros)
+    cursor.executemany("UPDATE SAIDA_FORMAPAG SET SYNK_DASH_PEND = 'S' WHERE ID_SAIDA = ?", parametros)
+
+def faixas_de_vendas(lista):
+    """
+    Dia grande em faixas de até RECONCILIAR_MAX_VENDAS vendas: [(de, ate, vendas)]
+    com ids em [de, ate), contíguas (a primeira sem início, a última sem fim),
+    para que uma venda só da nuvem caia em alguma faixa.
+    """
+    blocos = [lista[i:i + RECONCILIAR_MAX_VENDAS] for i in range(0, len(lista), RECONCILIAR_MAX_VENDAS)] or [[]]
+    return [(None if i == 0 else bloco[0][0],
+             blocos[i + 1][0][0] if i + 1 < len(blocos) else None,
+             bloco) for i, bloco in enumerate(blocos)]
+
+def executar_reconciliacao():
+    """
+    Desce mes -> dia -> venda só nas faixas divergentes e remarca as vendas
+    que diferem ou faltam na nuvem. Uma consulta que falha só deixa a sua
+    faixa para a próxima passada. Devolve quantas foram remarcadas.
+    """
+    hora_atual = datetime.now().strftime("%H:%M:%S")
+    fim = date.today()
+    inicio = max(date.fromisoformat(DATA_CORTE[:10]), fim - timedelta(days=RECONCILIAR_DIAS - 1))
+    conn = get_connection()
+    if not conn: return 0
+
+    try:
+        cursor = conn.cursor()
+        vendas = vendas_locais(cursor, inicio, fim)
+        remarcar_ids, sobrando, falhas = [], 0, 0
+        pendentes = [("mes", inicio, fim, vendas, None, None)]
+        while pendentes:
+            nivel, ini, fi, lista, id_de, id_ate = pendentes.pop()
+            resposta = consultar_reconciliacao(nivel, ini, fi, lista, id_de, id_ate)
+            if resposta is None:
+                falhas += 1
+                continue
+            divergentes, ausentes = set(resposta["divergentes"]), set(resposta["ausentes"])
+            if nivel == "venda":
+                sobrando += len(resposta["sobrando"])
+                remarcar_ids += [v[1] for v in lista if v[0] in divergentes or v[0] in ausentes]
+                continue
+            # Faixa que a nuvem não tem: remarca inteira, sem descer
+            chave = (lambda v: v[2].strftime("%Y-%m")) if nivel == "mes" else (lambda v: v[2].isoformat())
+            remarcar_ids += [v[1] for v in lista if chave(v) in ausentes]
+            for faixa in sorted(divergentes):
+                filhas = [v for v in lista if chave(v) == faixa]
+                if nivel == "mes":
+                    primeiro = date.fromisoformat(faixa + "-01")
+                    ultimo = (primeiro + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+                    pendentes.append(("dia", max(primeiro, inicio), min(ultimo, fim), filhas, None, None))
+                else:
+                    dia = date.fromisoformat(faixa)
+                    # Limite de digestos por requisição do servidor: dia grande vai em faixas de id
+                    for de, ate, bloco in faixas_de_vendas(filhas):
+                        pendentes.append(("venda", dia, dia, bloco, de, ate))
+
+        if remarcar_ids:
+            remarcar(cursor, remarcar_ids)
+            conn.commit()
+        conn.close()
+        if remarcar_ids or sobrando or falhas:
+            print(f"\n[{hora_atual}] Reconciliação: {len(remarcar_ids)} vendas remarcadas para reenvio"
+                  f"{f', {sobrando} só na nuvem' if sobrando else ''}"
+                  f"{f', {falhas} consultas falharam (ficam para a próxima)' if falhas else ''}")
+        return len(remarcar_ids)
+    except Exception as e:
+        if conn: conn.close()
+        print(f"Erro na reconciliação: {e}")
+    return 0
+
 def configurar_estrutura_banco():
     print(f"\n--- Agente Sync Dashboard v{VERSAO} ---")
     conn = get_connection()
@@ -229,10 +579,22 @@ def configurar_estrutura_banco():
 if __name__ == "__main__":
     configurar_estrutura_banco()
     print(f"Sincronismo Ativo. Pressione CTRL+C para encerrar.\n")
+    ultima_reconciliacao = 0
 
     while True:
         try:
-            if not executar_ciclo_sync():
+            if _lotes_na_fila: acompanhar_fila()
+            encontrou = False
+            # Fila do servidor no limite: só acompanha até os lotes serem aplicados
+            if len(_lotes_na_fila) < MAX_LOTES_NA_FILA:
+                encontrou = executar_ciclo_sync()
+                if VENDAS_DOCUMENTO:
+                    encontrou = executar_ciclo_vendas() or encontrou
+            # Reconcilia só com a fila vazia: pendente em trânsito apareceria como divergência
+            if not encontrou and not _lotes_na_fila and RECONCILIAR_HORAS > 0 and time.time() - ultima_reconciliacao >= RECONCILIAR_HORAS * 3600:
+                ultima_reconciliacao = time.time()
+                encontrou = executar_reconciliacao() > 0
+            if not encontrou and not _lotes_na_fila:
                 sys.stdout.write(".")
                 sys.stdout.flush()
                 time.sleep(DELAY_OCIOSO)
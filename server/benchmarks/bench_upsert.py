@@ -0,0 +1,98 @@
+"""
+Benchmark do upsert de sincronização: linha a linha (antigo) x lote (bulk_upsert).
+
+Uso (a partir de server/, com um Postgres local acessível pelas variáveis DB_*):
+    python benchmarks/bench_upsert.py --linhas 500 --rodadas 5
+
+Cria o schema descartável 'bench_upsert' e o remove ao final.
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bulk_upsert
+from database_utils import get_db_connection, get_sql_novo_cliente
+
+SCHEMA = "bench_upsert"
+TABELA = "saida_produto"
+
+
+def gerar_lote(qtd, prefixo):
+    return [{
+        "id_original": f"{prefixo}{i}",
+        "id_saida": str(i // 5),
+        "id_produto": str(i % 300),
+        "id_vendedor": "1",
+        "quant": "1.000",
+        "total": f"{(i % 97) + 0.5:.2f}",
+    } for i in range(qtd)]
+
+
+def upsert_linha_a_linha(cursor, dados):
+    """ Reprodução do laço antigo de upsert_generico: um INSERT por linha. """
+    for item in dados:
+        campos = [k for k in item.keys() if k != 'id']
+        valores = [str(item[k]) if item[k] is not None else None for k in campos]
+        placeholders = ", ".join(["%s"] * len(valores))
+        update_set = ", ".join([f"{c} = EXCLUDED.{c}" for c in campos if c != 'id_original'])
+        cursor.execute(f"""
+            INSERT INTO {SCHEMA}.{TABELA} ({", ".join(campos)})
+            VALUES ({placeholders})
+            ON CONFLICT (id_original) DO UPDATE SET {update_set}, modificado_em = NOW()
+        """, valores)
+
+
+def upsert_lote(modo):
+    def _executar(cursor, dados):
+        bulk_upsert.SYNC_BULK_MODO = modo
+        bulk_upsert.aplicar_lote(cursor, SCHEMA, TABELA, dados)
+    return _executar
+
+
+def medir(conn, nome, funcao, linhas, rodadas):
+    cursor = conn.cursor()
+    tempos = []
+    for _ in range(rodadas):
+        # Metade das linhas é nova e metade já existe (insert + update)
+        prefixo = uuid.uuid4().hex[:8]
+        dados = gerar_lote(linhas // 2, prefixo) + gerar_lote(linhas - linhas // 2, "fixo_")
+        inicio = time.perf_counter()
+        funcao(cursor, dados)
+        conn.commit()
+        tempos.append(time.perf_counter() - inicio)
+    melhor = min(tempos)
+    media = sum(tempos) / len(tempos)
+    print(f"{nome:<14} média {media * 1000:8.1f} ms | melhor {melhor * 1000:8.1f} ms | {linhas / media:10.0f} linhas/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--linhas", type=int, default=500)
+    parser.add_argument("--rodadas", type=int, default=5)
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cursor.execute(get_sql_novo_cliente(SCHEMA))
+        cursor.execute(f"ALTER TABLE {SCHEMA}.{TABELA} ADD COLUMN IF NOT EXISTS id_vendedor TEXT")
+        conn.commit()
+
+        print(f"Lote de {args.linhas} linhas em {TABELA}, {args.rodadas} rodadas\n")
+        medir(conn, "linha a linha", upsert_linha_a_linha, args.linhas, args.rodadas)
+        medir(conn, "lote (values)", upsert_lote("values"), args.linhas, args.rodadas)
+        medir(conn, "lote (copy)", upsert_lote("copy"), args.linhas, args.rodadas)
+    finally:
+        conn.rollback()
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
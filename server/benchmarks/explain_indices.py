@@ -0,0 +1,159 @@
+"""
+Regressão de planos: os relatórios brutos usam índice no período, não seq scan.
+
+Uso (a partir de server/, com um Postgres local acessível pelas variáveis DB_*):
+    python benchmarks/explain_indices.py --vendas 300000
+
+Cria o schema descartável 'bench_indices' (estrutura de loja nova, com os
+índices de indices_relatorios.py), gera vendas espalhadas em dois anos com
+itens e pagamentos, roda os cards e todos os rankings (e os comparativos)
+pelas tabelas brutas (sem resumo) para períodos curtos e confere com
+EXPLAIN que saida, saida_produto e saida_formapag são lidas por índice. Sai com código 1 se
+algum plano tiver Seq Scan nessas tabelas.
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database_utils import get_db_connection, get_sql_novo_cliente
+from routers import reports
+import schema_cache
+
+SCHEMA = "bench_indices"
+TABELAS_VIGIADAS = ("saida", "saida_produto", "saida_formapag")
+RANKINGS = ["produto", "hora", "dia", "pagamento", "terminal", "usuario", "secao", "grupo",
+            "fabricante", "fornecedor", "cliente", "vendedor"]
+
+
+class CursorExplain:
+    """ Cursor que, antes de cada consulta de relatório, guarda o plano dela. """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.planos = []
+
+    def __getattr__(self, nome):
+        return getattr(self._cursor, nome)
+
+    def execute(self, sql, params=None):
+        if sql.lstrip().upper().startswith("SELECT") and f"{SCHEMA}.saida" in sql:
+            self._cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            self.planos.append((sql, self._cursor.fetchone()[0][0]["Plan"]))
+        return self._cursor.execute(sql, params)
+
+
+def varreduras(plano):
+    """ [(tipo do nó, tabela)] de todos os nós que leem uma tabela. """
+    lista = []
+    if "Relation Name" in plano:
+        lista.append((plano["Node Type"], plano["Relation Name"]))
+    for filho in plano.get("Plans", []):
+        lista += varreduras(filho)
+    return lista
+
+
+def gerar_dados(cursor, vendas, dias):
+    cursor.execute(f"ALTER TABLE {SCHEMA}.saida ADD COLUMN IF NOT EXISTS normal VARCHAR(1)")
+    cursor.execute(f"ALTER TABLE {SCHEMA}.saida_produto ADD COLUMN IF NOT EXISTS id_vendedor VARCHAR(50)")
+    cursor.execute(f"""
+        INSERT INTO {SCHEMA}.produto (id_original, nome, custo_total, id_grupo, id_fabricante, id_fornecedor)
+        SELECT g::text, 'Produto ' || g, (g % 50) + 0.5, (g % 40)::text, (g % 30)::text, (g % 20)::text
+        FROM generate_series(1, 2000) g
+    """)
+    cursor.execute(f"INSERT INTO {SCHEMA}.grupo (id_original, nome, id_secao) SELECT g::text, 'Grupo ' || g, (g % 5)::text FROM generate_series(0, 39) g")
+    cursor.execute(f"INSERT INTO {SCHEMA}.secao (id_original, nome) SELECT g::text, 'Seção ' || g FROM generate_series(0, 4) g")
+    cursor.execute(f"INSERT INTO {SCHEMA}.fabricante (id_original, nome) SELECT g::text, 'Fabricante ' || g FROM generate_series(0, 29) g")
+    cursor.execute(f"INSERT INTO {SCHEMA}.cliente (id_original, nome) SELECT g::text, 'Cliente ' || g FROM generate_series(0, 499) g")
+    cursor.execute(f"INSERT INTO {SCHEMA}.vendedor (id_original, nome) SELECT g::text, 'Vendedor ' || g FROM generate_series(0, 9) g")
+    cursor.execute(f"INSERT INTO {SCHEMA}.usuario_pdv (id_original, nome) SELECT g::text, 'Operador ' || g FROM generate_series(0, 9) g")
+    cursor.execute(f"INSERT INTO {SCHEMA}.formapag (id_original, nome) SELECT g::text, 'Forma ' || g FROM generate_series(0, 5) g")
+    cursor.execute(f"""
+        INSERT INTO {SCHEMA}.saida (id_original, data, hora, total, id_cliente, terminal, id_usuario, eliminado, normal)
+        SELECT g::text,
+               CURRENT_DATE - (g %% %s) + make_interval(secs => (g * 37) %% 86400),
+               make_time(((g * 37) %% 86400) / 3600, 0, 0),
+               (g %% 300) + 0.99, (g %% 500)::text, (g %% 8)::text, (g %% 10)::text,
+               CASE WHEN g %% 20 = 0 THEN 'S' ELSE 'N' END, 'S'
+        FROM generate_series(1, %s) g
+    """, (dias, vendas))
+    cursor.execute(f"""
+        INSERT INTO {SCHEMA}.saida_produto (id_original, id_saida, id_produto, id_vendedor, quant, total)
+        SELECT s || '-' || i, s::text, ((s * 7 + i) %% 2000 + 1)::text, (s %% 10)::text, 1 + i, (s %% 100) + 0.5
+        FROM generate_series(1, %s) s, generate_series(1, 3) i
+    """, (vendas,))
+    cursor.execute(f"""
+        INSERT INTO {SCHEMA}.saida_formapag (id_saida, id_formapag, valor)
+        SELECT s::text, (s %% 6)::text, (s %% 300) + 0.99 FROM generate_series(1, %s) s
+    """, (vendas,))
+    # Sem cobertura de resumo: os relatórios vão às tabelas brutas
+    cursor.execute(f"DELETE FROM {SCHEMA}.resumo_cobertura")
+    for tabela in ("saida", "saida_produto", "saida_formapag", "produto"):
+        cursor.execute(f"ANALYZE {SCHEMA}.{tabela}")
+
+
+def verificar_planos(conn, vendas: int, dias: int):
+    """
+    Cria o schema descartável, gera os dados e roda os relatórios sob EXPLAIN.
+    Devolve (consultas verificadas, [(período, sql, plano, tabelas com Seq Scan)]).
+    """
+    cursor = conn.cursor()
+    verificadas, falhas = 0, []
+    try:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cursor.execute(get_sql_novo_cliente(SCHEMA))
+        gerar_dados(cursor, vendas, dias)
+        conn.commit()
+        schema_cache.invalidar(SCHEMA)
+
+        ontem = date.today() - timedelta(days=1)
+        for nome, inicio in (("1 dia", ontem), ("7 dias", ontem - timedelta(days=6))):
+            explain = CursorExplain(conn.cursor())
+            reports.calcular_cards(explain, SCHEMA, inicio, ontem)
+            for tipo in RANKINGS:
+                reports.calcular_ranking(explain, SCHEMA, tipo, inicio, ontem, 20)
+            # Comparativos: os dois períodos numa varredura (OR de intervalos)
+            anterior = reports.periodo_anterior(inicio, ontem)
+            reports.calcular_cards(explain, SCHEMA, inicio, ontem, anterior)
+            for tipo in RANKINGS:
+                if tipo != "dia": reports.calcular_ranking(explain, SCHEMA, tipo, inicio, ontem, 20, anterior)
+            conn.rollback()
+
+            verificadas += len(explain.planos)
+            for sql, plano in explain.planos:
+                seq = [t for n, t in varreduras(plano) if n == "Seq Scan" and t in TABELAS_VIGIADAS]
+                if seq: falhas.append((nome, sql, plano, seq))
+    finally:
+        conn.rollback()
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.commit()
+        schema_cache.invalidar(SCHEMA)
+    return verificadas, falhas
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vendas", type=int, default=300000)
+    parser.add_argument("--dias", type=int, default=730, help="Vendas espalhadas nos últimos N dias")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        print(f"Gerando {args.vendas} vendas em {args.dias} dias...")
+        verificadas, falhas = verificar_planos(conn, args.vendas, args.dias)
+    finally:
+        conn.close()
+
+    for nome, sql, plano, seq in falhas:
+        print(f"[{nome}] FALHOU: Seq Scan em {', '.join(seq)}\n{' '.join(sql.split())}\n"
+              f"{json.dumps(plano, indent=1)[:2000]}\n")
+    print(f"{verificadas} consultas verificadas")
+    print("OK: todos os planos usam índice" if not falhas else f"{len(falhas)} plano(s) com Seq Scan")
+    sys.exit(1 if falhas else 0)
+
+
+if __name__ == "__main__":
+    main()
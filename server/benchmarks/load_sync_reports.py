@@ -0,0 +1,90 @@
+"""
+Teste de carga: latência dos relatórios com e sem a ingestão saturada.
+
+Com a API rodando (uvicorn main:app) e uma loja de teste criada:
+    python benchmarks/load_sync_reports.py --url http://localhost:8000/api --token <t1>,<t2>,... --agentes 20
+
+Fase 1 mede /reports/dashboard-cards sozinho; fase 2 repete a medição com
+N "agentes" enviando lotes para /sync/saida_produto sem pausa. Com o sync
+fora do event loop o p99 dos relatórios deve ficar praticamente igual.
+Lotes da mesma loja são aplicados em fila; passe vários tokens (um por loja)
+para medir a vazão com agentes de lojas diferentes em paralelo.
+Os lotes usam ids com prefixo 'carga_' (apague-os depois se for uma loja real).
+"""
+import argparse
+import threading
+import time
+import uuid
+from datetime import date
+
+import requests
+
+
+def percentil(valores, p):
+    if not valores: return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+def medir_relatorios(args, parar, latencias):
+    sessao = requests.Session()
+    headers = {"Authorization": f"Bearer {args.tokens[0]}"}
+    hoje = date.today().isoformat()
+    while not parar.is_set():
+        inicio = time.perf_counter()
+        r = sessao.get(f"{args.url}/reports/dashboard-cards",
+                       params={"data_inicio": "2000-01-01", "data_fim": hoje}, headers=headers, timeout=120)
+        if r.status_code == 200:
+            latencias.append(time.perf_counter() - inicio)
+
+
+def agente(args, parar, contadores, token):
+    sessao = requests.Session()
+    headers = {"Authorization": f"Bearer {token}"}
+    while not parar.is_set():
+        prefixo = f"carga_{uuid.uuid4().hex[:10]}_"
+        lote = [{"id_original": f"{prefixo}{i}", "id_saida": f"{prefixo}{i // 5}", "id_produto": "1",
+                 "quant": "1", "total": "9.90"} for i in range(args.lote)]
+        r = sessao.post(f"{args.url}/sync/saida_produto", json=lote, headers=headers, timeout=120)
+        if r.status_code == 200:
+            contadores["linhas"] += args.lote
+        else:
+            contadores["erros"] += 1
+
+
+def fase(nome, args, agentes):
+    parar = threading.Event()
+    latencias = []
+    contadores = {"linhas": 0, "erros": 0}
+    threads = [threading.Thread(target=medir_relatorios, args=(args, parar, latencias))]
+    threads += [threading.Thread(target=agente, args=(args, parar, contadores, args.tokens[i % len(args.tokens)]))
+                for i in range(agentes)]
+    for t in threads: t.start()
+    time.sleep(args.duracao)
+    parar.set()
+    for t in threads: t.join()
+
+    print(f"{nome:<22} relatórios: {len(latencias):5d} req | "
+          f"p50 {percentil(latencias, 50) * 1000:8.1f} ms | p99 {percentil(latencias, 99) * 1000:8.1f} ms", end="")
+    if agentes:
+        print(f" | sync {contadores['linhas'] / args.duracao:8.0f} linhas/s ({contadores['erros']} erros)")
+    else:
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000/api")
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--agentes", type=int, default=20)
+    parser.add_argument("--lote", type=int, default=500)
+    parser.add_argument("--duracao", type=int, default=30)
+    args = parser.parse_args()
+    args.tokens = [t.strip() for t in args.token.split(",") if t.strip()]
+
+    fase("sem sync", args, 0)
+    fase(f"sync com {args.agentes} agentes", args, args.agentes)
+
+
+if __name__ == "__main__":
+    main()
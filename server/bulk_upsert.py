@@ -0,0 +1,213 @@
+import io
+import os
+from typing import List
+
+from psycopg2.extras import execute_values
+
+import schema_cache
+import particionamento
+
+# Arquivo: server/bulk_upsert.py
+# Motor de ingestão em lote: o lote inteiro vai para uma tabela temporária
+# (COPY) e é aplicado com um único INSERT ... SELECT ... ON CONFLICT.
+# Tabelas particionadas (particionamento.py) não têm índice único em
+# id_original: o lote é aplicado com UPDATE + INSERT a partir da staging.
+
+# "copy" (padrão) ou "values" (INSERT multi-linha via execute_values),
+# útil atrás de poolers/proxies que não repassam COPY.
+SYNC_BULK_MODO = os.getenv("SYNC_BULK_MODO", "copy").lower()
+
+
+def colunas_do_lote(dados: List[dict]):
+    """
+    União ordenada das chaves de todas as linhas (sem o 'id' do Firebird):
+    as colunas que a tabela precisa ter para receber o lote.
+    """
+    colunas = []
+    vistas = set()
+    for item in dados:
+        for k in item.keys():
+            if k != 'id' and k not in vistas:
+                vistas.add(k)
+                colunas.append(k)
+    return colunas
+
+
+def deduplicar_lote(dados: List[dict]):
+    """
+    Mantém a última ocorrência de cada id_original (mesma semântica do antigo
+    upsert linha a linha). Um mesmo INSERT ... ON CONFLICT não pode tocar a
+    mesma linha duas vezes.
+    """
+    por_id = {}
+    sem_id = []
+    for item in dados:
+        chave = item.get('id_original')
+        if chave is None:
+            sem_id.append(item)
+        else:
+            por_id.pop(chave, None)
+            por_id[chave] = item
+    return list(por_id.values()) + sem_id
+
+
+def grupos_do_lote(linhas: List[dict]):
+    """
+    [(colunas, linhas)] agrupando as linhas pelo conjunto de chaves que cada
+    uma trouxe. Cada grupo vira um merge próprio: uma coluna ausente na linha
+    não entra no SET e o valor gravado é preservado (como no antigo upsert
+    linha a linha), em vez de virar NULL pela união das colunas do lote.
+    """
+    grupos = {}
+    for item in linhas:
+        colunas = tuple(k for k in item.keys() if k != 'id')
+        grupos.setdefault(frozenset(colunas), (list(colunas), []))[1].append(item)
+    return list(grupos.values())
+
+
+def _valor_texto(valor):
+    if valor is None: return None
+    return str(valor)
+
+
+def _valor_copy(valor):
+    if valor is None: return "\\N"
+    return (str(valor).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def _sql_update_set(colunas):
+    update_set = ", ".join([f"{c} = EXCLUDED.{c}" for c in colunas if c != 'id_original'])
+    if update_set: return update_set + ", modificado_em = NOW()"
+    return "modificado_em = NOW()"
+
+
+def _sql_mudou(colunas):
+    """
+    Guarda do DO UPDATE: só reescreve a linha se alguma coluna sincronizada
+    mudou. Reenvios idênticos (trigger do Firebird remarcando o registro)
+    não geram nova versão da tupla nem mexem em modificado_em.
+    """
+    dados = [c for c in colunas if c != 'id_original']
+    if not dados: return "FALSE"
+    return f"({', '.join(f't.{c}' for c in dados)}) IS DISTINCT FROM ({', '.join(f'EXCLUDED.{c}' for c in dados)})"
+
+
+def _sql_merge(schema, tabela, colunas, origem):
+    """
+    INSERT ... ON CONFLICT que devolve (inseridos, atualizados).
+    xmax = 0 na linha retornada indica INSERT; linhas barradas pela guarda
+    não voltam no RETURNING.
+    """
+    cols = ", ".join(colunas)
+    return f"""
+        WITH aplicadas AS (
+            INSERT INTO {schema}.{tabela} AS t ({cols})
+            {origem}
+            ON CONFLICT (id_original) DO UPDATE SET {_sql_update_set(colunas)}
+            WHERE {_sql_mudou(colunas)}
+            RETURNING (t.xmax = 0) AS inserida
+        )
+        SELECT COUNT(*) FILTER (WHERE inserida), COUNT(*) FILTER (WHERE NOT inserida) FROM aplicadas
+    """
+
+
+def _sql_merge_particionada(schema, tabela, colunas, stg):
+    """
+    Mesma semântica do ON CONFLICT (id_original) sem índice único: atualiza
+    as linhas existentes que mudaram (podendo trocar de partição) e insere
+    as que não existem. Devolve (inseridos, atualizados).
+    """
+    cols = ", ".join(colunas)
+    dados = [c for c in colunas if c != 'id_original']
+    update_set = ", ".join([f"{c} = o.{c}" for c in dados] + ["modificado_em = NOW()"])
+    mudou = _sql_mudou(colunas).replace("EXCLUDED.", "o.")
+    return f"""
+        WITH atualizadas AS (
+            UPDATE {schema}.{tabela} AS t SET {update_set}
+            FROM {stg} o
+            WHERE t.id_original = o.id_original AND {mudou}
+            RETURNING 1
+        ), inseridas AS (
+            INSERT INTO {schema}.{tabela} ({cols})
+            SELECT {cols} FROM {stg} o
+            WHERE o.id_original IS NULL
+               OR NOT EXISTS (SELECT 1 FROM {schema}.{tabela} t WHERE t.id_original = o.id_original)
+            RETURNING 1
+        )
+        SELECT (SELECT COUNT(*) FROM inseridas), (SELECT COUNT(*) FROM atualizadas)
+    """
+
+
+def _criar_staging(cursor, schema, tabela, colunas, linhas, modo="copy"):
+    cols = ", ".join(colunas)
+    stg = f"stg_{tabela}"
+
+    # Staging com os mesmos tipos do destino e sem constraints
+    cursor.execute(f"DROP TABLE IF EXISTS pg_temp.{stg}")
+    cursor.execute(f"CREATE TEMP TABLE {stg} ON COMMIT DROP AS SELECT {cols} FROM {schema}.{tabela} WITH NO DATA")
+
+    if modo == "values":
+        valores = [tuple(_valor_texto(item.get(c)) for c in colunas) for item in linhas]
+        execute_values(cursor, f"INSERT INTO {stg} ({cols}) VALUES %s", valores, page_size=len(valores))
+        return stg
+
+    buffer = io.StringIO()
+    for item in linhas:
+        buffer.write("\t".join(_valor_copy(item.get(c)) for c in colunas))
+        buffer.write("\n")
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {stg} ({cols}) FROM STDIN", buffer)
+    return stg
+
+
+def _aplicar_copy(cursor, schema, tabela, colunas, linhas):
+    stg = _criar_staging(cursor, schema, tabela, colunas, linhas)
+    cursor.execute(_sql_merge(schema, tabela, colunas, f"SELECT {', '.join(colunas)} FROM {stg}"))
+    return cursor.fetchone()
+
+
+def _aplicar_particionada(cursor, schema, tabela, colunas, linhas):
+    stg = _criar_staging(cursor, schema, tabela, colunas, linhas, SYNC_BULK_MODO)
+    colunas = particionamento.preparar_staging(cursor, schema, tabela, stg, colunas)
+    # Sem índice único, quem garante um id_original por loja é esta trava
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"{schema}:merge:{tabela}",))
+    cursor.execute(_sql_merge_particionada(schema, tabela, colunas, stg))
+    inseridos, atualizados = cursor.fetchone()
+    particionamento.realinhar_derivadas(cursor, schema, tabela, stg)
+    return inseridos, atualizados
+
+
+def _aplicar_values(cursor, schema, tabela, colunas, linhas):
+    valores = [tuple(_valor_texto(item.get(c)) for c in colunas) for item in linhas]
+    # Página única: o lote inteiro vira um só comando e o SELECT final conta tudo
+    execute_values(cursor, _sql_merge(schema, tabela, colunas, "VALUES %s"), valores, page_size=len(valores))
+    return cursor.fetchone()
+
+
+def aplicar_lote(cursor, schema: str, tabela: str, dados: List[dict]):
+    """
+    Aplica o lote na tabela do tenant usando o cursor (e a transação) do chamador.
+    A tabela já deve existir com todas as colunas do lote e o índice único em
+    id_original (ou ser particionada).
+    Retorna {"inseridos", "atualizados", "ignorados"} sobre as linhas distintas
+    do lote (ignorados = já estavam iguais no banco).
+    """
+    if not dados: return {"inseridos": 0, "atualizados": 0, "ignorados": 0}
+
+    linhas = deduplicar_lote(dados)
+    particionada = particionamento.particionada(schema_cache.obter_tabela(cursor, schema, tabela))
+
+    inseridos = atualizados = 0
+    # Lote homogêneo (o caso do agente): um único grupo, um único merge
+    for colunas, grupo in grupos_do_lote(linhas):
+        if particionada:
+            i, a = _aplicar_particionada(cursor, schema, tabela, colunas, grupo)
+        elif SYNC_BULK_MODO == "values":
+            i, a = _aplicar_values(cursor, schema, tabela, colunas, grupo)
+        else:
+            i, a = _aplicar_copy(cursor, schema, tabela, colunas, grupo)
+        inseridos += i
+        atualizados += a
+    return {"inseridos": inseridos, "atualizados": atualizados,
+            "ignorados": len(linhas) - inseridos - atualizados}
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import schema_cache
+
+try:
+    import redis
+except ImportError:  # Opcional: sem o pacote, só o cache em memória
+    redis = None
+
+# Arquivo: server/cache_relatorios.py
+# Cache de resultados dos relatórios, chave (schema, endpoint, parâmetros).
+#
+# Cada tenant tem versões por dia em {schema}.versao_dados, incrementadas na
+# transação do sync/deleção para os dias de venda tocados (a linha
+# '-infinity' é a versão global, para cadastros que afetam qualquer período).
+# A versão de um período = versão global + soma das versões dos dias do
+# período: só muda quando algum dia dentro dele é escrito. Uma entrada só é
+# servida se foi calculada com a mesma versão que o período tem agora.
+#
+# - Em memória: LRU por worker, limitada em entradas e em bytes.
+# - Compartilhado (opcional): Redis em CACHE_RELATORIOS_REDIS_URL. A versão
+#   faz parte da chave, então nada precisa ser invalidado lá: versões velhas
+#   expiram pelo TTL.
+
+CACHE_RELATORIOS_MAX = int(os.getenv("CACHE_RELATORIOS_MAX", "2000"))
+CACHE_RELATORIOS_MAX_MB = float(os.getenv("CACHE_RELATORIOS_MAX_MB", "64"))
+CACHE_RELATORIOS_REDIS_URL = os.getenv("CACHE_RELATORIOS_REDIS_URL", "")
+CACHE_RELATORIOS_REDIS_TTL = int(os.getenv("CACHE_RELATORIOS_REDIS_TTL", "86400"))
+
+_entradas = OrderedDict()   # (schema, chave) -> (versao, valor, bytes)
+_bytes = 0
+_lock = threading.Lock()
+_stats = {"acertos": 0, "acertos_compartilhado": 0, "falhas": 0, "descartes": 0}
+
+_redis = redis.Redis.from_url(CACHE_RELATORIOS_REDIS_URL) if redis and CACHE_RELATORIOS_REDIS_URL else None
+
+
+def sql_tabela_versoes(schema: str) -> str:
+    return f"""
+    CREATE TABLE IF NOT EXISTS {schema}.versao_dados (
+        dia DATE PRIMARY KEY,
+        versao BIGINT NOT NULL DEFAULT 1
+    );
+    """
+
+
+# --- VERSÕES (ESCRITA) ---
+def marcar_alterados(cursor, schema: str, dias=None):
+    """
+    Incrementa a versão dos dias alterados (ou a global, se dias=None) na
+    transação do chamador.
+    """
+    if dias is not None:
+        dias = sorted(d for d in dias if d is not None)
+        if not dias: return
+    if schema_cache.obter_tabela(cursor, schema, "versao_dados") is None:
+        cursor.execute(sql_tabela_versoes(schema))
+        schema_cache.carregar_tabela(cursor, schema, "versao_dados")
+        # Entregue no commit: os outros workers param de responder sem versão
+        schema_cache.publicar_alteracao(cursor, schema)
+    cursor.execute(f"""
+        INSERT INTO {schema}.versao_dados (dia, versao)
+        SELECT unnest(%s::date[]), 1
+        ON CONFLICT (dia) DO UPDATE SET versao = {schema}.versao_dados.versao + 1
+    """, (dias if dias is not None else ['-infinity'],))
+
+
+# --- VERSÕES (LEITURA) ---
+def versao_periodo(cursor, schema: str, data_inicio, data_fim):
+    """
+    Versão dos dados do período, ou None se a loja ainda não tem a tabela de
+    versões (nesse caso não se usa cache).
+    """
+    if schema_cache.obter_tabela(cursor, schema, "versao_dados") is None: return None
+    cursor.execute(f"""
+        SELECT COALESCE(MAX(versao) FILTER (WHERE dia = '-infinity'), 0),
+               COALESCE(SUM(versao) FILTER (WHERE dia <> '-infinity'), 0)
+        FROM {schema}.versao_dados
+        WHERE dia BETWEEN %s AND %s OR dia = '-infinity'
+    """, (data_inicio, data_fim))
+    global_, dias = cursor.fetchone()
+    return f"{global_}.{dias}"
+
+
+# --- CACHE ---
+def _chave_texto(schema, chave, versao):
+    return f"rel:{schema}:{':'.join(str(c) for c in chave)}:{versao}"
+
+
+def etag(schema: str, chave: tuple, versao: str):
+    """
+    ETag forte do resultado: muda junto com a versão do período ou com os
+    parâmetros. None quando a loja não tem versões.
+    """
+    if versao is None: return None
+    return '"' + hashlib.sha1(_chave_texto(schema, chave, versao).encode()).hexdigest() + '"'
+
+
+def obter(schema: str, chave: tuple, versao: str):
+    """ Resultado guardado para a versão atual do período, ou None. """
+    if versao is None: return None
+    with _lock:
+        entrada = _entradas.get((schema, chave))
+        if entrada and entrada[0] == versao:
+            _entradas.move_to_end((schema, chave))
+            _stats["acertos"] += 1
+            return entrada[1]
+
+    if _redis is not None:
+        try:
+            bruto = _redis.get(_chave_texto(schema, chave, versao))
+        except Exception as e:
+            print(f"Erro cache compartilhado: {e}")
+            bruto = None
+        if bruto is not None:
+            valor = json.loads(bruto)
+            _guardar_local(schema, chave, versao, valor, len(bruto))
+            with _lock: _stats["acertos_compartilhado"] += 1
+            return valor
+
+    with _lock: _stats["falhas"] += 1
+    return None
+
+
+def guardar(schema: str, chave: tuple, versao: str, valor):
+    if versao is None: return
+    bruto = json.dumps(valor, default=str)
+    _guardar_local(schema, chave, versao, valor, len(bruto))
+    if _redis is not None:
+        try:
+            _redis.set(_chave_texto(schema, chave, versao), bruto, ex=CACHE_RELATORIOS_REDIS_TTL)
+        except Exception as e:
+            print(f"Erro cache compartilhado: {e}")
+
+
+def _guardar_local(schema, chave, versao, valor, tamanho):
+    global _bytes
+    limite = CACHE_RELATORIOS_MAX_MB * 1024 * 1024
+    if tamanho > limite: return
+    with _lock:
+        anterior = _entradas.pop((schema, chave), None)
+        if anterior: _bytes -= anterior[2]
+        _entradas[(schema, chave)] = (versao, valor, tamanho)
+        _bytes += tamanho
+        while len(_entradas) > CACHE_RELATORIOS_MAX or _bytes > limite:
+            _, (_, _, t) = _entradas.popitem(last=False)
+            _bytes -= t
+            _stats["descartes"] += 1
+
+
+def invalidar(schema: str = None):
+    """ Descarta as entradas em memória da loja (ou todas). """
+    global _bytes
+    with _lock:
+        for k in [k for k in _entradas if schema is None or k[0] == schema]:
+            _bytes -= _entradas.pop(k)[2]
+
+
+def estatisticas():
+    with _lock:
+        consultas = _stats["acertos"] + _stats["acertos_compartilhado"] + _stats["falhas"]
+        return dict(_stats,
+                    taxa_acerto=round((_stats["acertos"] + _stats["acertos_compartilhado"]) / consultas, 4) if consultas else 0.0,
+                    entradas=len(_entradas), memoria_mb=round(_bytes / 1024 / 1024, 3),
+                    max_entradas=CACHE_RELATORIOS_MAX, max_mb=CACHE_RELATORIOS_MAX_MB,
+                    compartilhado=_redis is not None)
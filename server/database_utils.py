@@ -1,6 +1,7 @@
 import psycopg2
 import os
 import time
+from db_pool import PoolConexoes
 
 # --- CONFIGURAÇÃO ---
 DB_HOST = os.getenv("DB_HOST", "localhost")
@@ -9,7 +10,27 @@ DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASS = os.getenv("DB_PASS", "senha123")
 DB_DSN = f"postgres://{DB_USER}:{DB_PASS}@{DB_HOST}:5432/{DB_NAME}"
 
+# --- POOL DE CONEXÕES ---
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))          # Segundos esperando conexão livre
+DB_POOL_OCIOSO_CHECK = float(os.getenv("DB_POOL_OCIOSO_CHECK", "30")) # Idade mínima para SELECT 1 na retirada
+
+pool = PoolConexoes(DB_DSN, minimo=DB_POOL_MIN, maximo=DB_POOL_MAX,
+                    timeout=DB_POOL_TIMEOUT, ocioso_check=DB_POOL_OCIOSO_CHECK)
+
+def conexao():
+    """
+    Conexão emprestada do pool, para uso com 'with'. Na saída a transação
+    pendente é desfeita e a conexão volta ao pool (ou é descartada se caiu).
+    """
+    return pool.conexao()
+
 def get_db_connection():
+    """
+    Conexão avulsa (fora do pool), com retry. Usada apenas por scripts de
+    manutenção; as rotas usam conexao().
+    """
     max_retries = 15
     for i in range(max_retries):
         try:
@@ -22,6 +43,11 @@ def get_sql_novo_cliente(nome_schema):
     """
     Define a estrutura inicial completa para um novo cliente (Tenant).
     """
+    from tipos_colunas import sql_tabela_rejeitados
+    from resumos import sql_tabelas_resumo, sql_cobertura_inicial
+    from cache_relatorios import sql_tabela_versoes
+    from indices_relatorios import sql_indices
+    from integridade import sql_tabelas_integridade
     return f"""
     CREATE SCHEMA IF NOT EXISTS {nome_schema};
 
@@ -30,11 +56,12 @@ def get_sql_novo_cliente(nome_schema):
         uuid_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
         id_original VARCHAR(50) UNIQUE,
         data TIMESTAMP,
-        total TEXT,
+        total NUMERIC,
         id_cliente VARCHAR(50),
         id_vendedor VARCHAR(50),
         terminal VARCHAR(50),      -- Novo: Caixa/Terminal
         id_usuario VARCHAR(50),    -- Novo: Operador do PDV
+        hora TIME,
         eliminado VARCHAR(1),
         criado_em TIMESTAMP DEFAULT NOW(),
         modificado_em TIMESTAMP DEFAULT NOW()
@@ -46,12 +73,11 @@ def get_sql_novo_cliente(nome_schema):
         id_original VARCHAR(50) UNIQUE,
         id_saida VARCHAR(50),
         id_produto VARCHAR(50),
-        quant TEXT,
-        total TEXT,
+        quant NUMERIC,
+        total NUMERIC,
         criado_em TIMESTAMP DEFAULT NOW(),
         modificado_em TIMESTAMP DEFAULT NOW()
     );
-    CREATE INDEX IF NOT EXISTS idx_sp_saida ON {nome_schema}.saida_produto (id_saida);
     CREATE INDEX IF NOT EXISTS idx_sp_produto ON {nome_schema}.saida_produto (id_produto);
 
     -- 3. Formas de Pagamento
@@ -69,11 +95,10 @@ def get_sql_novo_cliente(nome_schema):
         uuid_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
         id_saida VARCHAR(50),
         id_formapag VARCHAR(50),
-        valor TEXT,
+        valor NUMERIC,
         criado_em TIMESTAMP DEFAULT NOW(),
         modificado_em TIMESTAMP DEFAULT NOW()
     );
-    CREATE INDEX IF NOT EXISTS idx_sf_saida ON {nome_schema}.saida_formapag (id_saida);
 
     -- 5. Cadastros Gerais
     CREATE TABLE IF NOT EXISTS {nome_schema}.cliente (
@@ -91,7 +116,7 @@ def get_sql_novo_cliente(nome_schema):
         uuid_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
         id_original VARCHAR(50) UNIQUE,
         nome VARCHAR(100),
-        comissao TEXT,
+        comissao NUMERIC,
         ativo VARCHAR(1),
         criado_em TIMESTAMP DEFAULT NOW(),
         modificado_em TIMESTAMP DEFAULT NOW()
@@ -143,8 +168,8 @@ def get_sql_novo_cliente(nome_schema):
         uuid_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
         id_original VARCHAR(50) UNIQUE,
         nome VARCHAR(200),
-        preco_venda TEXT,
-        custo_total TEXT,
+        preco_venda NUMERIC,
+        custo_total NUMERIC,
         id_grupo VARCHAR(50),
         id_fabricante VARCHAR(50),
         id_fornecedor VARCHAR(50),
@@ -153,43 +178,100 @@ def get_sql_novo_cliente(nome_schema):
         criado_em TIMESTAMP DEFAULT NOW(),
         modificado_em TIMESTAMP DEFAULT NOW()
     );
+
+    -- 6. Registros recusados na ingestão (valor malformado em coluna tipada)
+    {sql_tabela_rejeitados(nome_schema)}
+
+    -- 7. Resumos diários para os relatórios (ver resumos.py)
+    {sql_tabelas_resumo(nome_schema)}
+    {sql_cobertura_inicial(nome_schema)}
+
+    -- 8. Versões por dia dos dados (cache de relatórios, ver cache_relatorios.py)
+    {sql_tabela_versoes(nome_schema)}
+
+    -- 9. Índices dos relatórios (ver indices_relatorios.py)
+    {sql_indices(nome_schema)}
+
+    -- 10. Problemas de integridade e marca d'água da verificação (ver integridade.py)
+    {sql_tabelas_integridade(nome_schema)}
     """
 
 def init_master_table():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS public.lojas_sincronizadas (
-            id SERIAL PRIMARY KEY,
-            nome_fantasia VARCHAR(100),
-            cnpj VARCHAR(20) UNIQUE,
-            api_token VARCHAR(100),
-            schema_name VARCHAR(50) NOT NULL,
-            ativo BOOLEAN DEFAULT TRUE,
-            criado_em TIMESTAMP DEFAULT NOW()
-        );
-        """)
+    with conexao() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS public.lojas_sincronizadas (
+                id SERIAL PRIMARY KEY,
+                nome_fantasia VARCHAR(100),
+                cnpj VARCHAR(20) UNIQUE,
+                api_token VARCHAR(100),
+                schema_name VARCHAR(50) NOT NULL,
+                ativo BOOLEAN DEFAULT TRUE,
+                criado_em TIMESTAMP DEFAULT NOW()
+            );
+            """)
         
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS public.usuarios (
-            id SERIAL PRIMARY KEY,
-            nome VARCHAR(100),
-            telefone VARCHAR(20) UNIQUE,
-            criado_em TIMESTAMP DEFAULT NOW()
-        );
-        """)
-
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS public.usuarios_lojas (
-            usuario_id INT REFERENCES public.usuarios(id),
-            loja_id INT REFERENCES public.lojas_sincronizadas(id),
-            PRIMARY KEY (usuario_id, loja_id)
-        );
-        """)
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS public.usuarios (
+                id SERIAL PRIMARY KEY,
+                nome VARCHAR(100),
+                telefone VARCHAR(20) UNIQUE,
+                criado_em TIMESTAMP DEFAULT NOW()
+            );
+            """)
+
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS public.usuarios_lojas (
+                usuario_id INT REFERENCES public.usuarios(id),
+                loja_id INT REFERENCES public.lojas_sincronizadas(id),
+                PRIMARY KEY (usuario_id, loja_id)
+            );
+            """)
         
-        conn.commit()
-    except Exception as e:
-        print(f"Erro master table: {e}")
-    finally:
-        conn.close()
\ No newline at end of file
+            # Fila durável de lotes de sync no modo assíncrono (ver fila_ingestao.py)
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS public.fila_ingestao (
+                id BIGSERIAL PRIMARY KEY,
+                schema_name VARCHAR(50) NOT NULL,
+                tipo VARCHAR(50) NOT NULL,
+                corpo BYTEA NOT NULL,
+                content_type VARCHAR(100),
+                content_encoding VARCHAR(20),
+                status VARCHAR(15) NOT NULL DEFAULT 'pendente',
+                tentativas INT NOT NULL DEFAULT 0,
+                resultado JSONB,
+                erro TEXT,
+                criado_em TIMESTAMP DEFAULT NOW(),
+                aplicado_em TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS idx_fila_pendente ON public.fila_ingestao (schema_name, id) WHERE status = 'pendente';
+            ALTER TABLE public.fila_ingestao ADD COLUMN IF NOT EXISTS chave_idempotencia VARCHAR(128);
+            CREATE INDEX IF NOT EXISTS idx_fila_chave ON public.fila_ingestao (schema_name, chave_idempotencia) WHERE chave_idempotencia IS NOT NULL;
+            ALTER TABLE public.fila_ingestao ADD COLUMN IF NOT EXISTS proximo_em TIMESTAMP;
+            """)
+
+            # Resultado dos lotes com Idempotency-Key (ver idempotencia.py)
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS public.lotes_aplicados (
+                schema_name VARCHAR(50) NOT NULL,
+                chave VARCHAR(128) NOT NULL,
+                resultado JSONB,
+                criado_em TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (schema_name, chave)
+            );
+            CREATE INDEX IF NOT EXISTS idx_lotes_aplicados_criado ON public.lotes_aplicados (criado_em);
+            """)
+
+            conn.commit()
+        except Exception as e:
+            print(f"Erro master table: {e}")
+            conn.rollback()
+
+        # Autenticação por token em toda requisição: busca indexada
+        try:
+            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_lojas_api_token ON public.lojas_sincronizadas (api_token)")
+            conn.commit()
+        except Exception as e:
+            print(f"Erro índice api_token (tokens duplicados?): {e}")
+            conn.rollback()
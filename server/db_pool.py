@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+# Arquivo: server/db_pool.py
+# Pool de conexões thread-safe com tamanho mínimo/máximo, timeout de
+# aquisição, verificação de saúde na retirada e estatísticas de uso.
+
+
+class PoolEsgotadoError(Exception):
+    """ Nenhuma conexão ficou livre dentro do timeout de aquisição. """
+
+
+class PoolConexoes:
+    def __init__(self, dsn, minimo=1, maximo=10, timeout=5.0, ocioso_check=30.0, connect_timeout=5):
+        self.dsn = dsn
+        self.minimo = minimo
+        self.maximo = maximo
+        self.timeout = timeout
+        # Conexões paradas há mais que isso recebem um SELECT 1 antes de sair do pool
+        self.ocioso_check = ocioso_check
+        self.connect_timeout = connect_timeout
+
+        self._livres = deque()   # (conexao, devolvida_em)
+        self._total = 0
+        self._em_uso = 0
+        self._aguardando = 0
+        self._cond = threading.Condition()
+
+        self._aquisicoes = 0
+        self._tempo_aquisicao = 0.0
+        self._maior_aquisicao = 0.0
+        self._timeouts = 0
+        self._descartadas = 0
+
+    # --- CICLO DE VIDA ---
+    def _conectar(self):
+        return psycopg2.connect(self.dsn, connect_timeout=self.connect_timeout)
+
+    def abrir(self, tentativas=15, intervalo=2):
+        """
+        Abre as conexões mínimas. Usado no startup: é o único ponto que
+        espera o banco subir (as requisições nunca ficam em laço de retry).
+        """
+        for i in range(tentativas):
+            try:
+                while True:
+                    with self._cond:
+                        if self._total >= self.minimo: return
+                        self._total += 1
+                    try:
+                        conn = self._conectar()
+                    except Exception:
+                        with self._cond: self._total -= 1
+                        raise
+                    with self._cond:
+                        self._livres.append((conn, time.monotonic()))
+                        self._cond.notify()
+            except psycopg2.OperationalError:
+                if i == tentativas - 1: raise
+                time.sleep(intervalo)
+
+    def fechar(self):
+        with self._cond:
+            while self._livres:
+                conn, _ = self._livres.popleft()
+                self._total -= 1
+                try: conn.close()
+                except Exception: pass
+
+    # --- AQUISIÇÃO / DEVOLUÇÃO ---
+    def _saudavel(self, conn, devolvida_em):
+        if conn.closed: return False
+        if time.monotonic() - devolvida_em < self.ocioso_check: return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _descartar(self, conn):
+        try: conn.close()
+        except Exception: pass
+        with self._cond:
+            self._total -= 1
+            self._descartadas += 1
+            self._cond.notify()
+
+    def obter(self):
+        inicio = time.monotonic()
+        limite = inicio + self.timeout
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    if self._livres:
+                        conn, devolvida_em = self._livres.pop()
+                        break
+                    if self._total < self.maximo:
+                        self._total += 1
+                        break
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        self._timeouts += 1
+                        raise PoolEsgotadoError(f"Pool esgotado: {self._em_uso}/{self.maximo} conexões em uso")
+                    self._aguardando += 1
+                    try: self._cond.wait(restante)
+                    finally: self._aguardando -= 1
+
+            if conn is None:
+                try:
+                    conn = self._conectar()
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._saudavel(conn, devolvida_em):
+                self._descartar(conn)
+                continue
+
+            espera = time.monotonic() - inicio
+            with self._cond:
+                self._em_uso += 1
+                self._aquisicoes += 1
+                self._tempo_aquisicao += espera
+                self._maior_aquisicao = max(self._maior_aquisicao, espera)
+            return conn
+
+    def devolver(self, conn, descartar=False):
+        with self._cond:
+            self._em_uso -= 1
+        if not descartar and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                descartar = True
+        if descartar or conn.closed:
+            self._descartar(conn)
+            return
+        with self._cond:
+            self._livres.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def conexao(self):
+        conn = self.obter()
+        descartar = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            descartar = True
+            raise
+        finally:
+            self.devolver(conn, descartar)
+
+    # --- MÉTRICAS ---
+    def estatisticas(self):
+        with self._cond:
+            media = self._tempo_aquisicao / self._aquisicoes if self._aquisicoes else 0.0
+            return {
+                "minimo": self.minimo,
+                "maximo": self.maximo,
+                "abertas": self._total,
+                "em_uso": self._em_uso,
+                "livres": len(self._livres),
+                "aguardando": self._aguardando,
+                "aquisicoes": self._aquisicoes,
+                "aquisicao_media_ms": round(media * 1000, 3),
+                "aquisicao_max_ms": round(self._maior_aquisicao * 1000, 3),
+                "timeouts": self._timeouts,
+                "descartadas": self._descartadas,
+            }
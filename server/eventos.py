@@ -0,0 +1,91 @@
+import asyncio
+import json
+import os
+import threading
+
+import notificacoes
+
+# Arquivo: server/eventos.py
+# Avisos de "dados alterados" para os painéis abertos (SSE).
+# O sync publica, na transação do lote, um NOTIFY com a loja e os dias de
+# venda tocados; o Postgres só entrega no commit. O LISTEN do worker (o de
+# notificacoes.py, uma conexão por worker) repassa para os assinantes da
+# loja neste worker, cada um com sua fila no event loop. O cliente só refaz
+# o relatório quando o aviso cobre o período que está na tela.
+
+CANAL_DADOS = "dados_alterados"
+SSE_MAX_ASSINANTES = int(os.getenv("SSE_MAX_ASSINANTES", "5000"))
+SSE_FILA = 100  # Avisos pendentes por assinante; além disso ele só recebe "reiniciar"
+
+_assinantes = {}   # schema -> set(Assinante)
+_lock = threading.Lock()
+
+
+class Assinante:
+    def __init__(self, schema: str):
+        self.schema = schema
+        self.loop = asyncio.get_running_loop()
+        self.fila = asyncio.Queue(maxsize=SSE_FILA)
+
+    def entregar(self, evento: dict):
+        """ Chamado na thread do listener: coloca o evento na fila pelo loop do assinante. """
+        self.loop.call_soon_threadsafe(self._colocar, evento)
+
+    def _colocar(self, evento):
+        if self.fila.full():
+            # Cliente lento: descarta o acumulado e pede para recarregar tudo
+            while not self.fila.empty(): self.fila.get_nowait()
+            evento = {"tipo": "reiniciar"}
+        self.fila.put_nowait(evento)
+
+
+def publicar_alteracao(cursor, schema: str, dias=None):
+    """
+    Avisa os painéis da loja (entregue no commit). dias=None: cadastro
+    alterado, vale para qualquer período.
+    """
+    evento = {"schema": schema, "tipo": "dados"}
+    if dias is not None:
+        dias = sorted(d for d in dias if d is not None)
+        if not dias: return
+        evento.update(de=dias[0].isoformat(), ate=dias[-1].isoformat())
+    notificacoes.publicar(cursor, CANAL_DADOS, json.dumps(evento))
+
+
+def assinar(schema: str):
+    with _lock:
+        if sum(len(a) for a in _assinantes.values()) >= SSE_MAX_ASSINANTES: return None
+        assinante = Assinante(schema)
+        _assinantes.setdefault(schema, set()).add(assinante)
+    return assinante
+
+
+def cancelar(assinante: Assinante):
+    with _lock:
+        lista = _assinantes.get(assinante.schema)
+        if lista is None: return
+        lista.discard(assinante)
+        if not lista: del _assinantes[assinante.schema]
+
+
+def total_assinantes():
+    with _lock:
+        return sum(len(a) for a in _assinantes.values())
+
+
+def _ao_notificar(payload):
+    if payload is None:
+        # Listener reconectou: avisos podem ter se perdido, todos recarregam
+        with _lock: destinos = [(a, {"tipo": "reiniciar"}) for lista in _assinantes.values() for a in lista]
+    else:
+        evento = json.loads(payload)
+        schema = evento.pop("schema")
+        with _lock: destinos = [(a, evento) for a in _assinantes.get(schema, ())]
+    for assinante, evento in destinos:
+        try:
+            assinante.entregar(evento)
+        except RuntimeError:
+            pass  # Loop encerrado (worker parando)
+
+
+notificacoes.registrar(CANAL_DADOS, _ao_notificar)
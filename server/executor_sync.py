@@ -0,0 +1,62 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from database_utils import DB_POOL_MAX
+
+# Arquivo: server/executor_sync.py
+# Executor dedicado para a ingestão (psycopg2 é bloqueante). Tira o trabalho
+# pesado do event loop e do threadpool padrão usado pelas rotas de relatório.
+#
+# - Lojas diferentes rodam em paralelo, até SYNC_WORKERS lotes ao mesmo tempo.
+# - Lotes da mesma loja entram numa fila FIFO e são aplicados um por vez,
+#   na ordem de chegada.
+# O padrão deixa metade do pool de conexões livre para os relatórios.
+
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", str(max(1, DB_POOL_MAX // 2))))
+
+_executor = ThreadPoolExecutor(max_workers=SYNC_WORKERS, thread_name_prefix="sync")
+_filas = {}   # schema -> [asyncio.Lock, qtd_lotes_na_fila]
+
+
+def lotes_na_fila(schema: str) -> int:
+    """ Lotes da loja aguardando ou em execução neste worker. """
+    fila = _filas.get(schema)
+    return fila[1] if fila else 0
+
+
+@asynccontextmanager
+async def fila_loja(schema: str):
+    """
+    Ocupa a vez da loja na fila (para operações com vários passos, como o
+    ingest em streaming).
+    """
+    fila = _filas.setdefault(schema, [asyncio.Lock(), 0])
+    fila[1] += 1
+    try:
+        async with fila[0]:  # asyncio.Lock atende em ordem de chegada
+            yield
+    finally:
+        fila[1] -= 1
+        if fila[1] == 0:
+            _filas.pop(schema, None)
+
+
+async def rodar(funcao, *args, **kwargs):
+    """ Executa funcao(*args) no executor de sync, sem passar pela fila. """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(funcao, *args, **kwargs))
+
+
+async def executar(schema: str, funcao, *args, **kwargs):
+    """
+    Executa funcao(*args) no executor de sync, respeitando a fila da loja.
+    """
+    async with fila_loja(schema):
+        return await rodar(funcao, *args, **kwargs)
+
+
+def encerrar():
+    _executor.shutdown(wait=True)
@@ -0,0 +1,145 @@
+import csv
+import io
+import os
+from datetime import timedelta
+
+from fastapi import HTTPException
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Opcional: sem o pacote, formato=parquet recebe 415
+    pyarrow = None
+
+from database_utils import conexao
+from tipos_colunas import expressoes_tipadas
+import particionamento
+import schema_cache
+
+# Arquivo: server/exportacao.py
+# Exportação das vendas/itens/pagamentos de um período, linha a linha:
+# cursor nomeado no servidor (o Postgres mantém o resultado, não o worker),
+# lido em blocos de EXPORT_LOTE com fetchmany e convertido bloco a bloco em
+# CSV ou Parquet (um row group por bloco). A memória do worker não depende
+# do tamanho da exportação.
+
+EXPORT_LOTE = int(os.getenv("EXPORT_LOTE", "5000"))
+
+# conteudo -> tabela principal (lida junto com saida para o período)
+CONTEUDOS = {"vendas": "saida", "itens": "saida_produto", "pagamentos": "saida_formapag"}
+FORMATOS = {"csv": "text/csv; charset=utf-8", "parquet": "application/vnd.apache.parquet"}
+
+
+def validar(cursor, schema: str, conteudo: str, formato: str):
+    """ Erros de parâmetro antes de começar a resposta (depois não há como mudar o status). """
+    if conteudo not in CONTEUDOS:
+        raise HTTPException(400, f"Conteúdo inválido: {conteudo} (use {', '.join(CONTEUDOS)})")
+    if formato not in FORMATOS:
+        raise HTTPException(400, f"Formato inválido: {formato} (use {', '.join(FORMATOS)})")
+    if formato == "parquet" and pyarrow is None:
+        raise HTTPException(415, "Parquet não suportado neste servidor (pacote 'pyarrow' ausente)")
+    for tabela in {"saida", CONTEUDOS[conteudo]}:
+        if not schema_cache.existe(cursor, schema, tabela):
+            raise HTTPException(404, f"Tabela {tabela} não existe nesta loja")
+
+
+def sql_exportacao(cursor, schema: str, conteudo: str, data_inicio, data_fim):
+    """ SELECT do conteúdo no período [início, fim], na ordem da data da venda. """
+    x = expressoes_tipadas(cursor, schema)
+    periodo = cursor.mogrify(f"{x['s_data']} >= %s AND {x['s_data']} < %s",
+                             (data_inicio, data_fim + timedelta(days=1))).decode()
+    if conteudo == "vendas":
+        return f"SELECT s.* FROM {schema}.saida s WHERE {periodo} ORDER BY s.\"data\", s.id_original"
+
+    alias = "sp" if conteudo == "itens" else "sf"
+    poda = ""
+    if alias == "sp" and particionamento.particionada(schema_cache.obter_tabela(cursor, schema, "saida_produto")):
+        # Mesmo período em sp."data" para podar as partições
+        poda = cursor.mogrify(' AND sp."data" >= %s AND sp."data" < %s', (data_inicio, data_fim + timedelta(days=1))).decode()
+    return f"""
+        SELECT s."data" AS data_venda, {alias}.*
+        FROM {schema}.{CONTEUDOS[conteudo]} {alias}
+        JOIN {schema}.saida s ON {alias}.id_saida = s.id_original
+        WHERE {periodo}{poda}
+        ORDER BY s."data", {alias}.id_saida
+    """
+
+
+def _blocos(sql: str):
+    """ (colunas, tipos) e depois as linhas em blocos, de um cursor nomeado em conexão própria. """
+    with conexao() as conn:
+        cursor = conn.cursor(name="exportacao")
+        cursor.execute(sql)
+        linhas = cursor.fetchmany(EXPORT_LOTE)
+        yield [(d.name, d.type_code) for d in cursor.description]
+        while linhas:
+            yield linhas
+            linhas = cursor.fetchmany(EXPORT_LOTE)
+        cursor.close()
+
+
+def gerar_csv(sql: str):
+    """ CSV com ';' e BOM (abre direto no Excel em pt-BR), um pedaço por bloco. """
+    blocos = _blocos(sql)
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=";", lineterminator="\r\n")
+    escritor.writerow([nome for nome, _ in next(blocos)])
+    yield "\ufeff" + buffer.getvalue()
+    for linhas in blocos:
+        buffer.seek(0); buffer.truncate()
+        escritor.writerows(linhas)
+        yield buffer.getvalue()
+
+
+# OID do Postgres -> tipo Arrow; os demais (varchar, numeric, ...) vão como texto
+def _tipos_arrow():
+    return {
+        16: pyarrow.bool_(), 20: pyarrow.int64(), 21: pyarrow.int32(), 23: pyarrow.int32(),
+        700: pyarrow.float32(), 701: pyarrow.float64(), 1082: pyarrow.date32(),
+        1083: pyarrow.time64("us"), 1114: pyarrow.timestamp("us"), 1184: pyarrow.timestamp("us", tz="UTC"),
+    }
+
+
+class _Saida(io.RawIOBase):
+    """ Destino do ParquetWriter: acumula o que foi escrito até ser drenado. """
+
+    def __init__(self):
+        self._dados = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._dados += b
+        return len(b)
+
+    def drenar(self) -> bytes:
+        dados, self._dados = bytes(self._dados), bytearray()
+        return dados
+
+
+def gerar_parquet(sql: str):
+    """ Parquet com um row group por bloco; cada row group sai assim que é escrito. """
+    blocos = _blocos(sql)
+    conhecidos = _tipos_arrow()
+    colunas = next(blocos)
+    esquema = pyarrow.schema([(nome, conhecidos.get(oid, pyarrow.string())) for nome, oid in colunas])
+    texto = [i for i, (_, oid) in enumerate(colunas) if oid not in conhecidos]
+
+    saida = _Saida()
+    escritor = pyarrow.parquet.ParquetWriter(saida, esquema, compression="zstd")
+    try:
+        for linhas in blocos:
+            valores = [list(c) for c in zip(*linhas)]
+            for i in texto:
+                valores[i] = [None if v is None else str(v) for v in valores[i]]
+            arrays = [pyarrow.array(v, type=campo.type) for v, campo in zip(valores, esquema)]
+            escritor.write_table(pyarrow.Table.from_arrays(arrays, schema=esquema))
+            yield saida.drenar()
+    finally:
+        escritor.close()
+    yield saida.drenar()
+
+
+def gerar(sql: str, formato: str):
+    return gerar_parquet(sql) if formato == "parquet" else gerar_csv(sql)
@@ -0,0 +1,219 @@
+import os
+import threading
+import time
+
+import psycopg2
+from psycopg2.extras import Json
+
+from database_utils import conexao
+import ingest_stream
+import schema_cache
+import notificacoes
+
+# Arquivo: server/fila_ingestao.py
+# Fila durável de lotes de sync (modo assíncrono).
+# A rota grava o corpo recebido em public.fila_ingestao e responde 202.
+# Aplicadores em background drenam a fila: por loja, sempre o lote mais
+# antigo primeiro; lojas diferentes em paralelo. O lote é aplicado e marcado
+# como 'aplicado' na mesma transação. Lote que falha volta a ser tentado só
+# depois de proximo_em (espera exponencial) e, após FILA_MAX_TENTATIVAS, fica
+# em 'erro': o agente consulta o status e só baixa as marcas com 'aplicado'.
+
+FILA_APLICADORES = int(os.getenv("FILA_APLICADORES", "2"))        # Threads por worker
+FILA_MAX_POR_LOJA = int(os.getenv("FILA_MAX_POR_LOJA", "50"))     # Acima disso: 429
+FILA_MAX_TOTAL = int(os.getenv("FILA_MAX_TOTAL", "5000"))
+FILA_MAX_TENTATIVAS = int(os.getenv("FILA_MAX_TENTATIVAS", "3"))
+FILA_ESPERA_BASE = int(os.getenv("FILA_ESPERA_BASE", "10"))        # Segundos; dobra a cada falha do lote
+FILA_RETENCAO_HORAS = int(os.getenv("FILA_RETENCAO_HORAS", "24"))  # Lotes aplicados ficam para consulta de status
+CANAL_FILA = "fila_ingestao"
+
+_aplicador = None   # funcao(cursor, schema, tipo, dados, chave) -> dict
+_depois_do_commit = None   # funcao(schema), após o commit de um lote aplicado
+_acordar = threading.Event()
+_parar = threading.Event()
+_threads = []
+
+
+class FilaCheiaError(Exception):
+    """ Fila da loja (ou global) acima do limite: o agente deve tentar mais tarde. """
+
+
+def registrar_aplicador(funcao, depois_do_commit=None):
+    """
+    Define como aplicar um lote: funcao(cursor, schema, tipo, dados, chave),
+    onde tipo é a tabela de destino ou 'vendas' e chave é a Idempotency-Key
+    do agente (ou None). Roda na transação do aplicador. depois_do_commit(schema)
+    roda quando o lote aplicado foi gravado (o mesmo gancho do sync direto).
+    """
+    global _aplicador, _depois_do_commit
+    _aplicador = funcao
+    _depois_do_commit = depois_do_commit
+
+
+# --- PRODUTOR ---
+def enfileirar(schema: str, tipo: str, corpo: bytes, content_type: str, content_encoding: str, chave: str = None):
+    with conexao() as conn:
+        cursor = conn.cursor()
+        if chave:
+            # Reenvio de um lote já na fila (ou já aplicado): devolve o mesmo id
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"fila:{schema}:{chave}",))
+            cursor.execute("""
+                SELECT id FROM public.fila_ingestao
+                WHERE schema_name = %s AND chave_idempotencia = %s AND status <> 'erro'
+                ORDER BY id DESC LIMIT 1
+            """, (schema, chave))
+            r = cursor.fetchone()
+            if r:
+                conn.rollback()
+                return r[0]
+
+        cursor.execute("""
+            SELECT COUNT(*) FILTER (WHERE schema_name = %s), COUNT(*)
+            FROM public.fila_ingestao WHERE status = 'pendente'
+        """, (schema,))
+        da_loja, total = cursor.fetchone()
+        if da_loja >= FILA_MAX_POR_LOJA or total >= FILA_MAX_TOTAL:
+            raise FilaCheiaError(f"Fila de ingestão cheia ({da_loja} lotes pendentes da loja, {total} no total)")
+
+        cursor.execute("""
+            INSERT INTO public.fila_ingestao (schema_name, tipo, corpo, content_type, content_encoding, chave_idempotencia)
+            VALUES (%s, %s, %s, %s, %s, %s) RETURNING id
+        """, (schema, tipo, psycopg2.Binary(corpo), content_type, content_encoding, chave))
+        id_lote = cursor.fetchone()[0]
+        notificacoes.publicar(cursor, CANAL_FILA, schema)
+        conn.commit()
+    _acordar.set()
+    return id_lote
+
+
+# --- CONSULTAS ---
+def status_lote(schema: str, id_lote: int):
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT status, tentativas, resultado, erro, criado_em, aplicado_em, proximo_em,
+                   (SELECT COUNT(*) FROM public.fila_ingestao p
+                    WHERE p.schema_name = f.schema_name AND p.status = 'pendente' AND p.id < f.id)
+            FROM public.fila_ingestao f
+            WHERE id = %s AND schema_name = %s
+        """, (id_lote, schema))
+        r = cursor.fetchone()
+    if not r: return None
+    return {"id_lote": id_lote, "status": r[0], "tentativas": r[1], "resultado": r[2], "erro": r[3],
+            "criado_em": r[4], "aplicado_em": r[5], "proxima_tentativa": r[6] if r[0] == 'pendente' else None,
+            "lotes_a_frente": r[7] if r[0] == 'pendente' else 0}
+
+
+def profundidade(schema: str = None):
+    """ Lotes pendentes e idade do mais antigo, por loja (ou de uma loja). """
+    with conexao() as conn:
+        cursor = conn.cursor()
+        filtro = "AND schema_name = %s" if schema else ""
+        cursor.execute(f"""
+            SELECT schema_name, COUNT(*), EXTRACT(EPOCH FROM NOW() - MIN(criado_em))
+            FROM public.fila_ingestao
+            WHERE status = 'pendente' {filtro}
+            GROUP BY schema_name ORDER BY 2 DESC
+        """, (schema,) if schema else None)
+        lojas = [{"schema": r[0], "pendentes": r[1], "mais_antigo_seg": float(r[2] or 0)} for r in cursor.fetchall()]
+    return {"pendentes": sum(l["pendentes"] for l in lojas), "lojas": lojas}
+
+
+# --- APLICADORES ---
+def _aplicar_proximo():
+    """ Aplica o lote mais antigo de alguma loja livre. Retorna False se não havia nada. """
+    with conexao() as conn:
+        cursor = conn.cursor()
+        # A cabeça da fila de cada loja fica travada até o commit: outro
+        # aplicador pula (SKIP LOCKED) e o próximo lote da mesma loja só vira
+        # cabeça depois que este terminar. Garante a ordem por loja.
+        cursor.execute("""
+            SELECT f.id, f.schema_name, f.tipo, f.corpo, f.content_type, f.content_encoding, f.tentativas, f.chave_idempotencia
+            FROM public.fila_ingestao f
+            WHERE f.status = 'pendente'
+              AND (f.proximo_em IS NULL OR f.proximo_em <= NOW())
+              AND f.id = (SELECT MIN(p.id) FROM public.fila_ingestao p
+                          WHERE p.schema_name = f.schema_name AND p.status = 'pendente')
+            ORDER BY f.id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        """)
+        lote = cursor.fetchone()
+        if not lote:
+            conn.rollback()
+            return False
+
+        id_lote, schema, tipo, corpo, content_type, content_encoding, tentativas, chave = lote
+        aplicado = False
+        try:
+            cursor.execute("SAVEPOINT aplicar_lote")
+            dados = ingest_stream.decodificar_corpo(bytes(corpo), content_type, content_encoding)
+            resultado = _aplicador(cursor, schema, tipo, dados, chave) if dados else {"status": "vazio"}
+            cursor.execute("""
+                UPDATE public.fila_ingestao
+                SET status = 'aplicado', resultado = %s, erro = NULL, aplicado_em = NOW(), corpo = ''::bytea
+                WHERE id = %s
+            """, (Json(resultado), id_lote))
+            aplicado = True
+        except Exception as e:
+            # Desfaz só o lote; a linha da fila continua travada por nós
+            cursor.execute("ROLLBACK TO SAVEPOINT aplicar_lote")
+            schema_cache.invalidar(schema)
+            novo_status = 'erro' if tentativas + 1 >= FILA_MAX_TENTATIVAS else 'pendente'
+            # A cabeça da loja espera antes da próxima tentativa (os lotes atrás dela também)
+            cursor.execute("""
+                UPDATE public.fila_ingestao
+                SET tentativas = tentativas + 1, erro = %s, status = %s,
+                    proximo_em = NOW() + make_interval(secs => %s)
+                WHERE id = %s
+            """, (str(e), novo_status, FILA_ESPERA_BASE * 2 ** tentativas, id_lote))
+            print(f"Erro Fila lote {id_lote} ({schema}.{tipo}): {e}")
+        conn.commit()
+    if aplicado and _depois_do_commit: _depois_do_commit(schema)
+    return True
+
+
+def _limpar_antigos():
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            DELETE FROM public.fila_ingestao
+            WHERE status <> 'pendente' AND criado_em < NOW() - make_interval(hours => %s)
+        """, (FILA_RETENCAO_HORAS,))
+        conn.commit()
+
+
+def _loop(indice):
+    ultima_limpeza = 0.0
+    while not _parar.is_set():
+        try:
+            if _aplicar_proximo(): continue
+            if indice == 0 and time.monotonic() - ultima_limpeza > 600:
+                _limpar_antigos()
+                ultima_limpeza = time.monotonic()
+        except Exception as e:
+            print(f"Erro aplicador da fila: {e}")
+            _parar.wait(2)
+        # Sem trabalho: dorme até um NOTIFY de lote novo (ou 5 s, por segurança)
+        _acordar.wait(5)
+        _acordar.clear()
+
+
+notificacoes.registrar(CANAL_FILA, lambda payload: _acordar.set())
+
+
+def iniciar():
+    if _threads or FILA_APLICADORES <= 0: return
+    _parar.clear()
+    for i in range(FILA_APLICADORES):
+        t = threading.Thread(target=_loop, args=(i,), name=f"aplicador-fila-{i}", daemon=True)
+        t.start()
+        _threads.append(t)
+
+
+def parar():
+    _parar.set()
+    _acordar.set()
+    for t in _threads:
+        t.join(timeout=30)
+    _threads.clear()
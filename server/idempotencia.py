@@ -0,0 +1,48 @@
+import os
+import threading
+
+from psycopg2.extras import Json
+
+# Arquivo: server/idempotencia.py
+# Proteção contra reenvio de lotes: o agente manda 'Idempotency-Key' e o
+# resultado do lote fica guardado por loja. Um reenvio (timeout do agente
+# depois do commit no servidor) recebe o resultado guardado sem tocar nas
+# tabelas.
+
+IDEMPOTENCIA_RETENCAO_HORAS = int(os.getenv("IDEMPOTENCIA_RETENCAO_HORAS", "48"))
+_LIMPEZA_A_CADA = 500   # Registros entre uma limpeza e outra (por worker)
+
+_registros = 0
+_lock = threading.Lock()
+
+
+def chave_da_requisicao(request):
+    chave = request.headers.get("idempotency-key", "").strip()
+    return chave[:128] or None
+
+
+def reservar(cursor, schema: str, chave: str):
+    """
+    Trava a chave até o fim da transação (reenvios simultâneos em workers
+    diferentes esperam) e devolve o resultado já gravado, se houver.
+    """
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"{schema}:{chave}",))
+    cursor.execute("SELECT resultado FROM public.lotes_aplicados WHERE schema_name = %s AND chave = %s", (schema, chave))
+    r = cursor.fetchone()
+    return dict(r[0], repetido=True) if r else None
+
+
+def registrar(cursor, schema: str, chave: str, resultado: dict):
+    """ Grava o resultado na mesma transação do lote. """
+    global _registros
+    cursor.execute("""
+        INSERT INTO public.lotes_aplicados (schema_name, chave, resultado) VALUES (%s, %s, %s)
+        ON CONFLICT (schema_name, chave) DO NOTHING
+    """, (schema, chave, Json(resultado)))
+
+    with _lock:
+        _registros += 1
+        limpar = _registros % _LIMPEZA_A_CADA == 0
+    if limpar:
+        cursor.execute("DELETE FROM public.lotes_aplicados WHERE criado_em < NOW() - make_interval(hours => %s)",
+                       (IDEMPOTENCIA_RETENCAO_HORAS,))
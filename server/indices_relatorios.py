@@ -0,0 +1,178 @@
+"""
+Conjunto de índices dos relatórios (e da verificação de integridade),
+mantido para todas as lojas.
+
+Uso (a partir de server/, com as variáveis DB_* do ambiente):
+    python indices_relatorios.py                      # todas as lojas
+    python indices_relatorios.py --schema loja_x      # uma loja
+    python indices_relatorios.py --verificar          # só lista o que falta
+
+Lojas novas recebem os índices em get_sql_novo_cliente (sql_indices). Nas
+existentes cada índice é criado com CREATE INDEX CONCURRENTLY, sem bloquear
+o sync; um índice que ficou inválido (build interrompido) é recriado. Os
+índices simples em id_saida, substituídos pelos de cobertura, são removidos
+depois que estes existem. Em tabelas particionadas o índice é criado no pai
+(ON ONLY) e em cada partição com CONCURRENTLY, depois anexado. Pode ser
+executado de novo a qualquer momento.
+"""
+import argparse
+
+from database_utils import get_db_connection
+import schema_cache
+from particionamento import particionada
+
+# Filtro das vendas válidas: é o mesmo texto usado pelos relatórios, então o
+# planejador prova que a consulta está contida no índice parcial
+VENDA_VALIDA = "(eliminado IS NULL OR eliminado = 'N')"
+
+# nome -> (tabela, colunas, INCLUDE, WHERE)
+INDICES = {
+    # Filtro de período dos relatórios: "data" >= início AND "data" < fim
+    "idx_saida_data": ("saida", '"data"', None, None),
+    # Só vendas não eliminadas; inclui o necessário para os cards e o join
+    # com os itens sem visitar a tabela (index-only scan)
+    "idx_saida_data_validas": ("saida", '"data"', "id_original, total", VENDA_VALIDA),
+    # Joins dos rankings/CMV: itens da venda já com produto, quantidade e total
+    "idx_sp_saida_cobertura": ("saida_produto", "id_saida", "id_produto, quant, total", None),
+    "idx_sf_saida_cobertura": ("saida_formapag", "id_saida", "id_formapag, valor", None),
+    # Verificação de integridade incremental: linhas alteradas desde a marca
+    # d'água (ver integridade.py). BRIN: minúsculo, e não impede HOT update
+    # (no Postgres 16+) embora modificado_em mude a cada upsert
+    "idx_saida_modificado": ("saida", "modificado_em", None, None),
+    "idx_sp_modificado": ("saida_produto", "modificado_em", None, None),
+    "idx_sf_modificado": ("saida_formapag", "modificado_em", None, None),
+}
+
+# Índices que não são btree: nome -> método
+METODOS = {
+    "idx_saida_modificado": "brin",
+    "idx_sp_modificado": "brin",
+    "idx_sf_modificado": "brin",
+}
+
+# Substituídos pelos índices de cobertura acima: nome -> índice que o cobre
+OBSOLETOS = {
+    "idx_sp_saida": "idx_sp_saida_cobertura",
+    "idx_sf_saida": "idx_sf_saida_cobertura",
+}
+
+
+def _colunas(definicao: str):
+    return [c.strip().strip('"') for c in definicao.split(",")]
+
+
+def sql_indice(schema: str, nome: str, concorrente: bool = False, tabela: str = None, apenas: bool = False) -> str:
+    """ tabela: outra tabela com a mesma estrutura (partição); apenas: ON ONLY (pai particionado). """
+    tabela_base, colunas, incluir, onde = INDICES[nome]
+    metodo = f" USING {METODOS[nome]}" if nome in METODOS else ""
+    return (f"CREATE INDEX {'CONCURRENTLY ' if concorrente else ''}IF NOT EXISTS {nome} "
+            f"ON {'ONLY ' if apenas else ''}{schema}.{tabela or tabela_base}{metodo} ({colunas})"
+            f"{f' INCLUDE ({incluir})' if incluir else ''}"
+            f"{f' WHERE {onde}' if onde else ''}")
+
+
+def sql_indices(schema: str) -> str:
+    """ DDL do conjunto completo, para o script de criação da loja. """
+    return "\n    ".join(f"{sql_indice(schema, nome)};" for nome in INDICES)
+
+
+def estado(cursor, schema: str):
+    """ {nome_indice: valido} dos índices existentes no schema. """
+    cursor.execute("""
+        SELECT c.relname, i.indisvalid
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s
+    """, (schema,))
+    return dict(cursor.fetchall())
+
+
+def pendentes(cursor, schema: str):
+    """ Índices do conjunto que faltam (ou estão inválidos) e cujas colunas existem. """
+    existentes = estado(cursor, schema)
+    lista = []
+    for nome, (tabela, colunas, incluir, onde) in INDICES.items():
+        if existentes.get(nome): continue
+        meta = schema_cache.carregar_tabela(cursor, schema, tabela)
+        necessarias = _colunas(colunas) + (_colunas(incluir) if incluir else []) + (["eliminado"] if onde else [])
+        if meta and all(c in meta["colunas"] for c in necessarias):
+            lista.append(nome)
+    return lista
+
+
+def _criar_particionado(cursor, schema: str, nome: str):
+    """
+    CONCURRENTLY não vale para tabela particionada: cria o índice só no pai
+    (inválido até cobrir todas), cada partição com CONCURRENTLY e anexa.
+    """
+    tabela = INDICES[nome][0]
+    cursor.execute(sql_indice(schema, nome, apenas=True))
+    cursor.execute("""
+        SELECT c.relname FROM pg_inherits h
+        JOIN pg_class c ON c.oid = h.inhrelid
+        WHERE h.inhparent = to_regclass(%s)
+    """, (f"{schema}.{tabela}",))
+    for (particao,) in cursor.fetchall():
+        local = f"{nome}_{particao}"[:63]
+        cursor.execute(sql_indice(schema, nome, concorrente=True, tabela=particao).replace(f" {nome} ", f" {local} ", 1))
+        cursor.execute(f"""
+            SELECT 1 FROM pg_inherits WHERE inhparent = to_regclass(%s) AND inhrelid = to_regclass(%s)
+        """, (f"{schema}.{nome}", f"{schema}.{local}"))
+        if not cursor.fetchone():
+            cursor.execute(f"ALTER INDEX {schema}.{nome} ATTACH PARTITION {schema}.{local}")
+
+
+def aplicar(conn, schema: str, verificar: bool = False):
+    """ Cria os índices que faltam e remove os obsoletos. Exige conexão em autocommit. """
+    cursor = conn.cursor()
+    existentes = estado(cursor, schema)
+    for nome in pendentes(cursor, schema):
+        print(f"{schema}: criando {nome}")
+        if verificar: continue
+        if particionada(schema_cache.carregar_tabela(cursor, schema, INDICES[nome][0])):
+            _criar_particionado(cursor, schema, nome)
+            continue
+        if nome in existentes:
+            # Sobrou de um CONCURRENTLY interrompido: inválido, não é usado
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {schema}.{nome}")
+        cursor.execute(sql_indice(schema, nome, concorrente=True))
+
+    existentes = estado(cursor, schema)
+    for nome, substituto in OBSOLETOS.items():
+        if nome in existentes and existentes.get(substituto):
+            print(f"{schema}: removendo {nome} (coberto por {substituto})")
+            if verificar: continue
+            # Índice de tabela particionada só sai com DROP INDEX comum
+            concorrente = not particionada(schema_cache.carregar_tabela(cursor, schema, INDICES[substituto][0]))
+            cursor.execute(f"DROP INDEX {'CONCURRENTLY ' if concorrente else ''}IF EXISTS {schema}.{nome}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--schema")
+    parser.add_argument("--verificar", action="store_true")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    # CREATE/DROP INDEX CONCURRENTLY não roda dentro de transação
+    conn.autocommit = True
+    try:
+        cursor = conn.cursor()
+        if args.schema:
+            schemas = [args.schema]
+        else:
+            cursor.execute("SELECT schema_name FROM public.lojas_sincronizadas ORDER BY schema_name")
+            schemas = [r[0] for r in cursor.fetchall()]
+
+        for schema in schemas:
+            try:
+                aplicar(conn, schema, args.verificar)
+            except Exception as e:
+                print(f"Erro nos índices de {schema}: {e}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import io
+import json
+import os
+import tempfile
+import zlib
+
+from fastapi import HTTPException, Request
+
+try:
+    import zstandard
+except ImportError:  # Opcional: sem o pacote, corpos zstd recebem 415
+    zstandard = None
+
+# Arquivo: server/ingest_stream.py
+# Leitura incremental do corpo dos lotes de sync:
+# - NDJSON (uma linha JSON por registro), opcionalmente gzip/zstd, lido em
+#   blocos de até SYNC_STREAM_BLOCO linhas sem materializar o corpo inteiro;
+# - JSON array (contrato antigo), também aceito comprimido.
+# A descompressão sai sempre em pedaços de até _SAIDA bytes: gzip/deflate
+# com max_length; zstd (cujo decompressobj não limita a saída) guarda o corpo
+# comprimido num arquivo temporário e é lido com stream_reader.
+
+SYNC_STREAM_BLOCO = int(os.getenv("SYNC_STREAM_BLOCO", "1000"))
+# Teto do corpo (já descomprimido; bomba de descompressão): acima disso, 413
+SYNC_MAX_DESCOMPRIMIDO = int(os.getenv("SYNC_MAX_DESCOMPRIMIDO", str(256 * 1024 * 1024)))
+_SAIDA = 64 * 1024               # Saída máxima por leitura do descompressor
+_ZSTD_EM_MEMORIA = 8 * 1024 * 1024  # Corpo zstd comprimido acima disso vai para o disco
+
+TIPOS_NDJSON = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+def eh_ndjson(request: Request) -> bool:
+    tipo = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    return tipo in TIPOS_NDJSON
+
+
+def _descompressor_para(encoding: str):
+    encoding = (encoding or "").strip().lower()
+    if encoding in ("", "identity"): return None
+    if encoding == "gzip": return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "deflate": return zlib.decompressobj()
+    if encoding == "zstd":
+        if zstandard is None:
+            raise HTTPException(415, "Content-Encoding zstd não suportado neste servidor (pacote 'zstandard' ausente)")
+        return zstandard.ZstdDecompressor()
+    raise HTTPException(415, f"Content-Encoding não suportado: {encoding}")
+
+
+def _descompressor(request: Request):
+    return _descompressor_para(request.headers.get("content-encoding", ""))
+
+
+def conferir_encoding(request: Request):
+    """ 415 já na chegada para um Content-Encoding que não saberíamos abrir (fila: antes de gravar). """
+    _descompressor(request)
+
+
+def _descomprimir(descompressor, dados: bytes):
+    """ zlib: saída de 'dados' em pedaços de até _SAIDA, nunca tudo de uma vez. """
+    while dados:
+        parte = descompressor.decompress(dados, _SAIDA)
+        dados = descompressor.unconsumed_tail
+        if parte: yield parte
+
+
+def _ler_zstd(descompressor, arquivo):
+    """ zstd: corpo comprimido inteiro em 'arquivo', lido em pedaços de até _SAIDA. """
+    leitor = descompressor.stream_reader(arquivo, read_across_frames=True)
+    while True:
+        parte = leitor.read(_SAIDA)
+        if not parte: return
+        yield parte
+
+
+def _eh_zstd(descompressor) -> bool:
+    return zstandard is not None and isinstance(descompressor, zstandard.ZstdDecompressor)
+
+
+class _Teto:
+    """ Soma o que já foi descomprimido e recusa o corpo acima do teto. """
+
+    def __init__(self):
+        self.total = 0
+
+    def conferir(self, parte: bytes):
+        self.total += len(parte)
+        if self.total > SYNC_MAX_DESCOMPRIMIDO:
+            raise HTTPException(413, f"Corpo descomprimido acima de {SYNC_MAX_DESCOMPRIMIDO} bytes")
+        return parte
+
+
+async def _partes(request: Request):
+    descompressor = _descompressor(request)
+    teto = _Teto()
+    if _eh_zstd(descompressor):
+        # O comprimido também conta no teto (é menor que o descomprimido)
+        with tempfile.SpooledTemporaryFile(max_size=_ZSTD_EM_MEMORIA) as arquivo:
+            async for parte in request.stream():
+                arquivo.write(teto.conferir(parte))
+            arquivo.seek(0)
+            teto = _Teto()
+            for pedaco in _ler_zstd(descompressor, arquivo):
+                yield teto.conferir(pedaco)
+        return
+
+    async for parte in request.stream():
+        if descompressor is None:
+            if parte: yield teto.conferir(parte)
+            continue
+        for pedaco in _descomprimir(descompressor, parte):
+            yield teto.conferir(pedaco)
+    if descompressor is not None:
+        final = descompressor.flush()
+        if final: yield teto.conferir(final)
+
+
+async def ler_corpo(request: Request) -> bytes:
+    """ Corpo inteiro descomprimido (caminho JSON array). """
+    return b"".join([parte async for parte in _partes(request)])
+
+
+async def iterar_blocos(request: Request, tamanho: int = SYNC_STREAM_BLOCO):
+    """
+    Gera listas de até 'tamanho' linhas NDJSON ainda em bytes: o parse fica
+    para quem aplica o bloco (fora do event loop).
+    """
+    inicio = []   # Pedaços da linha ainda sem '\n' (uma linha longa não é recopiada a cada parte)
+    bloco = []
+    async for parte in _partes(request):
+        *linhas, fim = parte.split(b"\n")
+        if not linhas:
+            inicio.append(fim)
+            continue
+        linhas[0] = b"".join(inicio) + linhas[0]
+        inicio = [fim]
+        for linha in linhas:
+            if linha.strip(): bloco.append(linha)
+            if len(bloco) >= tamanho:
+                yield bloco
+                bloco = []
+    resto = b"".join(inicio)
+    if resto.strip(): bloco.append(resto)
+    if bloco: yield bloco
+
+
+def decodificar_corpo(corpo: bytes, content_type: str, content_encoding: str):
+    """
+    Versão síncrona para corpos já guardados (fila de ingestão): descomprime
+    e devolve a lista de registros, seja NDJSON ou JSON array.
+    """
+    descompressor = _descompressor_para(content_encoding)
+    if descompressor is not None:
+        teto = _Teto()
+        if _eh_zstd(descompressor):
+            partes = [teto.conferir(p) for p in _ler_zstd(descompressor, io.BytesIO(corpo))]
+        else:
+            partes = [teto.conferir(p) for p in _descomprimir(descompressor, corpo)]
+            partes.append(teto.conferir(descompressor.flush()))
+        corpo = b"".join(partes)
+    tipo = (content_type or "").split(";")[0].strip().lower()
+    if tipo in TIPOS_NDJSON:
+        return [json.loads(l) for l in corpo.split(b"\n") if l.strip()]
+    return json.loads(corpo)
@@ -0,0 +1,241 @@
+"""
+Verificação de integridade incremental, por loja.
+
+Uso (a partir de server/, com as variáveis DB_* do ambiente):
+    python integridade.py                      # todas as lojas
+    python integridade.py --schema loja_x      # uma loja
+    python integridade.py --completa           # ignora a marca d'água (relê tudo)
+
+Cada passada olha só as linhas com modificado_em desde a última marca
+d'água da loja (menos INTEGRIDADE_SOBREPOSICAO, para não perder lotes que
+estavam em transação quando a marca foi gravada), grava os problemas em
+{schema}.integrity_issues e reconfere os que estão abertos: o que o sync já
+corrigiu é marcado como resolvido. Depois de cada lote gravado o sync agenda
+uma passada (no máximo uma por INTEGRIDADE_INTERVALO por loja); a rota só lê
+a tabela.
+"""
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from database_utils import conexao, get_db_connection
+import schema_cache
+
+INTEGRIDADE_INTERVALO = int(os.getenv("INTEGRIDADE_INTERVALO", "60"))            # segundos
+INTEGRIDADE_SOBREPOSICAO = int(os.getenv("INTEGRIDADE_SOBREPOSICAO", "600"))     # segundos
+INTEGRIDADE_RETER_DIAS = int(os.getenv("INTEGRIDADE_RETER_DIAS", "30"))          # resolvidos
+
+
+def sql_tabelas_integridade(schema: str) -> str:
+    return f"""
+    CREATE TABLE IF NOT EXISTS {schema}.integrity_issues (
+        tipo VARCHAR(40) NOT NULL,
+        id_alvo TEXT NOT NULL,
+        acao VARCHAR(40) NOT NULL,
+        msg TEXT,
+        detectado_em TIMESTAMP NOT NULL DEFAULT NOW(),
+        visto_em TIMESTAMP NOT NULL DEFAULT NOW(),
+        resolvido_em TIMESTAMP,
+        PRIMARY KEY (tipo, id_alvo)
+    );
+    CREATE INDEX IF NOT EXISTS idx_integrity_abertos ON {schema}.integrity_issues (detectado_em, tipo, id_alvo)
+        WHERE resolvido_em IS NULL;
+
+    -- Até onde modificado_em já foi verificado
+    CREATE TABLE IF NOT EXISTS {schema}.integrity_watermark (
+        id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        ate TIMESTAMP NOT NULL
+    );
+    """
+
+
+# --- VERIFICAÇÕES ---
+# tipo -> (ação do agente, tabelas necessárias, candidatos, ainda vale)
+# candidatos: SELECT id_alvo, msg das linhas alteradas ({novos_X} = filtro de
+# modificado_em da tabela X, vazio na primeira passada); ainda vale: condição
+# sobre i.id_alvo de um problema aberto, reconferida a cada passada.
+VERIFICACOES = {
+    "PRODUTO_INEXISTENTE": ("REENVIAR_PRODUTO", ("saida_produto", "produto"), """
+        SELECT DISTINCT ON (sp.id_produto) sp.id_produto,
+               'Produto ' || sp.id_produto || ' não cadastrado (Venda ' || sp.id_saida || ')'
+        FROM {s}.saida_produto sp
+        LEFT JOIN {s}.produto p ON sp.id_produto = p.id_original
+        WHERE p.id_original IS NULL AND sp.id_produto IS NOT NULL {novos_sp}
+    """, "NOT EXISTS (SELECT 1 FROM {s}.produto p WHERE p.id_original = i.id_alvo)"),
+
+    "PAGAMENTO_INVALIDO": ("REENVIAR_FORMAPAG", ("saida_formapag", "formapag"), """
+        SELECT DISTINCT sf.id_formapag, 'Forma Pagto ' || sf.id_formapag || ' não cadastrada'
+        FROM {s}.saida_formapag sf
+        LEFT JOIN {s}.formapag f ON sf.id_formapag = f.id_original
+        WHERE f.id_original IS NULL AND sf.id_formapag IS NOT NULL {novos_sf}
+    """, "NOT EXISTS (SELECT 1 FROM {s}.formapag f WHERE f.id_original = i.id_alvo)"),
+
+    "ITEM_SEM_VENDA": ("CHECK_VENDA_ELIMINADA", ("saida_produto", "saida"), """
+        SELECT DISTINCT ON (sp.id_saida) sp.id_saida,
+               'Item ' || sp.id_original || ' aponta para venda inexistente ' || sp.id_saida
+        FROM {s}.saida_produto sp
+        LEFT JOIN {s}.saida s ON sp.id_saida = s.id_original
+        WHERE s.id_original IS NULL AND sp.id_saida IS NOT NULL {novos_sp}
+    """, """NOT EXISTS (SELECT 1 FROM {s}.saida s WHERE s.id_original = i.id_alvo)
+        AND EXISTS (SELECT 1 FROM {s}.saida_produto sp WHERE sp.id_saida = i.id_alvo)"""),
+
+    "VENDA_SEM_ITENS": ("REENVIAR_ITENS_VENDA", ("saida", "saida_produto"), """
+        SELECT s.id_original, 'Venda ' || s.id_original || ' ativa mas sem itens'
+        FROM {s}.saida s
+        WHERE (s.eliminado IS NULL OR s.eliminado = 'N') {novos_s}
+          AND NOT EXISTS (SELECT 1 FROM {s}.saida_produto sp WHERE sp.id_saida = s.id_original)
+    """, """EXISTS (SELECT 1 FROM {s}.saida s WHERE s.id_original = i.id_alvo AND (s.eliminado IS NULL OR s.eliminado = 'N'))
+        AND NOT EXISTS (SELECT 1 FROM {s}.saida_produto sp WHERE sp.id_saida = i.id_alvo)"""),
+
+    "VENDA_SEM_PAGAMENTO": ("REENVIAR_PAGTOS_VENDA", ("saida", "saida_formapag"), """
+        SELECT s.id_original, 'Venda ' || s.id_original || ' ativa mas sem pagamento'
+        FROM {s}.saida s
+        WHERE (s.eliminado IS NULL OR s.eliminado = 'N') {novos_s}
+          AND NOT EXISTS (SELECT 1 FROM {s}.saida_formapag sf WHERE sf.id_saida = s.id_original)
+    """, """EXISTS (SELECT 1 FROM {s}.saida s WHERE s.id_original = i.id_alvo AND (s.eliminado IS NULL OR s.eliminado = 'N'))
+        AND NOT EXISTS (SELECT 1 FROM {s}.saida_formapag sf WHERE sf.id_saida = i.id_alvo)"""),
+
+    # Venda eliminada alterada, ou item novo de uma venda já eliminada
+    "LIXO_VENDA_ELIMINADA": ("FORCAR_DELECAO", ("saida", "saida_produto"), """
+        SELECT s.id_original, 'Venda ' || s.id_original || ' está eliminada mas ainda tem itens.'
+        FROM {s}.saida s
+        WHERE s.eliminado = 'S' {novos_s}
+          AND EXISTS (SELECT 1 FROM {s}.saida_produto sp WHERE sp.id_saida = s.id_original)
+        UNION
+        SELECT s.id_original, 'Venda ' || s.id_original || ' está eliminada mas ainda tem itens.'
+        FROM {s}.saida_produto sp
+        JOIN {s}.saida s ON sp.id_saida = s.id_original
+        WHERE s.eliminado = 'S' {novos_sp}
+    """, """EXISTS (SELECT 1 FROM {s}.saida s WHERE s.id_original = i.id_alvo AND s.eliminado = 'S')
+        AND EXISTS (SELECT 1 FROM {s}.saida_produto sp WHERE sp.id_saida = i.id_alvo)"""),
+}
+
+# alias usado nas consultas -> tabela com modificado_em
+ALIASES = {"s": "saida", "sp": "saida_produto", "sf": "saida_formapag"}
+
+
+def _filtros_novos(cursor, schema: str, desde):
+    """ {novos_X: 'AND X.modificado_em >= desde'}; vazio sem marca ou sem a coluna (lê tudo). """
+    filtros = {}
+    for alias, tabela in ALIASES.items():
+        if desde is None or not schema_cache.existe(cursor, schema, tabela, "modificado_em"):
+            filtros[f"novos_{alias}"] = ""
+        else:
+            filtros[f"novos_{alias}"] = cursor.mogrify(f"AND {alias}.modificado_em >= %s", (desde,)).decode()
+    return filtros
+
+
+def verificar(conn, schema: str, completa: bool = False):
+    """
+    Uma passada incremental numa transação. Devolve {"encontrados",
+    "resolvidos"}, ou None se outra passada da mesma loja está em andamento.
+    """
+    cursor = conn.cursor()
+    if not schema_cache.existe(cursor, schema, "integrity_issues"):
+        # Loja anterior a esta verificação: cria as tabelas (primeira passada lê tudo)
+        cursor.execute(sql_tabelas_integridade(schema))
+        schema_cache.publicar_alteracao(cursor, schema)
+        conn.commit()
+        schema_cache.invalidar(schema, "integrity_issues")
+
+    # Uma passada por loja de cada vez (entre todos os workers)
+    cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext(%s))", (f"integridade:{schema}",))
+    if not cursor.fetchone()[0]:
+        conn.rollback()
+        return None
+
+    cursor.execute(f"SELECT NOW(), (SELECT ate FROM {schema}.integrity_watermark WHERE id = 1)")
+    agora, marca = cursor.fetchone()
+    desde = None if completa or marca is None else marca - timedelta(seconds=INTEGRIDADE_SOBREPOSICAO)
+    filtros = _filtros_novos(cursor, schema, desde)
+
+    encontrados = resolvidos = 0
+    for tipo, (acao, tabelas, candidatos, ainda_vale) in VERIFICACOES.items():
+        if not all(schema_cache.existe(cursor, schema, t) for t in tabelas): continue
+        cursor.execute(f"""
+            INSERT INTO {schema}.integrity_issues (tipo, id_alvo, acao, msg)
+            SELECT %s, c.id_alvo, %s, c.msg
+            FROM ({candidatos.format(s=schema, **filtros)}) AS c(id_alvo, msg)
+            ON CONFLICT (tipo, id_alvo) DO UPDATE SET
+                msg = EXCLUDED.msg, visto_em = NOW(), resolvido_em = NULL,
+                detectado_em = CASE WHEN {schema}.integrity_issues.resolvido_em IS NULL
+                                    THEN {schema}.integrity_issues.detectado_em ELSE NOW() END
+        """, (tipo, acao))
+        encontrados += cursor.rowcount
+        cursor.execute(f"""
+            UPDATE {schema}.integrity_issues i SET resolvido_em = NOW()
+            WHERE i.tipo = %s AND i.resolvido_em IS NULL AND NOT ({ainda_vale.format(s=schema)})
+        """, (tipo,))
+        resolvidos += cursor.rowcount
+
+    cursor.execute(f"DELETE FROM {schema}.integrity_issues WHERE resolvido_em < NOW() - make_interval(days => %s)",
+                   (INTEGRIDADE_RETER_DIAS,))
+    cursor.execute(f"""
+        INSERT INTO {schema}.integrity_watermark (id, ate) VALUES (1, %s)
+        ON CONFLICT (id) DO UPDATE SET ate = EXCLUDED.ate
+    """, (agora,))
+    conn.commit()
+    return {"encontrados": encontrados, "resolvidos": resolvidos}
+
+
+# --- PASSADAS EM SEGUNDO PLANO ---
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="integridade")
+_estado = {}   # schema -> [última passada (monotonic), já agendada]
+_lock = threading.Lock()
+
+
+def agendar(schema: str):
+    """
+    Pede uma passada para a loja (após o commit de um lote). Pedidos que
+    chegam com uma já agendada são absorvidos por ela.
+    """
+    with _lock:
+        estado = _estado.setdefault(schema, [0.0, False])
+        if estado[1]: return
+        estado[1] = True
+        atraso = max(0.0, estado[0] + INTEGRIDADE_INTERVALO - time.monotonic())
+    temporizador = threading.Timer(atraso, _executor.submit, (_rodar, schema))
+    temporizador.daemon = True
+    temporizador.start()
+
+
+def _rodar(schema: str):
+    with _lock: _estado[schema] = [time.monotonic(), False]
+    try:
+        with conexao() as conn:
+            verificar(conn, schema)
+    except Exception as e:
+        print(f"Erro integridade {schema}: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--schema")
+    parser.add_argument("--completa", action="store_true")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if args.schema:
+            schemas = [args.schema]
+        else:
+            cursor.execute("SELECT schema_name FROM public.lojas_sincronizadas ORDER BY schema_name")
+            schemas = [r[0] for r in cursor.fetchall()]
+
+        for schema in schemas:
+            try:
+                resultado = verificar(conn, schema, args.completa)
+                print(f"{schema}: {resultado if resultado is not None else 'passada em andamento, ignorada'}")
+            except Exception as e:
+                conn.rollback()
+                print(f"Erro na integridade de {schema}: {e}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from database_utils import init_master_table
+from fastapi.responses import JSONResponse
+from database_utils import init_master_table, pool
+from db_pool import PoolEsgotadoError
+import notificacoes
+import executor_sync
+import fila_ingestao
 # Importa os 3 roteadores
-from routers import admin, sync, reports , integrity
+from routers import admin, sync, reports , integrity, consolidado
 
 app = FastAPI(title="Dashboard API Multi-Tenant")
 
@@ -17,13 +22,29 @@ app.add_middleware(
 
 @app.on_event("startup")
 def startup():
+    pool.abrir()  # Espera o banco subir apenas aqui, nunca durante uma requisição
     init_master_table()
+    notificacoes.iniciar()  # LISTEN deste worker (invalidação de caches entre workers)
+    fila_ingestao.iniciar() # Aplicadores da fila de lotes assíncronos
+
+@app.on_event("shutdown")
+def shutdown():
+    fila_ingestao.parar()
+    notificacoes.parar()
+    executor_sync.encerrar()
+    pool.fechar()
+
+# Pool sem conexão livre: devolve 503 rápido em vez de segurar a requisição
+@app.exception_handler(PoolEsgotadoError)
+async def pool_esgotado(request: Request, exc: PoolEsgotadoError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "2"})
 
 # Registra as rotas
 app.include_router(admin.router, prefix="/api")   # Criar Cliente
 app.include_router(sync.router, prefix="/api")    # Receber Dados
 app.include_router(reports.router, prefix="/api") # Gerar Relatórios
 app.include_router(integrity.router, prefix="/api") # <--- CORRIGIDO AQUI
+app.include_router(consolidado.router, prefix="/api") # Relatórios de várias lojas
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,179 @@
+"""
+Migração online das colunas TEXT dos tenants para os tipos de tipos_colunas.py.
+
+Uso (a partir de server/, com as variáveis DB_* do ambiente):
+    python migrar_tipos.py                      # todas as lojas
+    python migrar_tipos.py --schema loja_x      # uma loja
+    python migrar_tipos.py --verificar          # só lista o que seria convertido
+
+Para cada coluna, sem travar a tabela durante a cópia:
+1. cria a coluna sombra '<coluna>__tipado' (sem reescrita da tabela) e um
+   trigger que a preenche em todo INSERT/UPDATE, gravando valores
+   malformados em rejeitados_ingestao;
+2. percorre a tabela em lotes por uuid_id (commit a cada lote), reescrevendo
+   a coluna para o trigger converter;
+3. troca as colunas numa transação curta (DROP COLUMN + RENAME, só catálogo)
+   com lock_timeout; se a tabela estiver ocupada, tenta de novo.
+Ao final avisa os workers da API (NOTIFY) para relerem os metadados.
+O DROP COLUMN leva junto os índices que incluem a coluna: rode
+indices_relatorios.py depois para recriá-los.
+Pode ser interrompido e executado de novo: retoma da etapa em que parou.
+"""
+import argparse
+import time
+
+from database_utils import get_db_connection
+from tipos_colunas import TIPOS_COLUNAS, colunas_tipadas, sql_tabela_rejeitados, familia_tipo
+import schema_cache
+import notificacoes
+
+
+def criar_conversores(cursor):
+    """ public.texto_para_<tipo>(text): NULL quando o valor não converte. """
+    for tipo in sorted({t for colunas in TIPOS_COLUNAS.values() for t in colunas.values()}):
+        valor = "replace(btrim(v), ',', '.')" if tipo == "NUMERIC" else "btrim(v)"
+        cursor.execute(f"""
+            CREATE OR REPLACE FUNCTION public.texto_para_{tipo.lower()}(v text) RETURNS {tipo} AS $$
+            BEGIN
+                RETURN NULLIF({valor}, '')::{tipo};
+            EXCEPTION WHEN others THEN
+                RETURN NULL;
+            END $$ LANGUAGE plpgsql IMMUTABLE
+        """)
+
+
+def pendentes(cursor, schema):
+    """ [(tabela, coluna, tipo)] ainda em texto no tenant. """
+    lista = []
+    for tabela, colunas in TIPOS_COLUNAS.items():
+        meta = schema_cache.carregar_tabela(cursor, schema, tabela)
+        if not meta: continue
+        tipadas = colunas_tipadas(meta)
+        for coluna, tipo in colunas.items():
+            if coluna in meta["colunas"] and tipadas.get(coluna) != familia_tipo(tipo):
+                lista.append((tabela, coluna, tipo))
+    return lista
+
+
+def preparar_sombra(conn, schema, tabela, coluna, tipo):
+    cursor = conn.cursor()
+    sombra = f"{coluna}__tipado"
+    funcao = f"{schema}.tipar_{tabela}_{coluna}"
+    cursor.execute("SET lock_timeout = '5s'")
+    cursor.execute(sql_tabela_rejeitados(schema))
+    cursor.execute(f"ALTER TABLE {schema}.{tabela} ADD COLUMN IF NOT EXISTS {sombra} {tipo}")
+    cursor.execute(f"""
+        CREATE OR REPLACE FUNCTION {funcao}() RETURNS trigger AS $$
+        BEGIN
+            NEW.{sombra} := public.texto_para_{tipo.lower()}(NEW.{coluna}::text);
+            IF NEW.{sombra} IS NULL AND NULLIF(btrim(NEW.{coluna}::text), '') IS NOT NULL THEN
+                INSERT INTO {schema}.rejeitados_ingestao (tabela, id_original, motivo, registro)
+                VALUES (TG_TABLE_NAME, to_jsonb(NEW) ->> 'id_original',
+                        format('%s: valor ''%s'' inválido para %s (migração)', '{coluna}', NEW.{coluna}, '{tipo}'),
+                        to_jsonb(NEW) - '{sombra}');
+            END IF;
+            RETURN NEW;
+        END $$ LANGUAGE plpgsql
+    """)
+    cursor.execute(f"DROP TRIGGER IF EXISTS trg_tipar_{coluna} ON {schema}.{tabela}")
+    cursor.execute(f"""
+        CREATE TRIGGER trg_tipar_{coluna} BEFORE INSERT OR UPDATE ON {schema}.{tabela}
+        FOR EACH ROW EXECUTE FUNCTION {funcao}()
+    """)
+    conn.commit()
+
+
+def copiar_em_lotes(conn, schema, tabela, coluna, tamanho, pausa):
+    cursor = conn.cursor()
+    sombra = f"{coluna}__tipado"
+    ultimo = None
+    total = 0
+    while True:
+        cursor.execute(f"""
+            SELECT uuid_id FROM {schema}.{tabela}
+            WHERE %s::uuid IS NULL OR uuid_id > %s::uuid
+            ORDER BY uuid_id LIMIT %s
+        """, (ultimo, ultimo, tamanho))
+        ids = [r[0] for r in cursor.fetchall()]
+        if not ids: break
+        # Reescreve a própria coluna: o trigger preenche a sombra
+        cursor.execute(f"""
+            UPDATE {schema}.{tabela} SET {coluna} = {coluna}
+            WHERE uuid_id = ANY(%s::uuid[]) AND {sombra} IS NULL AND {coluna} IS NOT NULL
+        """, (ids,))
+        conn.commit()
+        total += len(ids)
+        ultimo = ids[-1]
+        print(f"   {schema}.{tabela}.{coluna}: {total} linhas", end="\r", flush=True)
+        if pausa: time.sleep(pausa)
+    print()
+
+
+def trocar_colunas(conn, schema, tabela, coluna, tentativas=20):
+    cursor = conn.cursor()
+    sombra = f"{coluna}__tipado"
+    for tentativa in range(tentativas):
+        try:
+            cursor.execute("SET lock_timeout = '2s'")
+            cursor.execute(f"DROP TRIGGER IF EXISTS trg_tipar_{coluna} ON {schema}.{tabela}")
+            cursor.execute(f"ALTER TABLE {schema}.{tabela} DROP COLUMN {coluna}")
+            cursor.execute(f"ALTER TABLE {schema}.{tabela} RENAME COLUMN {sombra} TO {coluna}")
+            cursor.execute(f"DROP FUNCTION IF EXISTS {schema}.tipar_{tabela}_{coluna}()")
+            notificacoes.publicar(cursor, schema_cache.CANAL_SCHEMA, schema)
+            conn.commit()
+            return True
+        except Exception as e:
+            conn.rollback()
+            print(f"   Tabela ocupada ({e.__class__.__name__}), tentando de novo...")
+            time.sleep(min(30, 2 ** tentativa))
+    return False
+
+
+def migrar_schema(conn, schema, args):
+    cursor = conn.cursor()
+    lista = pendentes(cursor, schema)
+    conn.rollback()
+    if not lista:
+        print(f"{schema}: nada a converter")
+        return
+    for tabela, coluna, tipo in lista:
+        print(f"{schema}.{tabela}.{coluna}: TEXT -> {tipo}")
+        if args.verificar: continue
+        preparar_sombra(conn, schema, tabela, coluna, tipo)
+        copiar_em_lotes(conn, schema, tabela, coluna, args.lote, args.pausa)
+        if not trocar_colunas(conn, schema, tabela, coluna):
+            print(f"   Não foi possível trocar {schema}.{tabela}.{coluna}; o trigger segue ativo, rode de novo.")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--schema")
+    parser.add_argument("--lote", type=int, default=5000)
+    parser.add_argument("--pausa", type=float, default=0.05, help="Segundos entre lotes")
+    parser.add_argument("--verificar", action="store_true")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if args.schema:
+            schemas = [args.schema]
+        else:
+            cursor.execute("SELECT schema_name FROM public.lojas_sincronizadas ORDER BY schema_name")
+            schemas = [r[0] for r in cursor.fetchall()]
+        if not args.verificar:
+            criar_conversores(cursor)
+        conn.commit()
+
+        for schema in schemas:
+            try:
+                migrar_schema(conn, schema, args)
+            except Exception as e:
+                conn.rollback()
+                print(f"Erro migrando {schema}: {e}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import select
+import threading
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from database_utils import DB_DSN
+
+# Arquivo: server/notificacoes.py
+# Um LISTEN por worker: uma thread com conexão dedicada (fora do pool)
+# recebe os NOTIFY do Postgres e repassa para os handlers registrados.
+# É assim que caches locais de um worker ficam sabendo de alterações
+# feitas por outro worker.
+
+_handlers = {}   # canal -> [funcao(payload)]
+_parar = threading.Event()
+_thread = None
+
+
+def registrar(canal: str, funcao):
+    """
+    Registra um handler para o canal. Deve ser chamado antes de iniciar().
+    O handler recebe o payload (str) ou None quando a conexão do listener
+    caiu e eventos podem ter sido perdidos (o handler deve limpar seu cache).
+    """
+    _handlers.setdefault(canal, []).append(funcao)
+
+
+def publicar(cursor, canal: str, payload: str = ""):
+    """
+    Publica dentro da transação do chamador: o Postgres só entrega no commit
+    (e descarta no rollback).
+    """
+    cursor.execute("SELECT pg_notify(%s, %s)", (canal, payload))
+
+
+def _despachar(canal, payload):
+    for funcao in _handlers.get(canal, []):
+        try:
+            funcao(payload)
+        except Exception as e:
+            print(f"Erro notificação {canal}: {e}")
+
+
+def _loop():
+    while not _parar.is_set():
+        conn = None
+        try:
+            conn = psycopg2.connect(DB_DSN, connect_timeout=5)
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            cursor = conn.cursor()
+            for canal in _handlers:
+                cursor.execute(f'LISTEN "{canal}"')
+
+            # Enquanto estávamos desconectados nada foi recebido
+            for canal in list(_handlers):
+                _despachar(canal, None)
+
+            while not _parar.is_set():
+                if select.select([conn], [], [], 5)[0]:
+                    conn.poll()
+                    while conn.notifies:
+                        n = conn.notifies.pop(0)
+                        _despachar(n.channel, n.payload)
+        except Exception as e:
+            print(f"Erro listener de notificações: {e}")
+            _parar.wait(2)
+        finally:
+            if conn is not None:
+                try: conn.close()
+                except Exception: pass
+
+
+def iniciar():
+    global _thread
+    if _thread is not None or not _handlers: return
+    _parar.clear()
+    _thread = threading.Thread(target=_loop, name="listener-notify", daemon=True)
+    _thread.start()
+
+
+def parar():
+    global _thread
+    _parar.set()
+    if _thread is not None:
+        _thread.join(timeout=10)
+    _thread = None
@@ -0,0 +1,386 @@
+"""
+Modo opcional de armazenamento: saida e saida_produto particionadas por mês.
+
+Uso (a partir de server/, com as variáveis DB_* do ambiente):
+    python particionamento.py --schema loja_x            # converte uma loja
+    python particionamento.py --schema loja_x --verificar
+    python particionamento.py --manter                   # só cria partições futuras (todas as lojas particionadas)
+
+As tabelas viram RANGE ("data") com uma partição por mês (<tabela>_pAAAAMM)
+e uma partição padrão (<tabela>_padrao) para datas nulas. saida_produto
+ganha a coluna "data", cópia da data da venda, mantida pelo upsert.
+
+Sem índice único em id_original (no Postgres ele teria de incluir "data"),
+o upsert de tabela particionada (bulk_upsert) faz UPDATE + INSERT a partir
+da staging, serializado por loja/tabela; a venda que muda de data muda de
+partição no próprio UPDATE. As partições dos meses do lote e dos próximos
+PARTICOES_MESES_A_FRENTE meses são criadas na mesma transação do lote.
+
+Conversão de uma loja existente, sem parar o sync (como migrar_tipos.py):
+1. cria <tabela>__part com as mesmas colunas e índices (não únicos), as
+   partições de todos os meses com venda e um trigger na tabela antiga que
+   espelha INSERT/UPDATE/DELETE na nova;
+2. copia as linhas em lotes por uuid_id (commit a cada lote);
+3. troca as tabelas numa transação curta com lock_timeout (DROP da antiga +
+   RENAME da nova) e avisa os workers (NOTIFY) para relerem os metadados.
+Requer os tipos já convertidos (migrar_tipos.py). Pode ser executado de
+novo: retoma da etapa em que parou.
+"""
+import argparse
+import os
+import time
+from datetime import date
+
+from database_utils import get_db_connection
+import schema_cache
+import notificacoes
+
+PARTICOES_MESES_A_FRENTE = int(os.getenv("PARTICOES_MESES_A_FRENTE", "3"))
+
+# tabela -> (tabela de onde vem a data, coluna de ligação) ou None se a data é própria
+TABELAS = {
+    "saida": None,
+    "saida_produto": ("saida", "id_saida"),
+}
+
+
+def particionada(meta) -> bool:
+    return bool(meta and meta.get("particionada"))
+
+
+def _mes(d) -> date:
+    return date(d.year, d.month, 1)
+
+
+def _proximo_mes(d: date) -> date:
+    return date(d.year + d.month // 12, d.month % 12 + 1, 1)
+
+
+def meses_futuros(quantidade: int = None):
+    mes = _mes(date.today())
+    lista = [mes]
+    for _ in range(PARTICOES_MESES_A_FRENTE if quantidade is None else quantidade):
+        mes = _proximo_mes(mes)
+        lista.append(mes)
+    return lista
+
+
+def nome_particao(tabela: str, mes: date) -> str:
+    return f"{tabela}_p{mes:%Y%m}"
+
+
+# --- PARTIÇÕES ---
+def criar_particao(cursor, schema: str, tabela: str, mes: date, pai: str = None):
+    """
+    Cria a partição do mês. Linhas do mês que tenham caído na partição
+    padrão são movidas para ela antes do ATTACH.
+    """
+    pai = pai or tabela
+    particao = nome_particao(tabela, mes)
+    fim = _proximo_mes(mes)
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {schema}.{particao} (LIKE {schema}.{pai} INCLUDING DEFAULTS)")
+    cursor.execute(f"""
+        WITH movidas AS (
+            DELETE FROM {schema}.{tabela}_padrao WHERE "data" >= %s AND "data" < %s RETURNING *
+        )
+        INSERT INTO {schema}.{particao} SELECT * FROM movidas
+    """, (mes, fim))
+    cursor.execute(f"ALTER TABLE {schema}.{pai} ATTACH PARTITION {schema}.{particao} FOR VALUES FROM (%s) TO (%s)",
+                   (mes, fim))
+
+
+def garantir_particoes(cursor, schema: str, tabela: str, meses, pai: str = None):
+    """
+    Cria as partições que faltam entre os meses informados e os próximos
+    meses, na transação do chamador.
+    """
+    meses = sorted(set(meses) | set(meses_futuros()))
+    nomes = [f"{schema}.{nome_particao(tabela, m)}" for m in meses]
+    cursor.execute("SELECT n FROM unnest(%s::text[]) AS n WHERE to_regclass(n) IS NULL", (nomes,))
+    faltando = {r[0] for r in cursor.fetchall()}
+    if not faltando: return 0
+
+    # Dois lotes da mesma loja não criam a mesma partição ao mesmo tempo
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"{schema}:particoes:{tabela}",))
+    criadas = 0
+    for mes, nome in zip(meses, nomes):
+        if nome not in faltando: continue
+        cursor.execute("SELECT to_regclass(%s) IS NULL", (nome,))
+        if cursor.fetchone()[0]:
+            criar_particao(cursor, schema, tabela, mes, pai)
+            criadas += 1
+    return criadas
+
+
+# --- UPSERT (chamado por bulk_upsert) ---
+def preparar_staging(cursor, schema: str, tabela: str, stg: str, colunas):
+    """
+    Completa a staging com a data das linhas (itens: data da venda) e cria
+    as partições dos meses do lote. Retorna as colunas a aplicar.
+    """
+    origem = TABELAS.get(tabela)
+    if origem and "id_saida" in colunas:
+        tabela_origem, ligacao = origem
+        if "data" not in colunas:
+            cursor.execute(f'ALTER TABLE {stg} ADD COLUMN "data" TIMESTAMP')
+            colunas = colunas + ["data"]
+        cursor.execute(f"""
+            UPDATE {stg} o SET "data" = v."data"
+            FROM {schema}.{tabela_origem} v WHERE v.id_original = o.{ligacao}
+        """)
+
+    meses = []
+    if "data" in colunas:
+        cursor.execute(f"""SELECT DISTINCT date_trunc('month', "data")::date FROM {stg} WHERE "data" IS NOT NULL""")
+        meses = [r[0] for r in cursor.fetchall()]
+    garantir_particoes(cursor, schema, tabela, meses)
+    return colunas
+
+
+def realinhar_derivadas(cursor, schema: str, tabela: str, stg: str):
+    """
+    Depois do merge de vendas: itens das vendas do lote acompanham a data
+    (e a partição) da venda.
+    """
+    for derivada, origem in TABELAS.items():
+        if not origem or origem[0] != tabela: continue
+        if not particionada(schema_cache.obter_tabela(cursor, schema, derivada)): continue
+        _, ligacao = origem
+        cursor.execute(f"""
+            SELECT DISTINCT date_trunc('month', v."data")::date
+            FROM {stg} o JOIN {schema}.{tabela} v ON v.id_original = o.id_original
+            WHERE v."data" IS NOT NULL
+        """)
+        garantir_particoes(cursor, schema, derivada, [r[0] for r in cursor.fetchall()])
+        cursor.execute(f"""
+            UPDATE {schema}.{derivada} d SET "data" = v."data"
+            FROM {stg} o JOIN {schema}.{tabela} v ON v.id_original = o.id_original
+            WHERE d.{ligacao} = v.id_original AND d."data" IS DISTINCT FROM v."data"
+        """)
+
+
+# --- CONVERSÃO ---
+def _indices(cursor, schema: str, tabela: str):
+    """ [(nome, definição)] dos índices da tabela. """
+    cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = %s AND tablename = %s",
+                   (schema, tabela))
+    return cursor.fetchall()
+
+
+def preparar(cursor, schema: str, tabela: str, espelhar: bool = True):
+    """
+    Cria <tabela>__part (partições, índices com sufixo __p) e, com espelhar,
+    o trigger que replica na nova as escritas feitas na antiga.
+    """
+    nova = f"{tabela}__part"
+    origem = TABELAS[tabela]
+    if origem:
+        cursor.execute(f'ALTER TABLE {schema}.{tabela} ADD COLUMN IF NOT EXISTS "data" TIMESTAMP')
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS {schema}.{nova} (LIKE {schema}.{tabela} INCLUDING DEFAULTS) PARTITION BY RANGE ("data")')
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {schema}.{tabela}_padrao PARTITION OF {schema}.{nova} DEFAULT")
+
+    # Meses com venda: do menor ao maior (pelo índice em "data")
+    cursor.execute(f'SELECT MIN("data"), MAX("data") FROM {schema}.saida')
+    menor, maior = cursor.fetchone()
+    meses = []
+    if menor and maior:
+        mes = _mes(menor)
+        while mes <= _mes(maior):
+            meses.append(mes)
+            mes = _proximo_mes(mes)
+    garantir_particoes(cursor, schema, tabela, meses, pai=nova)
+
+    # Mesmos índices, sem unicidade (teria de incluir "data"); o de
+    # id_original é o que o upsert procura (schema_cache.indice_id)
+    for nome, definicao in _indices(cursor, schema, tabela) + [(f"idx_{tabela}_id_original", None)]:
+        if definicao is None:
+            definicao = f"CREATE INDEX {nome} ON {schema}.{tabela} USING btree (id_original)"
+        definicao = definicao.replace("CREATE UNIQUE INDEX", "CREATE INDEX", 1)
+        definicao = definicao.replace(f"CREATE INDEX {nome} ON {schema}.{tabela} ",
+                                      f"CREATE INDEX IF NOT EXISTS {nome}__p ON {schema}.{nova} ", 1)
+        cursor.execute(definicao)
+
+    if not espelhar: return
+    if origem:
+        tabela_origem, ligacao = origem
+        cursor.execute(f"""
+            CREATE OR REPLACE FUNCTION {schema}.data_{tabela}() RETURNS trigger AS $$
+            BEGIN
+                NEW."data" := (SELECT v."data" FROM {schema}.{tabela_origem} v WHERE v.id_original = NEW.{ligacao} LIMIT 1);
+                RETURN NEW;
+            END $$ LANGUAGE plpgsql
+        """)
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_data_particao ON {schema}.{tabela}")
+        cursor.execute(f"""
+            CREATE TRIGGER trg_data_particao BEFORE INSERT OR UPDATE ON {schema}.{tabela}
+            FOR EACH ROW EXECUTE FUNCTION {schema}.data_{tabela}()
+        """)
+    cursor.execute(f"""
+        CREATE OR REPLACE FUNCTION {schema}.espelhar_{tabela}() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                DELETE FROM {schema}.{nova} WHERE uuid_id = OLD.uuid_id;
+            END IF;
+            IF TG_OP <> 'DELETE' THEN
+                INSERT INTO {schema}.{nova} SELECT (NEW).*;
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+    """)
+    cursor.execute(f"DROP TRIGGER IF EXISTS trg_espelhar_particao ON {schema}.{tabela}")
+    cursor.execute(f"""
+        CREATE TRIGGER trg_espelhar_particao AFTER INSERT OR UPDATE OR DELETE ON {schema}.{tabela}
+        FOR EACH ROW EXECUTE FUNCTION {schema}.espelhar_{tabela}()
+    """)
+
+
+def copiar_em_lotes(conn, schema: str, tabela: str, tamanho: int, pausa: float):
+    cursor = conn.cursor()
+    nova = f"{tabela}__part"
+    colunas = list(schema_cache.carregar_tabela(cursor, schema, tabela)["colunas"])
+    origem = TABELAS[tabela]
+    valores = ", ".join(f'v."data"' if origem and c == "data" else f"t.{c}" for c in colunas)
+    juncao = f"LEFT JOIN {schema}.{origem[0]} v ON v.id_original = t.{origem[1]}" if origem else ""
+    ultimo = None
+    total = 0
+    while True:
+        # Trava o lote: uma escrita concorrente espera (ou já foi espelhada)
+        cursor.execute(f"""
+            SELECT uuid_id FROM {schema}.{tabela}
+            WHERE %s::uuid IS NULL OR uuid_id > %s::uuid
+            ORDER BY uuid_id LIMIT %s FOR UPDATE
+        """, (ultimo, ultimo, tamanho))
+        ids = [r[0] for r in cursor.fetchall()]
+        if not ids: break
+        cursor.execute(f"""
+            INSERT INTO {schema}.{nova} ({", ".join(colunas)})
+            SELECT {valores} FROM {schema}.{tabela} t {juncao}
+            WHERE t.uuid_id = ANY(%s::uuid[])
+              AND NOT EXISTS (SELECT 1 FROM {schema}.{nova} n WHERE n.uuid_id = t.uuid_id)
+        """, (ids,))
+        conn.commit()
+        total += len(ids)
+        ultimo = ids[-1]
+        print(f"   {schema}.{tabela}: {total} linhas", end="\r", flush=True)
+        if pausa: time.sleep(pausa)
+    print()
+
+
+def trocar(cursor, schema: str, tabela: str):
+    """ DROP da antiga + RENAME da nova e dos índices. Na transação do chamador. """
+    nova = f"{tabela}__part"
+    indices = [nome for nome, _ in _indices(cursor, schema, nova) if nome.endswith("__p")]
+    cursor.execute(f"LOCK TABLE {schema}.{tabela} IN ACCESS EXCLUSIVE MODE")
+    cursor.execute(f"DROP TABLE {schema}.{tabela}")
+    cursor.execute(f"DROP FUNCTION IF EXISTS {schema}.espelhar_{tabela}()")
+    cursor.execute(f"DROP FUNCTION IF EXISTS {schema}.data_{tabela}()")
+    cursor.execute(f"ALTER TABLE {schema}.{nova} RENAME TO {tabela}")
+    for nome in indices:
+        cursor.execute(f"ALTER INDEX {schema}.{nome} RENAME TO {nome[:-3]}")
+    notificacoes.publicar(cursor, schema_cache.CANAL_SCHEMA, schema)
+    schema_cache.invalidar(schema, tabela)
+
+
+def particionar_vazia(cursor, schema: str):
+    """
+    Loja nova: converte as tabelas ainda vazias na própria transação.
+    Retorna False (sem mexer em nada) se alguma já tem linhas.
+    """
+    for tabela in TABELAS:
+        cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {schema}.{tabela})")
+        if cursor.fetchone()[0]: return False
+    for tabela in TABELAS:
+        if particionada(schema_cache.carregar_tabela(cursor, schema, tabela)): continue
+        preparar(cursor, schema, tabela, espelhar=False)
+        trocar(cursor, schema, tabela)
+    return True
+
+
+def converter(conn, schema: str, tabela: str, args, tentativas: int = 20):
+    cursor = conn.cursor()
+    if particionada(schema_cache.carregar_tabela(cursor, schema, tabela)):
+        conn.rollback()
+        print(f"{schema}.{tabela}: já particionada")
+        return True
+    print(f"{schema}.{tabela}: particionando por mês")
+    if args.verificar:
+        conn.rollback()
+        return True
+
+    cursor.execute("SET lock_timeout = '5s'")
+    preparar(cursor, schema, tabela)
+    conn.commit()
+    copiar_em_lotes(conn, schema, tabela, args.lote, args.pausa)
+
+    for tentativa in range(tentativas):
+        try:
+            cursor.execute("SET lock_timeout = '2s'")
+            trocar(cursor, schema, tabela)
+            conn.commit()
+            break
+        except Exception as e:
+            conn.rollback()
+            print(f"   Tabela ocupada ({e.__class__.__name__}), tentando de novo...")
+            time.sleep(min(30, 2 ** tentativa))
+    else:
+        print(f"   Não foi possível trocar {schema}.{tabela}; o espelhamento segue ativo, rode de novo.")
+        return False
+
+    origem = TABELAS[tabela]
+    if origem:
+        # Vendas que mudaram de data durante a cópia
+        cursor.execute(f"""
+            UPDATE {schema}.{tabela} d SET "data" = v."data" FROM {schema}.{origem[0]} v
+            WHERE d.{origem[1]} = v.id_original AND d."data" IS DISTINCT FROM v."data"
+        """)
+        conn.commit()
+    return True
+
+
+def main():
+    from migrar_tipos import pendentes
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--schema")
+    parser.add_argument("--manter", action="store_true", help="Só cria as partições dos próximos meses")
+    parser.add_argument("--lote", type=int, default=5000)
+    parser.add_argument("--pausa", type=float, default=0.05, help="Segundos entre lotes")
+    parser.add_argument("--verificar", action="store_true")
+    args = parser.parse_args()
+    if not args.schema and not args.manter:
+        parser.error("informe --schema (conversão é opcional, loja a loja) ou --manter")
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if args.schema:
+            schemas = [args.schema]
+        else:
+            cursor.execute("SELECT schema_name FROM public.lojas_sincronizadas ORDER BY schema_name")
+            schemas = [r[0] for r in cursor.fetchall()]
+        conn.commit()
+
+        for schema in schemas:
+            try:
+                if args.manter:
+                    for tabela in TABELAS:
+                        if particionada(schema_cache.carregar_tabela(cursor, schema, tabela)):
+                            criadas = garantir_particoes(cursor, schema, tabela, [])
+                            if criadas: print(f"{schema}.{tabela}: {criadas} partições criadas")
+                    conn.commit()
+                    continue
+                if pendentes(cursor, schema):
+                    conn.rollback()
+                    print(f"{schema}: converta os tipos antes (migrar_tipos.py)")
+                    continue
+                for tabela in TABELAS:
+                    if not converter(conn, schema, tabela, args): break
+            except Exception as e:
+                conn.rollback()
+                print(f"Erro particionando {schema}: {e}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
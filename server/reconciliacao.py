@@ -0,0 +1,118 @@
+from datetime import date, timedelta
+
+from fastapi import HTTPException
+
+from tipos_colunas import expressoes_tipadas
+import particionamento
+import schema_cache
+
+# Arquivo: server/reconciliacao.py
+# Conferência entre o Firebird da loja e a cópia na nuvem por digestos de
+# faixa (estilo árvore de Merkle), sem reenviar dados:
+#
+#   mes -> dia -> venda
+#
+# O agente manda o digesto de cada faixa do nível; o servidor calcula os
+# mesmos digestos e devolve só as chaves que não batem. O agente desce um
+# nível nas divergentes e, nas vendas, remarca SYNK_DASH_PEND = 'S' apenas
+# nas que diferem. Um ano sem divergência custa 12 digestos de ida. Dia com
+# mais vendas que RECONCILIAR_MAX_CHAVES vai em faixas de id [id_de, id_ate).
+#
+# Digesto de uma faixa: [vendas, soma dos totais em centavos, md5 das
+# assinaturas das vendas em ordem de id (bytes, COLLATE "C")]. Assinatura:
+#
+#   id:eliminado:normal:total:qtd_itens:itens:qtd_pagamentos:pagamentos
+#
+# com valores em centavos (arredondados linha a linha, meio para longe do
+# zero) e texto vazio para nulo. O agente calcula exatamente o mesmo (ver
+# client/agente_sync.py); mudar a assinatura exige mudar os dois lados.
+
+NIVEIS = {
+    "mes": "to_char(v.dia, 'YYYY-MM')",
+    "dia": "to_char(v.dia, 'YYYY-MM-DD')",
+    "venda": "v.id",
+}
+RECONCILIAR_MAX_DIAS = 400      # Período por requisição (um ano com folga)
+RECONCILIAR_MAX_CHAVES = 5000   # Digestos por requisição (vendas de um dia)
+
+
+def validar(nivel: str, data_inicio: date, data_fim: date, digestos: dict):
+    if nivel not in NIVEIS:
+        raise HTTPException(400, f"Nível inválido: {nivel} (use {', '.join(NIVEIS)})")
+    if data_fim < data_inicio or (data_fim - data_inicio).days >= RECONCILIAR_MAX_DIAS:
+        raise HTTPException(400, f"Período inválido (fim >= início, até {RECONCILIAR_MAX_DIAS} dias)")
+    if len(digestos) > RECONCILIAR_MAX_CHAVES:
+        raise HTTPException(413, f"Máximo de {RECONCILIAR_MAX_CHAVES} digestos por requisição")
+
+
+def _filhos(cursor, schema: str, tabela: str, alias: str, valor: str, poda: str = ""):
+    """ Por venda do período: quantidade de linhas e soma em centavos da tabela filha. """
+    if not schema_cache.existe(cursor, schema, tabela):
+        return "SELECT NULL::text AS id_saida, 0 AS qtd, 0 AS centavos WHERE false"
+    return f"""
+        SELECT {alias}.id_saida, COUNT(*) AS qtd, SUM(round(COALESCE({valor}, 0) * 100))::bigint AS centavos
+        FROM {schema}.{tabela} {alias}
+        JOIN vendas v ON v.id = {alias}.id_saida
+        WHERE true {poda}
+        GROUP BY {alias}.id_saida
+    """
+
+
+def sql_digestos(cursor, schema: str, nivel: str, data_inicio: date, data_fim: date,
+                 id_de: str = None, id_ate: str = None) -> str:
+    """
+    chave, vendas, centavos, md5 de cada faixa do nível no período [início,
+    fim], opcionalmente só dos ids em [id_de, id_ate) na ordem "C".
+    """
+    x = expressoes_tipadas(cursor, schema)
+    periodo = (data_inicio, data_fim + timedelta(days=1))
+    faixa_ids = ""
+    if id_de is not None: faixa_ids += cursor.mogrify(' AND s.id_original COLLATE "C" >= %s', (id_de,)).decode()
+    if id_ate is not None: faixa_ids += cursor.mogrify(' AND s.id_original COLLATE "C" < %s', (id_ate,)).decode()
+    faixa_ids = faixa_ids.replace("%", "%%")  # Ainda passa pelo mogrify do período
+    poda = ""
+    if particionamento.particionada(schema_cache.obter_tabela(cursor, schema, "saida_produto")):
+        poda = cursor.mogrify('AND sp."data" >= %s AND sp."data" < %s', periodo).decode()
+
+    return cursor.mogrify(f"""
+        WITH vendas AS (
+            SELECT s.id_original AS id, {x['s_data']}::date AS dia,
+                   COALESCE(s.eliminado, '') AS eliminado, COALESCE(s.normal, '') AS normal,
+                   round(COALESCE({x['s_total']}, 0) * 100)::bigint AS centavos
+            FROM {schema}.saida s
+            WHERE {x['s_data']} >= %s AND {x['s_data']} < %s{faixa_ids}
+        ),
+        itens AS ({_filhos(cursor, schema, 'saida_produto', 'sp', x['sp_total'], poda)}),
+        pagamentos AS ({_filhos(cursor, schema, 'saida_formapag', 'sf', x['sf_valor'])})
+        SELECT {NIVEIS[nivel]} AS chave, COUNT(*), SUM(v.centavos)::bigint,
+               md5(string_agg(
+                   concat_ws(':', v.id, v.eliminado, v.normal, v.centavos,
+                             COALESCE(i.qtd, 0), COALESCE(i.centavos, 0),
+                             COALESCE(p.qtd, 0), COALESCE(p.centavos, 0)),
+                   E'\\n' ORDER BY v.id COLLATE "C"))
+        FROM vendas v
+        LEFT JOIN itens i ON i.id_saida = v.id
+        LEFT JOIN pagamentos p ON p.id_saida = v.id
+        GROUP BY 1
+    """, periodo).decode()
+
+
+def digestos(cursor, schema: str, nivel: str, data_inicio: date, data_fim: date,
+             id_de: str = None, id_ate: str = None) -> dict:
+    """ {chave: [vendas, centavos, md5]}; loja sem vendas ainda: vazio. """
+    if not schema_cache.existe(cursor, schema, "saida"): return {}
+    cursor.execute(sql_digestos(cursor, schema, nivel, data_inicio, data_fim, id_de, id_ate))
+    return {chave: [qtd, centavos, md5] for chave, qtd, centavos, md5 in cursor.fetchall()}
+
+
+def comparar(locais: dict, remotos: dict) -> dict:
+    """
+    divergentes: nos dois lados com digesto diferente (desce um nível);
+    ausentes: só no agente (reenviar a faixa inteira);
+    sobrando: só na nuvem (apagado na loja ou fora da data de corte).
+    """
+    return {
+        "divergentes": sorted(c for c in locais if c in remotos and list(locais[c]) != remotos[c]),
+        "ausentes": sorted(c for c in locais if c not in remotos),
+        "sobrando": sorted(c for c in remotos if c not in locais),
+    }
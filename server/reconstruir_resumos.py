@@ -0,0 +1,49 @@
+"""
+Reconstrói os resumos diários (resumos.py) a partir das tabelas brutas.
+
+Uso (a partir de server/, com as variáveis DB_* do ambiente):
+    python reconstruir_resumos.py                          # todas as lojas, histórico inteiro
+    python reconstruir_resumos.py --schema loja_x          # uma loja
+    python reconstruir_resumos.py --desde 2025-01-01       # só a partir da data (backfill parcial)
+
+Pode rodar com a API no ar: cada bloco de dias é uma transação curta e o
+sync continua mantendo os dias que tocar. Os relatórios passam a ler o
+resumo quando o período pedido começa em uma data coberta.
+"""
+import argparse
+from datetime import date
+
+from database_utils import get_db_connection
+import resumos
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--schema")
+    parser.add_argument("--desde", type=date.fromisoformat)
+    parser.add_argument("--dias-por-transacao", type=int, default=31)
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if args.schema:
+            schemas = [args.schema]
+        else:
+            cursor.execute("SELECT schema_name FROM public.lojas_sincronizadas ORDER BY schema_name")
+            schemas = [r[0] for r in cursor.fetchall()]
+        conn.commit()
+
+        for schema in schemas:
+            try:
+                qtd = resumos.reconstruir(conn, schema, args.desde, args.dias_por_transacao)
+                print(f"{schema}: {qtd} dias recalculados")
+            except Exception as e:
+                conn.rollback()
+                print(f"Erro reconstruindo {schema}: {e}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+from datetime import date
+from typing import List
+
+import schema_cache
+from tipos_colunas import expressoes_tipadas
+
+# Arquivo: server/resumos.py
+# Resumos diários por tenant ({schema}.resumo_diario), mantidos na mesma
+# transação do sync: cada lote que toca vendas recalcula os dias afetados a
+# partir das tabelas brutas (delete + insert do dia inteiro). Os relatórios
+# leem o resumo quando o período pedido está coberto.
+#
+# Uma linha por (dia, dimensão, chave, filtro):
+# - dimensões gravadas: dia, hora, terminal, usuario, pagamento, produto, vendedor;
+# - grupo, seção, fabricante e fornecedor saem do resumo de produto juntado
+#   ao cadastro atual, e o CMV sai de quant x custo atual do produto. Assim
+#   uma troca de grupo ou de custo no cadastro não deixa o resumo defasado,
+#   e o resultado é o mesmo da consulta nas tabelas brutas;
+# - filtro 'S' = normal nulo ou 'S' (rankings); 'O' = outros valores
+#   diferentes de 'N' (entram só nos cards). Eliminadas e normal = 'N' ficam fora.
+
+DIMENSOES_PRODUTO = {"produto", "grupo", "secao", "fabricante", "fornecedor"}
+RANKINGS = DIMENSOES_PRODUTO | {"dia", "hora", "terminal", "usuario", "pagamento", "vendedor"}
+
+
+def sql_tabelas_resumo(schema: str) -> str:
+    return f"""
+    CREATE TABLE IF NOT EXISTS {schema}.resumo_diario (
+        dia DATE NOT NULL,
+        dimensao VARCHAR(20) NOT NULL,
+        chave TEXT,
+        filtro CHAR(1) NOT NULL,
+        faturamento NUMERIC,
+        vendas INT,
+        itens INT,
+        quant NUMERIC,
+        maior NUMERIC,
+        menor NUMERIC
+    );
+    CREATE INDEX IF NOT EXISTS idx_resumo_dimensao_dia ON {schema}.resumo_diario (dimensao, dia);
+    CREATE INDEX IF NOT EXISTS idx_resumo_dia ON {schema}.resumo_diario (dia);
+
+    -- Resumo vale para dia >= desde (tenant novo: desde sempre)
+    CREATE TABLE IF NOT EXISTS {schema}.resumo_cobertura (
+        id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        desde DATE NOT NULL,
+        reconstruido_em TIMESTAMP DEFAULT NOW()
+    );
+    """
+
+
+def sql_cobertura_inicial(schema: str) -> str:
+    """ Tenant ainda sem vendas: o resumo nasce completo. Com vendas, só após reconstruir(). """
+    return f"""
+    INSERT INTO {schema}.resumo_cobertura (id, desde)
+    SELECT 1, '-infinity' WHERE NOT EXISTS (SELECT 1 FROM {schema}.saida)
+    ON CONFLICT (id) DO NOTHING;
+    """
+
+
+def ativo(cursor, schema: str) -> bool:
+    return schema_cache.obter_tabela(cursor, schema, "resumo_diario") is not None
+
+
+def cobre(cursor, schema: str, data_inicio: date) -> bool:
+    """ O período que começa em data_inicio pode ser lido do resumo? """
+    if not ativo(cursor, schema): return False
+    cursor.execute(f"SELECT desde <= %s FROM {schema}.resumo_cobertura WHERE id = 1", (data_inicio,))
+    r = cursor.fetchone()
+    return bool(r and r[0])
+
+
+# --- MANUTENÇÃO INCREMENTAL ---
+def dias_das_vendas(cursor, schema: str, ids_venda: List[str]):
+    if not ids_venda: return set()
+    cursor.execute(f"SELECT DISTINCT \"data\"::date FROM {schema}.saida WHERE id_original = ANY(%s) AND \"data\" IS NOT NULL",
+                   (list(ids_venda),))
+    return {r[0] for r in cursor.fetchall()}
+
+
+def dias_afetados(cursor, schema: str, tabela: str, dados: List[dict]):
+    """
+    Dias (das vendas) tocados pelo lote. Chamado antes do upsert (data antiga,
+    venda antiga do item) e depois (data nova).
+    """
+    if not dados: return set()
+    ids = [str(d["id_original"]) for d in dados if d.get("id_original") is not None]
+    if tabela == "saida":
+        return dias_das_vendas(cursor, schema, ids)
+
+    if schema_cache.obter_tabela(cursor, schema, tabela) is None: return set()
+    vendas = {str(d["id_saida"]) for d in dados if d.get("id_saida") is not None}
+    cursor.execute(f"SELECT DISTINCT id_saida FROM {schema}.{tabela} WHERE id_original = ANY(%s)", (ids,))
+    vendas |= {r[0] for r in cursor.fetchall() if r[0] is not None}
+    return dias_das_vendas(cursor, schema, list(vendas))
+
+
+def _coluna(meta, alias: str, coluna: str):
+    """ alias.coluna se existir na tabela; senão NULL (coluna ainda não sincronizada). """
+    return f"{alias}.{coluna}" if meta and coluna in meta["colunas"] else "NULL::text"
+
+
+def recalcular_dias(cursor, schema: str, dias):
+    """
+    Refaz o resumo dos dias informados a partir das tabelas brutas, na
+    transação do chamador.
+    """
+    dias = sorted(d for d in dias if d is not None)
+    if not dias or not ativo(cursor, schema): return 0
+
+    # Um dia por vez em toda a base: lotes concorrentes (outros workers,
+    # fila, reconstrução) não duplicam linhas. Ordem fixa evita deadlock.
+    for dia in dias:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"{schema}:resumo:{dia.isoformat()}",))
+
+    ms = schema_cache.obter_tabela(cursor, schema, "saida")
+    msp = schema_cache.obter_tabela(cursor, schema, "saida_produto")
+    msf = schema_cache.obter_tabela(cursor, schema, "saida_formapag")
+    x = expressoes_tipadas(cursor, schema)
+
+    eliminado, normal = _coluna(ms, "s", "eliminado"), _coluna(ms, "s", "normal")
+    hora = f"EXTRACT(HOUR FROM {x['s_hora']})::text" if ms and "hora" in ms["colunas"] else "NULL::text"
+
+    partes = [
+        "SELECT dia, 'dia', NULL, filtro, SUM(total), COUNT(*), NULL::int, NULL::numeric, MAX(total), MIN(total) FROM v GROUP BY 1, 3, 4",
+        "SELECT dia, 'hora', hora, filtro, SUM(total), COUNT(*), NULL::int, NULL::numeric, MAX(total), MIN(total) FROM v GROUP BY 1, 3, 4",
+        "SELECT dia, 'terminal', terminal, filtro, SUM(total), COUNT(*), NULL::int, NULL::numeric, MAX(total), MIN(total) FROM v GROUP BY 1, 3, 4",
+        "SELECT dia, 'usuario', usuario, filtro, SUM(total), COUNT(*), NULL::int, NULL::numeric, MAX(total), MIN(total) FROM v GROUP BY 1, 3, 4",
+    ]
+    ctes = [f"""v AS MATERIALIZED (
+            SELECT d.dia, s.id_original, {x['s_total']} AS total, {hora} AS hora,
+                   {_coluna(ms, 's', 'terminal')} AS terminal, {_coluna(ms, 's', 'id_usuario')} AS usuario,
+                   CASE WHEN {normal} IS NULL OR {normal} = 'S' THEN 'S' ELSE 'O' END AS filtro
+            FROM unnest(%s::date[]) AS d(dia)
+            JOIN {schema}.saida s ON s."data" >= d.dia AND s."data" < d.dia + 1
+            WHERE ({eliminado} IS NULL OR {eliminado} = 'N') AND ({normal} IS NULL OR {normal} <> 'N')
+        )"""]
+
+    if msp:
+        ctes.append(f"""i AS MATERIALIZED (
+            SELECT v.dia, v.filtro, sp.id_saida, sp.id_produto, {_coluna(msp, 'sp', 'id_vendedor')} AS vendedor,
+                   {x['sp_total']} AS total, {x['sp_quant']} AS quant
+            FROM v JOIN {schema}.saida_produto sp ON sp.id_saida = v.id_original
+        )""")
+        partes += [
+            "SELECT dia, 'produto', id_produto, filtro, SUM(total), COUNT(DISTINCT id_saida), COUNT(*), SUM(quant), MAX(total), MIN(total) FROM i GROUP BY 1, 3, 4",
+            "SELECT dia, 'vendedor', vendedor, filtro, SUM(total), COUNT(DISTINCT id_saida), COUNT(*), SUM(quant), MAX(total), MIN(total) FROM i GROUP BY 1, 3, 4",
+        ]
+    if msf:
+        partes.append(f"""SELECT v.dia, 'pagamento', sf.id_formapag, v.filtro, SUM({x['sf_valor']}), COUNT(DISTINCT v.id_original),
+                   NULL::int, NULL::numeric, MAX({x['sf_valor']}), MIN({x['sf_valor']})
+            FROM v JOIN {schema}.saida_formapag sf ON sf.id_saida = v.id_original GROUP BY 1, 3, 4""")
+
+    cursor.execute(f"DELETE FROM {schema}.resumo_diario WHERE dia = ANY(%s::date[])", (dias,))
+    cursor.execute(f"""
+        WITH {", ".join(ctes)}
+        INSERT INTO {schema}.resumo_diario (dia, dimensao, chave, filtro, faturamento, vendas, itens, quant, maior, menor)
+        {" UNION ALL ".join(partes)}
+    """, (dias,))
+    return len(dias)
+
+
+# --- LEITURA ---
+def cards(cursor, schema: str, data_inicio: date, data_fim: date, anterior=None):
+    """
+    (faturamento, vendas, maior, menor, itens, cmv) do período. Com
+    anterior=(início, fim), [atual, anterior] lidos na mesma consulta.
+    """
+    params = {"ini": data_inicio, "fim": data_fim}
+    periodos = ["ini"]
+    if anterior:
+        params.update(ant_ini=anterior[0], ant_fim=anterior[1])
+        periodos.append("ant_ini")
+    def filtro(p): return f"r.dia BETWEEN %({p})s AND %({p.replace('ini', 'fim')})s"
+    onde = " OR ".join(f"({filtro(p)})" for p in periodos)
+
+    colunas = ", ".join(
+        f"COALESCE(SUM(r.faturamento) FILTER (WHERE {filtro(p)}), 0), COALESCE(SUM(r.vendas) FILTER (WHERE {filtro(p)}), 0), "
+        f"COALESCE(MAX(r.maior) FILTER (WHERE {filtro(p)}), 0), COALESCE(MIN(r.menor) FILTER (WHERE {filtro(p)}), 0)"
+        for p in periodos)
+    cursor.execute(f"""
+        SELECT {colunas}
+        FROM {schema}.resumo_diario r
+        WHERE r.dimensao = 'dia' AND ({onde})
+    """, params)
+    capa = cursor.fetchone()
+
+    if schema_cache.obter_tabela(cursor, schema, "produto"):
+        x = expressoes_tipadas(cursor, schema)
+        cmv = f"r.quant * COALESCE({x['p_custo']}, 0)"
+        join_produto = f"LEFT JOIN {schema}.produto p ON r.chave = p.id_original"
+    else:
+        cmv, join_produto = "0", ""
+    colunas = ", ".join(
+        f"COALESCE(SUM(r.itens) FILTER (WHERE {filtro(p)}), 0), COALESCE(SUM({cmv}) FILTER (WHERE {filtro(p)}), 0)"
+        for p in periodos)
+    cursor.execute(f"""
+        SELECT {colunas}
+        FROM {schema}.resumo_diario r {join_produto}
+        WHERE r.dimensao = 'produto' AND ({onde})
+    """, params)
+    itens = cursor.fetchone()
+
+    resultado = [tuple(capa[4*i:4*i+4]) + tuple(itens[2*i:2*i+2]) for i in range(len(periodos))]
+    return resultado if anterior else resultado[0]
+
+
+def sql_ranking(cursor, schema: str, tipo: str, limit: int, comparativo: bool = False):
+    """
+    SQL equivalente ao ranking das tabelas brutas (mesmos nomes e mesma
+    ordem), lendo do resumo. Parâmetros nomeados: ini e fim (dia seguinte ao
+    fim); na comparação também ant_ini e ant_fim, e total/qtd viram os pares
+    (atual, anterior).
+    """
+    def existe(tabela): return schema_cache.obter_tabela(cursor, schema, tabela) is not None
+
+    dimensao = "produto" if tipo in DIMENSOES_PRODUTO else tipo
+    joins = ""
+    nome, total, qtd = "r.chave", "SUM(r.faturamento)", "SUM(r.vendas)"
+    ordem = f"GROUP BY 1 ORDER BY 2 DESC LIMIT {limit}"
+    filtro_extra = ""
+
+    if tipo in DIMENSOES_PRODUTO:
+        qtd = "SUM(r.quant)"
+        joins = f"LEFT JOIN {schema}.produto p ON r.chave = p.id_original"
+        if tipo == "produto":
+            nome = "COALESCE(p.nome, 'N/D')"
+        elif tipo == "grupo":
+            joins += f" LEFT JOIN {schema}.grupo g ON p.id_grupo = g.id_original"
+            nome = "COALESCE(g.nome, 'N/D')"
+        elif tipo == "secao":
+            joins += f" LEFT JOIN {schema}.grupo g ON p.id_grupo = g.id_original LEFT JOIN {schema}.secao sec ON g.id_secao = sec.id_original"
+            nome = "COALESCE(sec.nome, 'N/D')"
+        elif tipo == "fabricante":
+            joins += f" LEFT JOIN {schema}.fabricante fab ON p.id_fabricante = fab.id_original"
+            nome = "COALESCE(fab.nome, 'N/D')"
+        elif tipo == "fornecedor":
+            joins += f" LEFT JOIN {schema}.cliente f ON p.id_fornecedor = f.id_original"
+            nome = "COALESCE(f.nome, 'N/D')"
+    elif tipo == "hora":
+        nome, ordem = "r.chave || 'h'", "GROUP BY 1 ORDER BY 1 ASC"
+    elif tipo == "dia":
+        nome, ordem = "TO_CHAR(r.dia, 'DD/MM/YYYY')", "GROUP BY r.dia, 1 ORDER BY r.dia ASC"
+    elif tipo == "terminal":
+        nome = "COALESCE(r.chave, 'N/D')"
+    elif tipo == "usuario":
+        if existe("usuario_pdv"):
+            joins = f"LEFT JOIN {schema}.usuario_pdv u ON r.chave = u.id_original"
+            nome = "COALESCE(u.nome, r.chave)"
+    elif tipo == "pagamento":
+        if existe("formapag"):
+            joins = f"LEFT JOIN {schema}.formapag f ON r.chave = f.id_original"
+            nome = "COALESCE(f.nome, r.chave)"
+        filtro_extra = f"AND {nome} <> 'TROCO'"
+    elif tipo == "vendedor":
+        joins = f"LEFT JOIN {schema}.vendedor v ON r.chave = v.id_original"
+        nome = "COALESCE(v.nome, 'Vendedor ' || r.chave, 'N/D')"
+    else:
+        return None
+
+    periodo = "r.dia >= %(ini)s AND r.dia < %(fim)s"
+    if comparativo:
+        periodo = f"(({periodo}) OR (r.dia >= %(ant_ini)s AND r.dia < %(ant_fim)s))"
+        total, qtd = (f"COALESCE({a} FILTER (WHERE r.dia >= %(ini)s), 0), COALESCE({a} FILTER (WHERE r.dia < %(ini)s), 0)"
+                      for a in (total, qtd))
+
+    return f"""
+        SELECT {nome}, {total}, {qtd}
+        FROM {schema}.resumo_diario r {joins}
+        WHERE r.dimensao = '{dimensao}' AND r.filtro = 'S' AND {periodo} {filtro_extra}
+        {ordem}
+    """
+
+
+def sql_serie(schema: str, unidade: str) -> str:
+    """
+    (t, faturamento, vendas) por intervalo de date_trunc(unidade) lidos do
+    resumo, mesmo filtro dos rankings. Por hora usa a dimensão 'hora' (dia +
+    chave). Parâmetros nomeados ini e fim (dia seguinte ao fim).
+    """
+    if unidade == "hour":
+        balde, dimensao = "r.dia + make_interval(hours => r.chave::int)", "hora"
+    else:
+        # ::timestamp: date_trunc de DATE devolveria timestamptz
+        balde, dimensao = f"date_trunc('{unidade}', r.dia::timestamp)", "dia"
+    return f"""
+        SELECT {balde} AS t, SUM(r.faturamento) AS faturamento, SUM(r.vendas) AS vendas
+        FROM {schema}.resumo_diario r
+        WHERE r.dimensao = '{dimensao}' AND r.filtro = 'S' AND r.dia >= %(ini)s AND r.dia < %(fim)s
+        GROUP BY 1
+    """
+
+
+# --- RECONSTRUÇÃO ---
+def reconstruir(conn, schema: str, desde: date = None, dias_por_transacao: int = 31):
+    """
+    Cria as tabelas (se preciso) e recalcula o resumo de todos os dias com
+    venda a partir de 'desde' (ou desde a primeira venda), em transações
+    curtas. A cobertura só é ampliada no final.
+    """
+    cursor = conn.cursor()
+    cursor.execute(sql_tabelas_resumo(schema))
+    # Os workers da API descartam o "tabela não existe" em cache e passam a
+    # manter o resumo nos lotes que chegarem durante a reconstrução
+    schema_cache.publicar_alteracao(cursor, schema)
+    conn.commit()
+    schema_cache.invalidar(schema, "resumo_diario")
+
+    cursor.execute(f"""
+        SELECT DISTINCT "data"::date FROM {schema}.saida
+        WHERE "data" IS NOT NULL AND (%s::date IS NULL OR "data" >= %s::date)
+        ORDER BY 1
+    """, (desde, desde))
+    dias = [r[0] for r in cursor.fetchall()]
+    conn.commit()
+
+    for i in range(0, len(dias), dias_por_transacao):
+        recalcular_dias(cursor, schema, dias[i:i + dias_por_transacao])
+        conn.commit()
+        print(f"   {schema}: {min(i + dias_por_transacao, len(dias))}/{len(dias)} dias", end="\r", flush=True)
+    print()
+
+    # Sem 'desde' a base inteira foi recalculada: cobre qualquer período
+    cursor.execute(f"""
+        INSERT INTO {schema}.resumo_cobertura (id, desde, reconstruido_em) VALUES (1, COALESCE(%s::date, '-infinity'), NOW())
+        ON CONFLICT (id) DO UPDATE SET desde = LEAST({schema}.resumo_cobertura.desde, EXCLUDED.desde), reconstruido_em = NOW()
+    """, (desde,))
+    conn.commit()
+    return len(dias)
@@ -1,7 +1,11 @@
 from fastapi import APIRouter, HTTPException, Header, Depends
 from pydantic import BaseModel
 from typing import List, Optional
-from database_utils import get_db_connection, get_sql_novo_cliente
+from database_utils import conexao, get_sql_novo_cliente, pool
+from security import invalidar_token, notificar_token_invalidado
+import fila_ingestao
+import cache_relatorios
+import particionamento
 import secrets
 import re
 import os
@@ -34,6 +38,7 @@ class NovoClienteSchema(BaseModel):
     nome_fantasia: str
     senha_admin: str 
     telefone: Optional[str] = None
+    particionado: bool = False   # saida/saida_produto particionadas por mês (particionamento.py)
 
 class StatusClienteSchema(BaseModel):
     cnpj: str
@@ -55,140 +60,143 @@ class WebhookUsuarioSchema(BaseModel):
 # 1. LISTAR TOKENS
 @router.get("/admin/listar-tokens", dependencies=[Depends(verificar_admin)])
 def listar_tokens():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            SELECT nome_fantasia, cnpj, api_token, schema_name, ativo 
-            FROM public.lojas_sincronizadas 
-            ORDER BY nome_fantasia
-        """)
+    with conexao() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT nome_fantasia, cnpj, api_token, schema_name, ativo 
+                FROM public.lojas_sincronizadas 
+                ORDER BY nome_fantasia
+            """)
         
-        lista_lojas = []
-        for linha in cursor.fetchall():
-            lista_lojas.append({
-                "nome_fantasia": linha[0],
-                "cnpj": linha[1],
-                "api_token": linha[2],
-                "schema": linha[3],
-                "ativo": linha[4]
-            })
-        return lista_lojas
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+            lista_lojas = []
+            for linha in cursor.fetchall():
+                lista_lojas.append({
+                    "nome_fantasia": linha[0],
+                    "cnpj": linha[1],
+                    "api_token": linha[2],
+                    "schema": linha[3],
+                    "ativo": linha[4]
+                })
+            return lista_lojas
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 # 2. ALTERAR STATUS
 @router.put("/admin/alterar-status", dependencies=[Depends(verificar_admin)])
 def alterar_status_cliente(dados: StatusClienteSchema):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cnpj_limpo = re.sub(r'\D', '', dados.cnpj)
-        cursor.execute("UPDATE public.lojas_sincronizadas SET ativo = %s WHERE cnpj = %s RETURNING id, nome_fantasia", (dados.ativo, cnpj_limpo))
-        resultado = cursor.fetchone()
-        conn.commit()
+    with conexao() as conn:
+        cursor = conn.cursor()
+        try:
+            cnpj_limpo = re.sub(r'\D', '', dados.cnpj)
+            cursor.execute("UPDATE public.lojas_sincronizadas SET ativo = %s WHERE cnpj = %s RETURNING id, nome_fantasia, api_token", (dados.ativo, cnpj_limpo))
+            resultado = cursor.fetchone()
+            # Revoga o token em cache em todos os workers (entregue no commit)
+            if resultado: notificar_token_invalidado(cursor, resultado[2])
+            conn.commit()
+            if resultado: invalidar_token(resultado[2])
         
-        if resultado:
-            status_str = "ativada" if dados.ativo else "desativada"
-            return {"status": "sucesso", "mensagem": f"Loja '{resultado[1]}' {status_str}.", "id_loja": resultado[0]}
-        else:
-            raise HTTPException(status_code=404, detail="Loja não encontrada")
-    except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+            if resultado:
+                status_str = "ativada" if dados.ativo else "desativada"
+                return {"status": "sucesso", "mensagem": f"Loja '{resultado[1]}' {status_str}.", "id_loja": resultado[0]}
+            else:
+                raise HTTPException(status_code=404, detail="Loja não encontrada")
+        except Exception as e:
+            conn.rollback()
+            raise HTTPException(status_code=500, detail=str(e))
 
 # 3. LISTAR USUÁRIOS POR LOJA
 @router.get("/admin/usuarios-loja/{cnpj}", dependencies=[Depends(verificar_admin)])
 def listar_usuarios_por_cnpj(cnpj: str):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cnpj_limpo = re.sub(r'\D', '', cnpj)
-        cursor.execute("""
-            SELECT u.id, u.nome, u.telefone 
-            FROM public.usuarios u
-            JOIN public.usuarios_lojas ul ON u.id = ul.usuario_id
-            JOIN public.lojas_sincronizadas l ON ul.loja_id = l.id
-            WHERE l.cnpj = %s
-        """, (cnpj_limpo,))
+    with conexao() as conn:
+        cursor = conn.cursor()
+        try:
+            cnpj_limpo = re.sub(r'\D', '', cnpj)
+            cursor.execute("""
+                SELECT u.id, u.nome, u.telefone 
+                FROM public.usuarios u
+                JOIN public.usuarios_lojas ul ON u.id = ul.usuario_id
+                JOIN public.lojas_sincronizadas l ON ul.loja_id = l.id
+                WHERE l.cnpj = %s
+            """, (cnpj_limpo,))
         
-        return [{"id": r[0], "nome": r[1], "telefone": r[2]} for r in cursor.fetchall()]
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+            return [{"id": r[0], "nome": r[1], "telefone": r[2]} for r in cursor.fetchall()]
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 # 4. REMOVER USUÁRIO DA LOJA
 @router.delete("/admin/remover-usuario-loja", dependencies=[Depends(verificar_admin)])
 def remover_usuario_da_loja(dados: UsuarioLojaSchema):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cnpj_limpo = re.sub(r'\D', '', dados.cnpj)
-        fone_limpo = re.sub(r'\D', '', dados.telefone)
+    with conexao() as conn:
+        cursor = conn.cursor()
+        try:
+            cnpj_limpo = re.sub(r'\D', '', dados.cnpj)
+            fone_limpo = re.sub(r'\D', '', dados.telefone)
 
-        # Busca IDs
-        cursor.execute("SELECT id FROM public.lojas_sincronizadas WHERE cnpj = %s", (cnpj_limpo,))
-        loja = cursor.fetchone()
-        if not loja: raise HTTPException(404, "Loja não encontrada")
+            # Busca IDs
+            cursor.execute("SELECT id FROM public.lojas_sincronizadas WHERE cnpj = %s", (cnpj_limpo,))
+            loja = cursor.fetchone()
+            if not loja: raise HTTPException(404, "Loja não encontrada")
 
-        cursor.execute("SELECT id FROM public.usuarios WHERE telefone = %s", (fone_limpo,))
-        usuario = cursor.fetchone()
-        if not usuario: raise HTTPException(404, "Usuário não encontrado")
+            cursor.execute("SELECT id FROM public.usuarios WHERE telefone = %s", (fone_limpo,))
+            usuario = cursor.fetchone()
+            if not usuario: raise HTTPException(404, "Usuário não encontrado")
 
-        cursor.execute("DELETE FROM public.usuarios_lojas WHERE usuario_id = %s AND loja_id = %s", (usuario[0], loja[0]))
-        if cursor.rowcount == 0: raise HTTPException(404, "Usuário não vinculado a esta loja")
+            cursor.execute("DELETE FROM public.usuarios_lojas WHERE usuario_id = %s AND loja_id = %s", (usuario[0], loja[0]))
+            if cursor.rowcount == 0: raise HTTPException(404, "Usuário não vinculado a esta loja")
         
-        conn.commit()
-        return {"status": "sucesso", "mensagem": f"Vínculo removido."}
-    except Exception as e:
-        conn.rollback()
-        raise HTTPException(500, str(e))
-    finally:
-        conn.close()
+            conn.commit()
+            return {"status": "sucesso", "mensagem": f"Vínculo removido."}
+        except Exception as e:
+            conn.rollback()
+            raise HTTPException(500, str(e))
 
 # 5. CRIAR CLIENTE (Novo Tenant)
 @router.post("/admin/criar-cliente")
 def criar_cliente(dados: NovoClienteSchema):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cnpj_limpo = re.sub(r'\D', '', dados.cnpj)
-        if not cnpj_limpo: raise HTTPException(400, "CNPJ inválido")
+    with conexao() as conn:
+        cursor = conn.cursor()
+        try:
+            cnpj_limpo = re.sub(r'\D', '', dados.cnpj)
+            if not cnpj_limpo: raise HTTPException(400, "CNPJ inválido")
             
-        schema_name = f"tenant_{cnpj_limpo}"
-        token_gerado = secrets.token_hex(32)
+            schema_name = f"tenant_{cnpj_limpo}"
+            token_gerado = secrets.token_hex(32)
         
-        # Cria Schema e Tabelas
-        cursor.execute(get_sql_novo_cliente(schema_name))
+            # Cria Schema e Tabelas
+            cursor.execute(get_sql_novo_cliente(schema_name))
+            if dados.particionado and not particionamento.particionar_vazia(cursor, schema_name):
+                print(f"{schema_name} já tem vendas: particione com particionamento.py --schema {schema_name}")
+
+            # Se a loja já existia, o token antigo deixa de valer
+            cursor.execute("SELECT api_token FROM public.lojas_sincronizadas WHERE cnpj = %s", (cnpj_limpo,))
+            token_antigo = cursor.fetchone()
+            token_antigo = token_antigo[0] if token_antigo else None
+            notificar_token_invalidado(cursor, token_antigo)
         
-        # Insere na Mestre
-        cursor.execute("""
-            INSERT INTO public.lojas_sincronizadas (nome_fantasia, cnpj, schema_name, api_token, ativo)
-            VALUES (%s, %s, %s, %s, TRUE)
-            ON CONFLICT (cnpj) DO UPDATE SET api_token = EXCLUDED.api_token, schema_name = EXCLUDED.schema_name, nome_fantasia = EXCLUDED.nome_fantasia
-            RETURNING id
-        """, (dados.nome_fantasia, cnpj_limpo, schema_name, token_gerado))
-        loja_id = cursor.fetchone()[0]
+            # Insere na Mestre
+            cursor.execute("""
+                INSERT INTO public.lojas_sincronizadas (nome_fantasia, cnpj, schema_name, api_token, ativo)
+                VALUES (%s, %s, %s, %s, TRUE)
+                ON CONFLICT (cnpj) DO UPDATE SET api_token = EXCLUDED.api_token, schema_name = EXCLUDED.schema_name, nome_fantasia = EXCLUDED.nome_fantasia
+                RETURNING id
+            """, (dados.nome_fantasia, cnpj_limpo, schema_name, token_gerado))
+            loja_id = cursor.fetchone()[0]
         
-        # Cria Admin (Opcional)
-        if dados.telefone:
-            fone_limpo = re.sub(r'\D', '', dados.telefone)
-            if fone_limpo:
-                cursor.execute("INSERT INTO public.usuarios (nome, telefone) VALUES (%s, %s) ON CONFLICT (telefone) DO UPDATE SET nome = EXCLUDED.nome RETURNING id", (f"Admin {dados.nome_fantasia}", fone_limpo))
-                user_id = cursor.fetchone()[0]
-                cursor.execute("INSERT INTO public.usuarios_lojas (usuario_id, loja_id) VALUES (%s, %s) ON CONFLICT DO NOTHING", (user_id, loja_id))
+            # Cria Admin (Opcional)
+            if dados.telefone:
+                fone_limpo = re.sub(r'\D', '', dados.telefone)
+                if fone_limpo:
+                    cursor.execute("INSERT INTO public.usuarios (nome, telefone) VALUES (%s, %s) ON CONFLICT (telefone) DO UPDATE SET nome = EXCLUDED.nome RETURNING id", (f"Admin {dados.nome_fantasia}", fone_limpo))
+                    user_id = cursor.fetchone()[0]
+                    cursor.execute("INSERT INTO public.usuarios_lojas (usuario_id, loja_id) VALUES (%s, %s) ON CONFLICT DO NOTHING", (user_id, loja_id))
 
-        conn.commit()
-        return {"status": "sucesso", "loja_id": loja_id, "schema": schema_name, "token_acesso": token_gerado}
-    except Exception as e:
-        conn.rollback()
-        raise HTTPException(500, str(e))
-    finally: conn.close()
+            conn.commit()
+            if token_antigo: invalidar_token(token_antigo)
+            return {"status": "sucesso", "loja_id": loja_id, "schema": schema_name, "token_acesso": token_gerado}
+        except Exception as e:
+            conn.rollback()
+            raise HTTPException(500, str(e))
 
 # 6. WEBHOOK: CRIAR USUÁRIO (Migrado do Front)
 @router.post("/admin/criar-usuario")
@@ -201,56 +209,79 @@ def criar_usuario_webhook(dados: WebhookUsuarioSchema):
     if dados.admin_secret != SENHA_ADMIN_SISTEMA:
         raise HTTPException(status_code=401, detail="Não autorizado: Secret incorreto")
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        fone_limpo = re.sub(r'\D', '', dados.telefone)
+    with conexao() as conn:
+        cursor = conn.cursor()
+        try:
+            fone_limpo = re.sub(r'\D', '', dados.telefone)
         
-        # 1. Cria ou Atualiza o Usuário
-        cursor.execute("""
-            INSERT INTO public.usuarios (nome, telefone) 
-            VALUES (%s, %s) 
-            ON CONFLICT (telefone) DO UPDATE SET nome = EXCLUDED.nome 
-            RETURNING id
-        """, (dados.nome, fone_limpo))
-        usuario_id = cursor.fetchone()[0]
+            # 1. Cria ou Atualiza o Usuário
+            cursor.execute("""
+                INSERT INTO public.usuarios (nome, telefone) 
+                VALUES (%s, %s) 
+                ON CONFLICT (telefone) DO UPDATE SET nome = EXCLUDED.nome 
+                RETURNING id
+            """, (dados.nome, fone_limpo))
+            usuario_id = cursor.fetchone()[0]
 
-        # 2. Busca os IDs das lojas baseados nos CNPJs enviados
-        # O ANY(%s) no Python/Psycopg2 espera uma lista
-        lista_cnpjs_limpos = [re.sub(r'\D', '', c) for c in dados.cnpjs]
+            # 2. Busca os IDs das lojas baseados nos CNPJs enviados
+            # O ANY(%s) no Python/Psycopg2 espera uma lista
+            lista_cnpjs_limpos = [re.sub(r'\D', '', c) for c in dados.cnpjs]
         
-        if not lista_cnpjs_limpos:
-            return {"status": "aviso", "mensagem": "Usuário criado, mas nenhum CNPJ válido fornecido."}
+            if not lista_cnpjs_limpos:
+                return {"status": "aviso", "mensagem": "Usuário criado, mas nenhum CNPJ válido fornecido."}
 
-        cursor.execute("""
-            SELECT id, cnpj FROM public.lojas_sincronizadas 
-            WHERE cnpj = ANY(%s)
-        """, (lista_cnpjs_limpos,))
+            cursor.execute("""
+                SELECT id, cnpj FROM public.lojas_sincronizadas 
+                WHERE cnpj = ANY(%s)
+            """, (lista_cnpjs_limpos,))
         
-        lojas_encontradas = cursor.fetchall()
+            lojas_encontradas = cursor.fetchall()
 
-        # 3. Vincula o usuário a cada loja encontrada
-        vinculos_criados = 0
-        for loja in lojas_encontradas:
-            loja_id = loja[0]
-            cursor.execute("""
-                INSERT INTO public.usuarios_lojas (usuario_id, loja_id) 
-                VALUES (%s, %s) 
-                ON CONFLICT (usuario_id, loja_id) DO NOTHING
-            """, (usuario_id, loja_id))
-            vinculos_criados += 1
+            # 3. Vincula o usuário a cada loja encontrada
+            vinculos_criados = 0
+            for loja in lojas_encontradas:
+                loja_id = loja[0]
+                cursor.execute("""
+                    INSERT INTO public.usuarios_lojas (usuario_id, loja_id) 
+                    VALUES (%s, %s) 
+                    ON CONFLICT (usuario_id, loja_id) DO NOTHING
+                """, (usuario_id, loja_id))
+                vinculos_criados += 1
+
+            conn.commit()
+            return {
+                "status": "sucesso", 
+                "usuario_id": usuario_id, 
+                "lojas_vinculadas": vinculos_criados,
+                "cnpjs_encontrados": [l[1] for l in lojas_encontradas]
+            }
+
+        except Exception as e:
+            conn.rollback()
+            print(f"Erro Webhook: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+# 7. MÉTRICAS DO POOL DE CONEXÕES
+@router.get("/admin/pool-stats", dependencies=[Depends(verificar_admin)])
+def estatisticas_pool():
+    """
+    Conexões abertas/em uso, requisições aguardando e latência de aquisição
+    deste worker (cada worker do uvicorn tem o seu pool).
+    """
+    return pool.estatisticas()
 
-        conn.commit()
-        return {
-            "status": "sucesso", 
-            "usuario_id": usuario_id, 
-            "lojas_vinculadas": vinculos_criados,
-            "cnpjs_encontrados": [l[1] for l in lojas_encontradas]
-        }
+# 8. PROFUNDIDADE DA FILA DE INGESTÃO
+@router.get("/admin/fila-stats", dependencies=[Depends(verificar_admin)])
+def estatisticas_fila():
+    """
+    Lotes assíncronos pendentes por loja e idade do mais antigo.
+    """
+    return fila_ingestao.profundidade()
 
-    except Exception as e:
-        conn.rollback()
-        print(f"Erro Webhook: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
\ No newline at end of file
+# 9. CACHE DE RELATÓRIOS
+@router.get("/admin/cache-stats", dependencies=[Depends(verificar_admin)])
+def estatisticas_cache():
+    """
+    Taxa de acerto, entradas e memória do cache de relatórios deste worker.
+    """
+    return cache_relatorios.estatisticas()
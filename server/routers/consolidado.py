@@ -0,0 +1,132 @@
+from fastapi import APIRouter, Depends, Request, Response
+from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from security import validar_tokens
+from database_utils import conexao
+from routers import reports
+import cache_relatorios
+from datetime import date, datetime
+import os
+
+# Relatórios consolidados de várias lojas (header X-Lojas com os tokens).
+# Cada loja é calculada na sua conexão, em paralelo, com o mesmo cache dos
+# relatórios da loja: incluir uma loja no conjunto só calcula essa loja.
+# O ETag do conjunto sai só das versões do período (uma consulta barata por
+# loja) e é conferido antes: um 304 não roda nenhum relatório.
+
+router = APIRouter()
+
+# Lojas calculadas ao mesmo tempo por requisição (cada uma ocupa uma conexão do pool)
+CONSOLIDADO_CONCORRENCIA = int(os.getenv("CONSOLIDADO_CONCORRENCIA", "4"))
+# Ranking: cada loja traz limit * margem linhas, para o top-N da soma não
+# perder um item que fica logo abaixo do corte em cada loja
+CONSOLIDADO_MARGEM_RANKING = int(os.getenv("CONSOLIDADO_MARGEM_RANKING", "3"))
+
+def _versoes(schemas: List[str], data_inicio: date, data_fim: date):
+    """
+    Versão do período de cada loja, numa conexão só (uma consulta barata por
+    loja). None se a loja falhou ou não tem versão: o conjunto fica sem ETag.
+    """
+    versoes = []
+    with conexao() as conn:
+        cursor = conn.cursor()
+        for schema in schemas:
+            try:
+                versoes.append(cache_relatorios.versao_periodo(cursor, schema, data_inicio, data_fim))
+            except Exception as e:
+                print(f"Erro Consolidado {schema}: {e}")
+                conn.rollback()
+                versoes.append(None)
+    return versoes
+
+def _condicional(request: Request, response: Response, schemas, chave, versoes):
+    """
+    ETag do conjunto (muda se qualquer loja mudar), conferido antes de
+    calcular qualquer loja: 304 sem rodar relatório. Sem a versão de alguma
+    loja o conjunto não tem ETag, como no painel em lote.
+    """
+    versao = None if None in versoes else "|".join(versoes)
+    return reports.condicional(request, response, "+".join(schemas), chave, versao)
+
+def _em_paralelo(schemas: List[str], versoes, calcular):
+    """
+    calcular(cursor, schema, versao) de cada loja, em paralelo. Devolve os
+    resultados na ordem das lojas; None se a loja falhou.
+    """
+    def executar(schema, versao):
+        # Uma loja com problema não derruba o consolidado: vai como None
+        try:
+            with conexao() as conn:
+                return calcular(conn.cursor(), schema, versao)
+        except Exception as e:
+            print(f"Erro Consolidado {schema}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=min(CONSOLIDADO_CONCORRENCIA, len(schemas))) as executor:
+        return list(executor.map(executar, schemas, versoes))
+
+def _parcial(response: Response, lojas):
+    """ Alguma loja falhou no cálculo: a resposta é parcial e não leva o ETag do conjunto. """
+    if any(r is None for r in lojas): reports.sem_cache(response)
+
+# --- JUNÇÃO ---
+def somar_cards(lista):
+    """ Cards das lojas somados; ticket, itens por venda, markup e margem recalculados do total. """
+    lista = [c for c in lista if c]
+    com_vendas = [c for c in lista if c["qtde_vendas"] > 0]
+    return reports.metricas_cards(
+        sum(c["faturamento"] for c in lista),
+        sum(c["qtde_vendas"] for c in lista),
+        max((c["maior_venda"] for c in com_vendas), default=0),
+        min((c["menor_venda"] for c in com_vendas), default=0),
+        # Itens = média por venda x vendas de cada loja
+        sum(c["itens_por_venda"] * c["qtde_vendas"] for c in lista),
+        sum(c["cmv"] for c in lista),
+    )
+
+def juntar_rankings(tipo: str, listas, limit: int):
+    """ Soma por nome (ids são de cada loja; o nome é o que elas têm em comum) e refaz a ordem e o corte. """
+    soma = {}
+    for lista in listas:
+        for item in lista or []:
+            atual = soma.setdefault(item["nome"], {"nome": item["nome"], "total": 0.0, "qtd": 0.0})
+            atual["total"] += item["total"]
+            atual["qtd"] += item["qtd"]
+    itens = list(soma.values())
+    # Hora e dia não têm corte: ordem cronológica, como no ranking da loja
+    if tipo == "hora":
+        return sorted(itens, key=lambda i: int(i["nome"].rstrip("h")))
+    if tipo == "dia":
+        return sorted(itens, key=lambda i: datetime.strptime(i["nome"], "%d/%m/%Y"))
+    return sorted(itens, key=lambda i: i["total"], reverse=True)[:limit]
+
+# --- ENDPOINTS ---
+@router.get("/reports/consolidado/dashboard-cards")
+def get_cards_consolidado(data_inicio: date, data_fim: date, request: Request, response: Response,
+                          schemas: List[str] = Depends(validar_tokens)):
+    """ {"consolidado": cards somados, "lojas": cards de cada loja, na ordem do X-Lojas} """
+    chave = ("dashboard-cards", data_inicio, data_fim)
+    versoes = _versoes(schemas, data_inicio, data_fim)
+    nao_modificado = _condicional(request, response, schemas, ("consolidado",) + chave, versoes)
+    if nao_modificado: return nao_modificado
+
+    lojas = _em_paralelo(schemas, versoes, lambda cursor, schema, versao: reports.em_cache(
+        schema, chave, versao, lambda: reports.calcular_cards(cursor, schema, data_inicio, data_fim)))
+    _parcial(response, lojas)
+    return {"consolidado": somar_cards(lojas), "lojas": lojas}
+
+@router.get("/reports/consolidado/ranking/{tipo}")
+def get_ranking_consolidado(tipo: str, data_inicio: date, data_fim: date, request: Request, response: Response,
+                            limit: int = 20, schemas: List[str] = Depends(validar_tokens)):
+    """ {"consolidado": top-N da soma das lojas, "lojas": ranking de cada loja} """
+    limite_loja = limit * CONSOLIDADO_MARGEM_RANKING
+    chave = ("ranking", tipo, data_inicio, data_fim, limite_loja)
+    versoes = _versoes(schemas, data_inicio, data_fim)
+    nao_modificado = _condicional(request, response, schemas, ("consolidado", tipo, data_inicio, data_fim, limit), versoes)
+    if nao_modificado: return nao_modificado
+
+    lojas = _em_paralelo(schemas, versoes, lambda cursor, schema, versao: reports.em_cache(
+        schema, chave, versao, lambda: reports.calcular_ranking(cursor, schema, tipo, data_inicio, data_fim, limite_loja)))
+    _parcial(response, lojas)
+    return {"consolidado": juntar_rankings(tipo, lojas, limit),
+            "lojas": [r[:limit] if r and tipo not in ("hora", "dia") else r for r in lojas]}
@@ -1,13 +1,30 @@
-from fastapi import APIRouter, Depends, Response
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
 from pydantic import BaseModel
 from security import validar_token
-from database_utils import get_db_connection
-from datetime import date
+from database_utils import conexao
+from tipos_colunas import expressoes_tipadas
+import resumos
+import cache_relatorios
+import exportacao
+import eventos
+import particionamento
+import schema_cache
+from datetime import date, timedelta
+import asyncio
+import json
+import os
 
 
 router = APIRouter()
 
+# Painel em lote: consultas simultâneas por requisição (cada uma com uma
+# conexão do pool) e número máximo de widgets aceitos
+DASHBOARD_CONCORRENCIA = int(os.getenv("DASHBOARD_CONCORRENCIA", "4"))
+DASHBOARD_MAX_WIDGETS = int(os.getenv("DASHBOARD_MAX_WIDGETS", "30"))
+
 class DashboardCards(BaseModel):
     faturamento: float
     qtde_vendas: int
@@ -25,108 +42,247 @@ class RankingItem(BaseModel):
     total: float
     qtd: float
 
-def verificar_tabela(cursor, schema, tabela, coluna=None):
-    try:
-        sql = f"SELECT 1 FROM information_schema.tables WHERE table_schema='{schema}' AND table_name='{tabela}'"
-        cursor.execute(sql)
-        if not cursor.fetchone(): return False
-        if coluna:
-            sql_col = f"SELECT 1 FROM information_schema.columns WHERE table_schema='{schema}' AND table_name='{tabela}' AND column_name='{coluna}'"
-            cursor.execute(sql_col)
-            return cursor.fetchone() is not None
-        return True
-    except: return False
+class WidgetSchema(BaseModel):
+    widget: str                  # "cards" ou "ranking"
+    tipo: Optional[str] = None   # ranking: produto, hora, dia, pagamento...
+    limit: int = 20
 
-@router.get("/reports/dashboard-cards", response_model=DashboardCards)
-def get_dashboard_cards(data_inicio: date, data_fim: date, response: Response, schema: str = Depends(validar_token)):
+class DashboardSchema(BaseModel):
+    data_inicio: date
+    data_fim: date
+    widgets: List[WidgetSchema]
+
+def intervalo(data_inicio: date, data_fim: date):
+    """
+    Período como intervalo semiaberto [início, dia seguinte ao fim): compara a
+    coluna "data" sem cast, usando o índice (ver indices_relatorios.py).
+    """
+    return data_inicio, data_fim + timedelta(days=1)
+
+def filtro_itens(cursor, schema, data_inicio: date, data_fim: date):
+    """
+    Loja com saida_produto particionada: repete o período nos itens (a data
+    da venda copiada em sp."data") para o planejador podar as partições.
+    """
+    if not particionamento.particionada(schema_cache.obter_tabela(cursor, schema, 'saida_produto')): return ""
+    return cursor.mogrify('AND sp."data" >= %s AND sp."data" < %s', intervalo(data_inicio, data_fim)).decode()
+
+def periodo_anterior(data_inicio: date, data_fim: date, anterior_inicio: Optional[date] = None, anterior_fim: Optional[date] = None):
+    """
+    Período de comparação: o informado ou, por padrão, o de mesma duração
+    imediatamente antes. Tem de terminar antes do início do atual.
+    """
+    if anterior_inicio is None or anterior_fim is None:
+        anterior_fim = data_inicio - timedelta(days=1)
+        anterior_inicio = anterior_fim - (data_fim - data_inicio)
+    if data_fim < data_inicio or anterior_fim < anterior_inicio:
+        raise HTTPException(status_code=400, detail="Período inválido")
+    if anterior_fim >= data_inicio:
+        raise HTTPException(status_code=400, detail="O período anterior deve terminar antes do início do atual")
+    return anterior_inicio, anterior_fim
+
+def _parametros_periodo(data_inicio: date, data_fim: date, anterior=None):
+    """ Parâmetros nomeados das consultas de período (intervalos semiabertos). """
+    p = dict(zip(("ini", "fim"), intervalo(data_inicio, data_fim)))
+    if anterior: p.update(zip(("ant_ini", "ant_fim"), intervalo(*anterior)))
+    return p
+
+def _comparar(atual, anterior):
+    atual, anterior = float(atual or 0), float(anterior or 0)
+    return {
+        "atual": atual, "anterior": anterior, "delta": atual - anterior,
+        "delta_percent": (atual - anterior) / abs(anterior) * 100 if anterior else None,
+    }
+
+def sem_cache(response: Response):
     # ESTAS LINHAS FORÇAM O NAVEGADOR A BUSCAR DADOS NOVOS SEMPRE
     response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
     response.headers["Pragma"] = "no-cache"
     response.headers["Expires"] = "0"
+    if "etag" in response.headers: del response.headers["etag"]
+
+def condicional(request: Request, response: Response, schema, chave, versao):
+    """
+    Marca a resposta com o ETag da versão atual do período. Se o cliente já
+    tem essa versão (If-None-Match), devolve o 304 a ser retornado sem rodar
+    o relatório; senão None.
+    """
+    tag = cache_relatorios.etag(schema, chave, versao)
+    if tag is None:
+        sem_cache(response)
+        return None
+    # Sempre revalidar, mas podendo reaproveitar o corpo guardado
+    cabecalhos = {"ETag": tag, "Cache-Control": "private, no-cache"}
+    enviados = [t.strip().removeprefix("W/") for t in request.headers.get("if-none-match", "").split(",")]
+    if tag in enviados or "*" in enviados:
+        return Response(status_code=304, headers=cabecalhos)
+    response.headers.update(cabecalhos)
+    return None
+
+def em_cache(schema, chave, versao, calcular):
+    """ Resultado guardado para a versão do período, ou calcular(). Falha (None) não é guardada. """
+    resultado = cache_relatorios.obter(schema, chave, versao)
+    if resultado is None:
+        resultado = calcular()
+        if resultado is not None: cache_relatorios.guardar(schema, chave, versao, resultado)
+    return resultado
+
+@router.get("/reports/dashboard-cards", response_model=DashboardCards)
+def get_dashboard_cards(data_inicio: date, data_fim: date, request: Request, response: Response, schema: str = Depends(validar_token)):
+    with conexao() as conn:
+        cursor = conn.cursor()
+        # Período sem escrita desde o último cálculo: 304 ou o resultado guardado
+        versao = cache_relatorios.versao_periodo(cursor, schema, data_inicio, data_fim)
+        chave = ("dashboard-cards", data_inicio, data_fim)
+        nao_modificado = condicional(request, response, schema, chave, versao)
+        if nao_modificado: return nao_modificado
+        resultado = em_cache(schema, chave, versao, lambda: calcular_cards(cursor, schema, data_inicio, data_fim))
+        if resultado is None:
+            sem_cache(response)
+            return {k:0 for k in DashboardCards.__annotations__}
+        return resultado
+
+def metricas_cards(fat, qtd, maior, menor, qtd_itens, cmv):
+    fat, qtd, maior, menor, qtd_itens, cmv = float(fat), int(qtd), float(maior), float(menor), float(qtd_itens), float(cmv)
+    ticket = fat / qtd if qtd > 0 else 0.0
+    itens_pv = qtd_itens / qtd if qtd > 0 else 0.0
+    lucro = fat - cmv
+    markup = (lucro / cmv * 100) if cmv > 0 else 0.0
+    margem = (lucro / fat * 100) if fat > 0 else 0.0
+
+    return {
+        "faturamento": fat, "qtde_vendas": qtd, "ticket_medio": ticket,
+        "itens_por_venda": itens_pv, "cmv": cmv, "lucro_bruto": lucro,
+        "markup": markup, "lucro_bruto_percent": margem, "maior_venda": maior, "menor_venda": menor
+    }
+
+def calcular_cards(cursor, schema, data_inicio, data_fim, anterior=None):
+    """
+    anterior=(início, fim): comparação. Os dois períodos saem da mesma
+    varredura (um FILTER por período) e cada card vira atual/anterior/delta.
+    """
+    zeros = {k:0 for k in DashboardCards.__annotations__}
+    if not schema_cache.existe(cursor, schema, 'saida', 'total'):
+        return {k: _comparar(0, 0) for k in zeros} if anterior else zeros
+
+    x = expressoes_tipadas(cursor, schema)
+    # Um filtro por período; o WHERE é a união deles (BitmapOr no índice de data)
+    periodos = ["ini", "ant_ini"] if anterior else ["ini"]
+    def filtro(coluna, p): return f"{coluna} >= %({p})s AND {coluna} < %({p.replace('ini', 'fim')})s"
+    def onde(coluna): return " OR ".join(f"({filtro(coluna, p)})" for p in periodos)
 
-    conn = get_db_connection(); cursor = conn.cursor()
-    if not verificar_tabela(cursor, schema, 'saida', 'total'):
-        conn.close(); return {k:0 for k in DashboardCards.__annotations__}
+    colunas_capa = ", ".join(
+        f"COALESCE(SUM({x['total']}) FILTER (WHERE {filtro(x['data'], p)}), 0), "
+        f"COUNT(*) FILTER (WHERE {filtro(x['data'], p)}), "
+        f"COALESCE(MAX({x['total']}) FILTER (WHERE {filtro(x['data'], p)}), 0), "
+        f"COALESCE(MIN({x['total']}) FILTER (WHERE {filtro(x['data'], p)}), 0)" for p in periodos)
+    colunas_itens = ", ".join(
+        f"COUNT(*) FILTER (WHERE {filtro(x['s_data'], p)}), "
+        f"COALESCE(SUM({x['sp_quant']} * COALESCE({x['p_custo']}, 0)) FILTER (WHERE {filtro(x['s_data'], p)}), 0)"
+        for p in periodos)
 
     sql_capa = f"""
-        SELECT 
-            COALESCE(SUM(NULLIF(total, '')::numeric), 0),
-            COUNT(*),
-            COALESCE(MAX(NULLIF(total, '')::numeric), 0),
-            COALESCE(MIN(NULLIF(total, '')::numeric), 0)
+        SELECT {colunas_capa}
         FROM {schema}.saida
-        WHERE "data"::date BETWEEN %s AND %s 
+        WHERE ({onde(x['data'])})
           AND (eliminado IS NULL OR eliminado = 'N') 
           AND (normal IS NULL OR normal <> 'N')
     """
-    
+
     sql_itens = f"""
-        SELECT 
-            COUNT(*),
-            COALESCE(SUM(NULLIF(sp.quant, '')::numeric * COALESCE(NULLIF(p.custo_total, '')::numeric, 0)), 0)
+        SELECT {colunas_itens}
         FROM {schema}.saida_produto sp
         JOIN {schema}.saida s ON sp.id_saida = s.id_original
         LEFT JOIN {schema}.produto p ON sp.id_produto = p.id_original
-        WHERE s."data"::date BETWEEN %s AND %s 
+        WHERE ({onde(x['s_data'])})
           AND (s.eliminado IS NULL OR s.eliminado = 'N') 
           AND (s.normal IS NULL OR s.normal <> 'N')
+        {filtro_itens(cursor, schema, anterior[0] if anterior else data_inicio, data_fim)}
     """
-    
+
     try:
-        cursor.execute(sql_capa, (data_inicio, data_fim))
-        capa = cursor.fetchone()
-        fat, qtd, maior, menor = float(capa[0]), int(capa[1]), float(capa[2]), float(capa[3])
-        
-        qtd_itens, cmv = 0.0, 0.0
-        if verificar_tabela(cursor, schema, 'saida_produto', 'quant'):
-            cursor.execute(sql_itens, (data_inicio, data_fim))
-            itens = cursor.fetchone()
-            if itens: qtd_itens, cmv = float(itens[0]), float(itens[1])
-
-        ticket = fat / qtd if qtd > 0 else 0.0
-        itens_pv = qtd_itens / qtd if qtd > 0 else 0.0
-        lucro = fat - cmv
-        markup = (lucro / cmv * 100) if cmv > 0 else 0.0
-        margem = (lucro / fat * 100) if fat > 0 else 0.0
+        if resumos.cobre(cursor, schema, anterior[0] if anterior else data_inicio):
+            # Período coberto pelos resumos diários: não varre as vendas
+            valores = resumos.cards(cursor, schema, data_inicio, data_fim, anterior)
+            if not anterior: valores = [valores]
+        else:
+            params = _parametros_periodo(data_inicio, data_fim, anterior)
+            cursor.execute(sql_capa, params)
+            capa = cursor.fetchone()
 
-        return {
-            "faturamento": fat, "qtde_vendas": qtd, "ticket_medio": ticket,
-            "itens_por_venda": itens_pv, "cmv": cmv, "lucro_bruto": lucro,
-            "markup": markup, "lucro_bruto_percent": margem, "maior_venda": maior, "menor_venda": menor
-        }
+            itens = [0.0, 0.0] * len(periodos)
+            if schema_cache.existe(cursor, schema, 'saida_produto', 'quant'):
+                cursor.execute(sql_itens, params)
+                itens = cursor.fetchone() or itens
+            valores = [tuple(capa[4*i:4*i+4]) + tuple(itens[2*i:2*i+2]) for i in range(len(periodos))]
+
+        cards = [metricas_cards(*v) for v in valores]
+        if anterior:
+            return {k: _comparar(cards[0][k], cards[1][k]) for k in cards[0]}
+        return cards[0]
     except Exception as e:
-        print(f"Erro Reports: {e}"); return {k:0 for k in DashboardCards.__annotations__}
-    finally: conn.close()
+        print(f"Erro Reports: {e}"); return None
     
 @router.get("/reports/ranking/{tipo}", response_model=List[RankingItem])
-def get_ranking(tipo: str, data_inicio: date, data_fim: date, limit: int = 20, schema: str = Depends(validar_token)):
-    conn = get_db_connection(); cursor = conn.cursor()
-    if not verificar_tabela(cursor, schema, 'saida', 'total'): conn.close(); return []
+def get_ranking(tipo: str, data_inicio: date, data_fim: date, request: Request, response: Response, limit: int = 20, schema: str = Depends(validar_token)):
+    with conexao() as conn:
+        cursor = conn.cursor()
+        versao = cache_relatorios.versao_periodo(cursor, schema, data_inicio, data_fim)
+        chave = ("ranking", tipo, data_inicio, data_fim, limit)
+        nao_modificado = condicional(request, response, schema, chave, versao)
+        if nao_modificado: return nao_modificado
+        resultado = em_cache(schema, chave, versao, lambda: calcular_ranking(cursor, schema, tipo, data_inicio, data_fim, limit))
+        if resultado is None:
+            sem_cache(response)
+            return []
+        return resultado
+
+def calcular_ranking(cursor, schema, tipo, data_inicio, data_fim, limit, anterior=None):
+    """
+    anterior=(início, fim): comparação. Lê os dois períodos na mesma
+    varredura e cada agregado vira o par (atual, anterior) com FILTER.
+    """
+    if not schema_cache.existe(cursor, schema, 'saida', 'total'): return []
 
+    x = expressoes_tipadas(cursor, schema)
     sql = ""
+    periodo = f"{x['s_data']} >= %(ini)s AND {x['s_data']} < %(fim)s"
+    # Agregados dos rankings; na comparação o período anterior termina antes
+    # do atual, então "data >= início" separa os dois
+    a = {"sp_total": f"SUM({x['sp_total']})", "sp_quant": f"SUM({x['sp_quant']})",
+         "s_total": f"SUM({x['s_total']})", "sf_valor": f"SUM({x['sf_valor']})",
+         "vendas": "COUNT(*)", "vendas_distintas": "COUNT(DISTINCT s.id_original)",
+         "vendas_itens": "COUNT(DISTINCT sp.id_saida)"}
+    if anterior:
+        periodo = f"(({periodo}) OR ({x['s_data']} >= %(ant_ini)s AND {x['s_data']} < %(ant_fim)s))"
+        atual = f"{x['s_data']} >= %(ini)s"
+        a = {k: f"COALESCE({v} FILTER (WHERE {atual}), 0), COALESCE({v} FILTER (WHERE NOT ({atual})), 0)"
+             for k, v in a.items()}
     # Filtro Unificado para todos os Rankings
     where_saida = f"""
-        WHERE s."data"::date BETWEEN %s AND %s 
+        WHERE {periodo}
         AND (s.eliminado IS NULL OR s.eliminado = 'N') 
         AND (s.normal IS NULL OR s.normal = 'S')
     """
-    
+    # Consultas que partem dos itens: mesmo filtro + poda de saida_produto
+    where_itens = where_saida + filtro_itens(cursor, schema, anterior[0] if anterior else data_inicio, data_fim)
+
     try:
         if tipo == "produto":
-            if verificar_tabela(cursor, schema, 'produto'):
+            if schema_cache.existe(cursor, schema, 'produto'):
                 sql = f"""
-                    SELECT COALESCE(p.nome, 'N/D'), SUM(NULLIF(sp.total, '')::numeric), SUM(NULLIF(sp.quant, '')::numeric)
+                    SELECT COALESCE(p.nome, 'N/D'), {a['sp_total']}, {a['sp_quant']}
                     FROM {schema}.saida_produto sp
                     JOIN {schema}.saida s ON sp.id_saida = s.id_original
                     LEFT JOIN {schema}.produto p ON sp.id_produto = p.id_original
-                    {where_saida} GROUP BY 1 ORDER BY 2 DESC LIMIT {limit}
+                    {where_itens} GROUP BY 1 ORDER BY 2 DESC LIMIT {limit}
                 """
         elif tipo == "hora":
             sql = f"""
                 SELECT 
-                    EXTRACT(HOUR FROM (s."data"::date + s."hora"::time))::text || 'h', 
-                    SUM(NULLIF(s.total, '')::numeric), 
-                    COUNT(*) 
+                    EXTRACT(HOUR FROM {x['s_hora']})::text || 'h', 
+                    {a['s_total']}, 
+                    {a['vendas']} 
                 FROM {schema}.saida s 
                 {where_saida} 
                 GROUP BY 1
@@ -134,18 +290,18 @@ def get_ranking(tipo: str, data_inicio: date, data_fim: date, limit: int = 20, s
             """
         # ... (os demais tipos como 'dia', 'pagamento' e 'vendedor' já utilizam {where_saida} corretamente)
         elif tipo == "dia":
-            sql = f"""SELECT TO_CHAR(s."data", 'DD/MM/YYYY'), SUM(NULLIF(s.total, '')::numeric), COUNT(*) FROM {schema}.saida s {where_saida} GROUP BY s."data"::date, 1 ORDER BY s."data"::date ASC"""
+            sql = f"""SELECT TO_CHAR(s."data", 'DD/MM/YYYY'), {a['s_total']}, {a['vendas']} FROM {schema}.saida s {where_saida} GROUP BY s."data"::date, 1 ORDER BY s."data"::date ASC"""
         elif tipo == "pagamento":
-            if verificar_tabela(cursor, schema, 'saida_formapag'):
+            if schema_cache.existe(cursor, schema, 'saida_formapag'):
                 nome_col = "sf.id_formapag"
                 join_forma = ""
-                if verificar_tabela(cursor, schema, 'formapag'):
+                if schema_cache.existe(cursor, schema, 'formapag'):
                     join_forma = f"LEFT JOIN {schema}.formapag f ON sf.id_formapag = f.id_original"
                     nome_col = "COALESCE(f.nome, sf.id_formapag)"
-                
+            
                 # CORREÇÃO: Filtro para ignorar a forma de pagamento 'TROCO'
                 sql = f"""
-                    SELECT {nome_col}, SUM(NULLIF(sf.valor, '')::numeric), COUNT(DISTINCT s.id_original) 
+                    SELECT {nome_col}, {a['sf_valor']}, {a['vendas_distintas']} 
                     FROM {schema}.saida_formapag sf 
                     JOIN {schema}.saida s ON sf.id_saida = s.id_original 
                     {join_forma} 
@@ -153,26 +309,26 @@ def get_ranking(tipo: str, data_inicio: date, data_fim: date, limit: int = 20, s
                     AND {nome_col} <> 'TROCO'
                     GROUP BY 1 ORDER BY 2 DESC LIMIT {limit}
                 """
-        
+    
         elif tipo == "terminal":
-            if verificar_tabela(cursor, schema, 'saida', 'terminal'):
+            if schema_cache.existe(cursor, schema, 'saida', 'terminal'):
                 sql = f"""
-                    SELECT COALESCE(s.terminal, 'N/D'), SUM(NULLIF(s.total, '')::numeric), COUNT(*) 
+                    SELECT COALESCE(s.terminal, 'N/D'), {a['s_total']}, {a['vendas']} 
                     FROM {schema}.saida s 
                     {where_saida} 
                     GROUP BY 1 ORDER BY 2 DESC LIMIT {limit}
                 """
-                
+            
         elif tipo == "usuario":
-            if verificar_tabela(cursor, schema, 'saida', 'id_usuario'):
+            if schema_cache.existe(cursor, schema, 'saida', 'id_usuario'):
                 col_nome = "s.id_usuario"
                 join_user = ""
-                if verificar_tabela(cursor, schema, 'usuario_pdv', 'nome'):
+                if schema_cache.existe(cursor, schema, 'usuario_pdv', 'nome'):
                     join_user = f"LEFT JOIN {schema}.usuario_pdv u ON s.id_usuario = u.id_original"
                     col_nome = "COALESCE(u.nome, s.id_usuario)"
-                
+            
                 sql = f"""
-                    SELECT {col_nome}, SUM(NULLIF(s.total, '')::numeric), COUNT(*) 
+                    SELECT {col_nome}, {a['s_total']}, {a['vendas']} 
                     FROM {schema}.saida s 
                     {join_user}
                     {where_saida} 
@@ -180,60 +336,302 @@ def get_ranking(tipo: str, data_inicio: date, data_fim: date, limit: int = 20, s
                 """
 
         elif tipo == "secao":
-            if verificar_tabela(cursor, schema, 'secao'):
-                sql = f"""SELECT COALESCE(sec.nome, 'N/D'), SUM(NULLIF(sp.total, '')::numeric), SUM(NULLIF(sp.quant, '')::numeric) FROM {schema}.saida_produto sp JOIN {schema}.saida s ON sp.id_saida = s.id_original LEFT JOIN {schema}.produto p ON sp.id_produto = p.id_original LEFT JOIN {schema}.grupo g ON p.id_grupo = g.id_original LEFT JOIN {schema}.secao sec ON g.id_secao = sec.id_original {where_saida} GROUP BY 1 ORDER BY 2 DESC LIMIT {limit}"""
+            if schema_cache.existe(cursor, schema, 'secao'):
+                sql = f"""SELECT COALESCE(sec.nome, 'N/D'), {a['sp_total']}, {a['sp_quant']} FROM {schema}.saida_produto sp JOIN {schema}.saida s ON sp.id_saida = s.id_original LEFT JOIN {schema}.produto p ON sp.id_produto = p.id_original LEFT JOIN {schema}.grupo g ON p.id_grupo = g.id_original LEFT JOIN {schema}.secao sec ON g.id_secao = sec.id_original {where_itens} GROUP BY 1 ORDER BY 2 DESC LIMIT {limit}"""
         elif tipo == "grupo":
-            if verificar_tabela(cursor, schema, 'grupo'):
-                sql = f"""SELECT COALESCE(g.nome, 'N/D'), SUM(NULLIF(sp.total, '')::numeric), SUM(NULLIF(sp.quant, '')::numeric) FROM {schema}.saida_produto sp JOIN {schema}.saida s ON sp.id_saida = s.id_original LEFT JOIN {schema}.produto p ON sp.id_produto = p.id_original LEFT JOIN {schema}.grupo g ON p.id_grupo = g.id_original {where_saida} GROUP BY 1 ORDER BY 2 DESC LIMIT {limit}"""
+            if schema_cache.existe(cursor, schema, 'grupo'):
+                sql = f"""SELECT COALESCE(g.nome, 'N/D'), {a['sp_total']}, {a['sp_quant']} FROM {schema}.saida_produto sp JOIN {schema}.saida s ON sp.id_saida = s.id_original LEFT JOIN {schema}.produto p ON sp.id_produto = p.id_original LEFT JOIN {schema}.grupo g ON p.id_grupo = g.id_original {where_itens} GROUP BY 1 ORDER BY 2 DESC LIMIT {limit}"""
         elif tipo == "fabricante":
-            if verificar_tabela(cursor, schema, 'fabricante'):
-                sql = f"""SELECT COALESCE(fab.nome, 'N/D'), SUM(NULLIF(sp.total, '')::numeric), SUM(NULLIF(sp.quant, '')::numeric) FROM {schema}.saida_produto sp JOIN {schema}.saida s ON sp.id_saida = s.id_original LEFT JOIN {schema}.produto p ON sp.id_produto = p.id_original LEFT JOIN {schema}.fabricante fab ON p.id_fabricante = fab.id_original {where_saida} GROUP BY 1 ORDER BY 2 DESC LIMIT {limit}"""
+            if schema_cache.existe(cursor, schema, 'fabricante'):
+                sql = f"""SELECT COALESCE(fab.nome, 'N/D'), {a['sp_total']}, {a['sp_quant']} FROM {schema}.saida_produto sp JOIN {schema}.saida s ON sp.id_saida = s.id_original LEFT JOIN {schema}.produto p ON sp.id_produto = p.id_original LEFT JOIN {schema}.fabricante fab ON p.id_fabricante = fab.id_original {where_itens} GROUP BY 1 ORDER BY 2 DESC LIMIT {limit}"""
         elif tipo == "fornecedor":
-            if verificar_tabela(cursor, schema, 'cliente'):
-                sql = f"""SELECT COALESCE(f.nome, 'N/D'), SUM(NULLIF(sp.total, '')::numeric), SUM(NULLIF(sp.quant, '')::numeric) FROM {schema}.saida_produto sp JOIN {schema}.saida s ON sp.id_saida = s.id_original LEFT JOIN {schema}.produto p ON sp.id_produto = p.id_original LEFT JOIN {schema}.cliente f ON p.id_fornecedor = f.id_original {where_saida} GROUP BY 1 ORDER BY 2 DESC LIMIT {limit}"""
+            if schema_cache.existe(cursor, schema, 'cliente'):
+                sql = f"""SELECT COALESCE(f.nome, 'N/D'), {a['sp_total']}, {a['sp_quant']} FROM {schema}.saida_produto sp JOIN {schema}.saida s ON sp.id_saida = s.id_original LEFT JOIN {schema}.produto p ON sp.id_produto = p.id_original LEFT JOIN {schema}.cliente f ON p.id_fornecedor = f.id_original {where_itens} GROUP BY 1 ORDER BY 2 DESC LIMIT {limit}"""
         elif tipo == "cliente":
-            if verificar_tabela(cursor, schema, 'cliente'):
-                sql = f"""SELECT COALESCE(c.nome, 'CONSUMIDOR'), SUM(NULLIF(s.total, '')::numeric), COUNT(*) FROM {schema}.saida s LEFT JOIN {schema}.cliente c ON s.id_cliente = c.id_original {where_saida} GROUP BY 1 ORDER BY 2 DESC LIMIT {limit}"""
+            if schema_cache.existe(cursor, schema, 'cliente'):
+                sql = f"""SELECT COALESCE(c.nome, 'CONSUMIDOR'), {a['s_total']}, {a['vendas']} FROM {schema}.saida s LEFT JOIN {schema}.cliente c ON s.id_cliente = c.id_original {where_saida} GROUP BY 1 ORDER BY 2 DESC LIMIT {limit}"""
         elif tipo == "produto":
-            if verificar_tabela(cursor, schema, 'produto'):
+            if schema_cache.existe(cursor, schema, 'produto'):
                 sql = f"""
-                    SELECT COALESCE(p.nome, 'N/D'), SUM(NULLIF(sp.total, '')::numeric), SUM(NULLIF(sp.quant, '')::numeric)
+                    SELECT COALESCE(p.nome, 'N/D'), {a['sp_total']}, {a['sp_quant']}
                     FROM {schema}.saida_produto sp
                     JOIN {schema}.saida s ON sp.id_saida = s.id_original
                     LEFT JOIN {schema}.produto p ON sp.id_produto = p.id_original
-                    {where_saida} GROUP BY 1 ORDER BY 2 DESC LIMIT {limit}
+                    {where_itens} GROUP BY 1 ORDER BY 2 DESC LIMIT {limit}
                 """
         elif tipo == "hora":
-             sql = f"""SELECT EXTRACT(HOUR FROM (s."data"::date + s."hora"::time))::text || 'h', SUM(NULLIF(s.total, '')::numeric), COUNT(*) FROM {schema}.saida s {where_saida} GROUP BY 1 ORDER BY 1 ASC"""
+             sql = f"""SELECT EXTRACT(HOUR FROM {x['s_hora']})::text || 'h', {a['s_total']}, {a['vendas']} FROM {schema}.saida s {where_saida} GROUP BY 1 ORDER BY 1 ASC"""
 
         elif tipo == "vendedor":
             # NOVA LÓGICA: Vinculando vendedor através dos itens (saida_produto)
-            if verificar_tabela(cursor, schema, 'vendedor'):
+            if schema_cache.existe(cursor, schema, 'vendedor'):
                 sql = f"""
                     SELECT 
                         COALESCE(v.nome, 'Vendedor ' || sp.id_vendedor, 'N/D'), 
-                        SUM(NULLIF(sp.total, '')::numeric), 
-                        COUNT(DISTINCT sp.id_saida) 
+                        {a['sp_total']}, 
+                        {a['vendas_itens']} 
                     FROM {schema}.saida_produto sp
                     JOIN {schema}.saida s ON sp.id_saida = s.id_original
                     LEFT JOIN {schema}.vendedor v ON sp.id_vendedor = v.id_original 
-                    {where_saida} 
+                    {where_itens} 
                     GROUP BY 1 
                     ORDER BY 2 DESC 
                     LIMIT {limit}
                 """
 
+        # Período coberto pelos resumos diários: mesma consulta, lida do resumo
+        if sql and tipo in resumos.RANKINGS and resumos.cobre(cursor, schema, anterior[0] if anterior else data_inicio):
+            sql = resumos.sql_ranking(cursor, schema, tipo, limit, comparativo=bool(anterior))
+
         # IMPORTANTE: Esta execução deve estar DENTRO do bloco try
         if sql:
-            cursor.execute(sql, (data_inicio, data_fim))
+            cursor.execute(sql, _parametros_periodo(data_inicio, data_fim, anterior))
+            if anterior:
+                return [{"nome": str(r[0]), "total": _comparar(r[1], r[2]), "qtd": _comparar(r[3], r[4])}
+                        for r in cursor.fetchall()]
             return [{"nome": str(r[0]), "total": float(r[1]), "qtd": float(r[2])} for r in cursor.fetchall()]
-        
+    
         return []
 
     except Exception as e:
         # Este bloco FECHA o try iniciado lá em cima
         print(f"Erro Ranking {tipo}: {e}")
-        return []
-    finally:
-        # Este bloco SEMPRE executa para fechar a conexão
-        conn.close()
\ No newline at end of file
+        return None
+
+# --- COMPARAÇÃO ENTRE PERÍODOS ---
+# Período atual x anterior (por padrão o de mesma duração logo antes), lidos
+# na mesma varredura. Cada métrica: {atual, anterior, delta, delta_percent}.
+@router.get("/reports/dashboard-cards/comparativo")
+def get_dashboard_cards_comparativo(data_inicio: date, data_fim: date, request: Request, response: Response,
+                                    anterior_inicio: Optional[date] = None, anterior_fim: Optional[date] = None,
+                                    schema: str = Depends(validar_token)):
+    anterior = periodo_anterior(data_inicio, data_fim, anterior_inicio, anterior_fim)
+    with conexao() as conn:
+        cursor = conn.cursor()
+        # Uma escrita em qualquer dia dos dois períodos muda a versão
+        versao = cache_relatorios.versao_periodo(cursor, schema, anterior[0], data_fim)
+        chave = ("dashboard-cards-comparativo", data_inicio, data_fim) + anterior
+        nao_modificado = condicional(request, response, schema, chave, versao)
+        if nao_modificado: return nao_modificado
+        resultado = em_cache(schema, chave, versao, lambda: calcular_cards(cursor, schema, data_inicio, data_fim, anterior))
+        if resultado is None:
+            sem_cache(response)
+            return {k: _comparar(0, 0) for k in DashboardCards.__annotations__}
+        return resultado
+
+@router.get("/reports/ranking/{tipo}/comparativo")
+def get_ranking_comparativo(tipo: str, data_inicio: date, data_fim: date, request: Request, response: Response,
+                            anterior_inicio: Optional[date] = None, anterior_fim: Optional[date] = None,
+                            limit: int = 20, schema: str = Depends(validar_token)):
+    """ Top-N do período atual com os valores de cada item no anterior. """
+    if tipo == "dia":
+        # As linhas são os próprios dias: não há o que parear entre os períodos
+        raise HTTPException(status_code=400, detail="Ranking por dia não tem comparativo")
+    anterior = periodo_anterior(data_inicio, data_fim, anterior_inicio, anterior_fim)
+    with conexao() as conn:
+        cursor = conn.cursor()
+        versao = cache_relatorios.versao_periodo(cursor, schema, anterior[0], data_fim)
+        chave = ("ranking-comparativo", tipo, data_inicio, data_fim, limit) + anterior
+        nao_modificado = condicional(request, response, schema, chave, versao)
+        if nao_modificado: return nao_modificado
+        resultado = em_cache(schema, chave, versao, lambda: calcular_ranking(cursor, schema, tipo, data_inicio, data_fim, limit, anterior))
+        if resultado is None:
+            sem_cache(response)
+            return []
+        return resultado
+
+# --- SÉRIE TEMPORAL ---
+# granularidade -> unidade do date_trunc
+GRANULARIDADES = {"hora": "hour", "dia": "day", "semana": "week", "mes": "month"}
+SERIE_MAX_PONTOS = int(os.getenv("SERIE_MAX_PONTOS", "2000"))
+
+def granularidade_padrao(data_inicio: date, data_fim: date):
+    """ Sem granularidade pedida: mais grossa quanto maior o período. """
+    dias = (data_fim - data_inicio).days + 1
+    if dias <= 2: return "hora"
+    if dias <= 92: return "dia"
+    if dias <= 731: return "semana"
+    return "mes"
+
+def _pontos(granularidade, data_inicio: date, data_fim: date):
+    dias = (data_fim - data_inicio).days + 1
+    if granularidade == "hora": return dias * 24
+    if granularidade == "semana": return dias // 7 + 2
+    if granularidade == "mes": return (data_fim.year - data_inicio.year) * 12 + data_fim.month - data_inicio.month + 1
+    return dias
+
+@router.get("/reports/serie")
+def get_serie(data_inicio: date, data_fim: date, request: Request, response: Response,
+              granularidade: Optional[str] = None, schema: str = Depends(validar_token)):
+    """
+    Faturamento e vendas por hora, dia, semana ou mês, com os intervalos sem
+    venda zerados. Colunar: {"granularidade", "inicio": [...], "faturamento": [...], "vendas": [...]},
+    onde inicio é o começo de cada intervalo (semana começa na segunda).
+    """
+    granularidade = granularidade or granularidade_padrao(data_inicio, data_fim)
+    if granularidade not in GRANULARIDADES:
+        raise HTTPException(status_code=400, detail=f"Granularidade inválida: {granularidade} (use {', '.join(GRANULARIDADES)})")
+    if data_fim < data_inicio:
+        raise HTTPException(status_code=400, detail="Período inválido")
+    if _pontos(granularidade, data_inicio, data_fim) > SERIE_MAX_PONTOS:
+        raise HTTPException(status_code=400, detail=f"Período longo demais para granularidade {granularidade} (máximo {SERIE_MAX_PONTOS} pontos)")
+
+    with conexao() as conn:
+        cursor = conn.cursor()
+        versao = cache_relatorios.versao_periodo(cursor, schema, data_inicio, data_fim)
+        chave = ("serie", granularidade, data_inicio, data_fim)
+        nao_modificado = condicional(request, response, schema, chave, versao)
+        if nao_modificado: return nao_modificado
+        resultado = em_cache(schema, chave, versao, lambda: _calcular_serie(cursor, schema, granularidade, data_inicio, data_fim))
+        if resultado is None:
+            sem_cache(response)
+            return {"granularidade": granularidade, "inicio": [], "faturamento": [], "vendas": []}
+        return resultado
+
+def _calcular_serie(cursor, schema, granularidade, data_inicio, data_fim):
+    vazio = {"granularidade": granularidade, "inicio": [], "faturamento": [], "vendas": []}
+    if not schema_cache.existe(cursor, schema, 'saida', 'total'): return vazio
+
+    unidade = GRANULARIDADES[granularidade]
+    x = expressoes_tipadas(cursor, schema)
+    if resumos.cobre(cursor, schema, data_inicio):
+        # Período coberto: agrega o resumo diário (ou o por hora), sem ler as vendas
+        valores = resumos.sql_serie(schema, unidade)
+    else:
+        if unidade == "hour":
+            # "data" pode vir sem a hora: a hora da venda está na coluna própria
+            balde = f"date_trunc('day', {x['s_data']}::timestamp) + make_interval(hours => EXTRACT(HOUR FROM {x['s_hora']})::int)"
+        else:
+            balde = f"date_trunc('{unidade}', {x['s_data']}::timestamp)"
+        valores = f"""
+            SELECT {balde} AS t, SUM({x['s_total']}) AS faturamento, COUNT(*) AS vendas
+            FROM {schema}.saida s
+            WHERE {x['s_data']} >= %(ini)s AND {x['s_data']} < %(fim)s
+              AND (s.eliminado IS NULL OR s.eliminado = 'N')
+              AND (s.normal IS NULL OR s.normal = 'S')
+            GROUP BY 1
+        """
+
+    # Todos os intervalos do período, com ou sem venda
+    sql = f"""
+        WITH v AS ({valores})
+        SELECT g.t, COALESCE(v.faturamento, 0), COALESCE(v.vendas, 0)
+        FROM generate_series(date_trunc('{unidade}', %(ini)s::timestamp),
+                             date_trunc('{unidade}', %(fim)s::timestamp - interval '1 hour'),
+                             interval '1 {unidade}') AS g(t)
+        LEFT JOIN v ON v.t = g.t
+        ORDER BY g.t
+    """
+    try:
+        cursor.execute(sql, _parametros_periodo(data_inicio, data_fim))
+        linhas = cursor.fetchall()
+        formato = "%Y-%m-%dT%H:%M" if unidade == "hour" else "%Y-%m-%d"
+        return {
+            "granularidade": granularidade,
+            "inicio": [r[0].strftime(formato) for r in linhas],
+            "faturamento": [float(r[1]) for r in linhas],
+            "vendas": [int(r[2]) for r in linhas],
+        }
+    except Exception as e:
+        print(f"Erro Série {granularidade}: {e}")
+        return None
+
+# --- EXPORTAÇÃO ---
+@router.get("/reports/export")
+def exportar(data_inicio: date, data_fim: date, conteudo: str = "vendas", formato: str = "csv", schema: str = Depends(validar_token)):
+    """
+    Listagem completa de vendas, itens ou pagamentos do período, em CSV ou
+    Parquet, enviada em blocos à medida que é lida (ver exportacao.py).
+    """
+    if data_fim < data_inicio:
+        raise HTTPException(status_code=400, detail="Período inválido")
+    with conexao() as conn:
+        cursor = conn.cursor()
+        exportacao.validar(cursor, schema, conteudo, formato)
+        sql = exportacao.sql_exportacao(cursor, schema, conteudo, data_inicio, data_fim)
+
+    nome = f"{conteudo}_{data_inicio:%Y%m%d}_{data_fim:%Y%m%d}.{formato}"
+    return StreamingResponse(exportacao.gerar(sql, formato), media_type=exportacao.FORMATOS[formato], headers={
+        "Content-Disposition": f'attachment; filename="{nome}"', "Cache-Control": "no-store",
+    })
+
+# --- AVISOS AO VIVO (SSE) ---
+SSE_PULSO = int(os.getenv("SSE_PULSO", "15"))  # Segundos entre comentários de keep-alive
+
+@router.get("/reports/eventos")
+async def get_eventos(request: Request, schema: str = Depends(validar_token)):
+    """
+    Server-Sent Events da loja: "dados" com {de, ate} (dias de venda
+    alterados; sem datas = cadastro, vale para qualquer período) e
+    "reiniciar" (avisos perdidos, recarregar tudo). O cliente refaz o
+    relatório só quando o aviso cobre o período na tela.
+    """
+    assinante = eventos.assinar(schema)
+    if assinante is None:
+        raise HTTPException(status_code=503, detail="Limite de conexões ao vivo atingido", headers={"Retry-After": "30"})
+
+    async def gerar():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    evento = await asyncio.wait_for(assinante.fila.get(), SSE_PULSO)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected(): break
+                    yield ": pulso\n\n"
+                    continue
+                dados = {k: v for k, v in evento.items() if k != "tipo"}
+                yield f"event: {evento['tipo']}\ndata: {json.dumps(dados)}\n\n"
+        finally:
+            eventos.cancelar(assinante)
+
+    return StreamingResponse(gerar(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"})
+
+# --- PAINEL EM LOTE ---
+def _executar_widget(schema, w: WidgetSchema, data_inicio, data_fim, versao):
+    """
+    Um widget numa conexão própria do pool; mesmo cache dos endpoints
+    individuais. None se a consulta falhou.
+    """
+    with conexao() as conn:
+        cursor = conn.cursor()
+        if w.widget == "cards":
+            return em_cache(schema, ("dashboard-cards", data_inicio, data_fim), versao,
+                             lambda: calcular_cards(cursor, schema, data_inicio, data_fim))
+        return em_cache(schema, ("ranking", w.tipo, data_inicio, data_fim, w.limit), versao,
+                         lambda: calcular_ranking(cursor, schema, w.tipo, data_inicio, data_fim, w.limit))
+
+@router.post("/reports/dashboard")
+def get_dashboard(dados: DashboardSchema, request: Request, response: Response, schema: str = Depends(validar_token)):
+    """
+    Cards e rankings do painel numa só chamada: os widgets rodam em
+    paralelo (até DASHBOARD_CONCORRENCIA por requisição), então o tempo
+    total fica perto do da consulta mais lenta. Resposta na ordem pedida.
+    """
+    if not dados.widgets or len(dados.widgets) > DASHBOARD_MAX_WIDGETS:
+        raise HTTPException(status_code=400, detail=f"Informe de 1 a {DASHBOARD_MAX_WIDGETS} widgets")
+    for w in dados.widgets:
+        if w.widget not in ("cards", "ranking") or (w.widget == "ranking" and not w.tipo):
+            raise HTTPException(status_code=400, detail=f"Widget inválido: {w.widget} {w.tipo or ''}".strip())
+
+    # Todos os widgets são do mesmo período: uma versão e um ETag para o lote
+    with conexao() as conn:
+        versao = cache_relatorios.versao_periodo(conn.cursor(), schema, dados.data_inicio, dados.data_fim)
+    chave = ("dashboard", dados.data_inicio, dados.data_fim) + tuple((w.widget, w.tipo, w.limit) for w in dados.widgets)
+    nao_modificado = condicional(request, response, schema, chave, versao)
+    if nao_modificado: return nao_modificado
+
+    with ThreadPoolExecutor(max_workers=min(DASHBOARD_CONCORRENCIA, len(dados.widgets))) as executor:
+        futuros = [executor.submit(_executar_widget, schema, w, dados.data_inicio, dados.data_fim, versao)
+                   for w in dados.widgets]
+        resultados = [f.result() for f in futuros]
+
+    widgets = []
+    for w, r in zip(dados.widgets, resultados):
+        if r is None:
+            # Falha de um widget: vazio, e o lote não deve ser reaproveitado pelo ETag
+            sem_cache(response)
+            r = {k:0 for k in DashboardCards.__annotations__} if w.widget == "cards" else []
+        widgets.append({"widget": w.widget, "tipo": w.tipo, "dados": r})
+    return {"widgets": widgets}
@@ -1,8 +1,25 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
+from datetime import date
 from security import validar_token
-from database_utils import get_db_connection
+from database_utils import conexao
+from bulk_upsert import aplicar_lote, colunas_do_lote
+from psycopg2 import errors
+import schema_cache
+import executor_sync
+import ingest_stream
+import fila_ingestao
+import idempotencia
+import tipos_colunas
+import resumos
+import cache_relatorios
+import eventos
+import integridade
+import reconciliacao
+import particionamento
+import json
 
 router = APIRouter()
 
@@ -10,21 +27,30 @@ router = APIRouter()
 class DeleteVendaSchema(BaseModel):
     id_original: str
 
+# --- MODELO PARA RECONCILIAÇÃO ---
+class ReconciliarSchema(BaseModel):
+    nivel: str
+    data_inicio: date
+    data_fim: date
+    digestos: Dict[str, list]   # chave -> [vendas, centavos, md5]
+    id_de: Optional[str] = None  # Faixa de ids [id_de, id_ate) de um dia grande
+    id_ate: Optional[str] = None
+
 # --- UTILS ---
-def get_existing_columns(cursor, schema, tabela):
-    cursor.execute(f"SELECT column_name FROM information_schema.columns WHERE table_schema = '{schema}' AND table_name = '{tabela}'")
-    return {row[0] for row in cursor.fetchall()}
+def preparar_tabela(cursor, schema: str, tabela: str, dados: List[dict]):
+    """
+    Garante tabela, colunas e índice único para o lote. Consulta o cache de
+    metadados e só executa DDL quando o payload traz algo ainda não visto.
+    """
+    chaves_json = [k for k in colunas_do_lote(dados) if k != 'id_original']
+    meta = schema_cache.obter_tabela(cursor, schema, tabela)
 
-# --- UPSERT INTELIGENTE ---
-def upsert_generico(schema: str, tabela: str, dados: List[dict]):
-    if not dados: return {"status": "vazio"}
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        chaves_json = [k for k in dados[0].keys() if k not in ('id_original', 'id')]
-        cols_create = ", ".join([f"{k} TEXT" for k in chaves_json])
-        
+    if meta is not None:
+        faltando = [c for c in chaves_json + ['modificado_em', 'id_original'] if c not in meta["colunas"]]
+        if not faltando and meta["indice_id"]: return
+
+    if meta is None:
+        cols_create = ", ".join([f"{k} {tipos_colunas.tipo_coluna(tabela, k)}" for k in chaves_json])
         sql_create = f"""
             CREATE TABLE IF NOT EXISTS {schema}.{tabela} (
                 uuid_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -35,61 +61,325 @@ def upsert_generico(schema: str, tabela: str, dados: List[dict]):
             )
         """
         cursor.execute(sql_create)
-        
-        colunas_banco = get_existing_columns(cursor, schema, tabela)
-        for col in chaves_json:
-            if col not in colunas_banco:
-                cursor.execute(f"ALTER TABLE {schema}.{tabela} ADD COLUMN {col} TEXT")
+        colunas_banco = set(chaves_json) | {'uuid_id', 'id_original', 'criado_em', 'modificado_em'}
+    else:
+        colunas_banco = meta["colunas"]
+
+    # IF NOT EXISTS: outro worker pode ter criado a coluna depois do nosso cache
+    for col in chaves_json:
+        if col not in colunas_banco:
+            cursor.execute(f"ALTER TABLE {schema}.{tabela} ADD COLUMN IF NOT EXISTS {col} {tipos_colunas.tipo_coluna(tabela, col)}")
+
+    if 'modificado_em' not in colunas_banco: cursor.execute(f"ALTER TABLE {schema}.{tabela} ADD COLUMN IF NOT EXISTS modificado_em TIMESTAMP DEFAULT NOW()")
+    if 'id_original' not in colunas_banco: cursor.execute(f"ALTER TABLE {schema}.{tabela} ADD COLUMN IF NOT EXISTS id_original VARCHAR(50)")
 
-        if 'modificado_em' not in colunas_banco: cursor.execute(f"ALTER TABLE {schema}.{tabela} ADD COLUMN modificado_em TIMESTAMP DEFAULT NOW()")
-        if 'id_original' not in colunas_banco: cursor.execute(f"ALTER TABLE {schema}.{tabela} ADD COLUMN id_original VARCHAR(50)")
+    if meta is None or not meta["indice_id"]:
+        # Tabela particionada não aceita índice único sem a chave de partição
+        unico = "" if particionamento.particionada(meta) else "UNIQUE "
+        cursor.execute(f"CREATE {unico}INDEX IF NOT EXISTS idx_{tabela}_id_original ON {schema}.{tabela} (id_original)")
 
+    # Recarrega depois do DDL; se a transação falhar, upsert_generico invalida a entrada
+    schema_cache.carregar_tabela(cursor, schema, tabela)
+    # Tabela/coluna nova: os outros workers relêem o retrato da loja (relatórios)
+    schema_cache.publicar_alteracao(cursor, schema)
+
+def aplicar_com_releitura(cursor, schema: str, tabelas: List[str], aplicar):
+    """
+    aplicar(cursor) -> dict num savepoint da transação do chamador. Se o
+    cache de metadados estiver desatualizado (tabela recriada por fora, ex.:
+    migrar_tipos, particionamento), relê o catálogo e tenta uma segunda vez.
+    Usado pelo sync direto e pela fila de ingestão.
+    """
+    for tentativa in range(2):
+        cursor.execute("SAVEPOINT releitura_cache")
         try:
-            cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{tabela}_id_original ON {schema}.{tabela} (id_original)")
-        except: pass
-
-        for item in dados:
-            campos = [k for k in item.keys() if k != 'id'] 
-            valores = [str(item[k]) if item[k] is not None else None for k in campos]
-            placeholders = ", ".join(["%s"] * len(valores))
-            cols_insert = ", ".join(campos)
-            
-            update_set = ", ".join([f"{c} = EXCLUDED.{c}" for c in campos if c != 'id_original'])
-            if update_set: update_set += ", modificado_em = NOW()"
-            else: update_set = "modificado_em = NOW()"
-            
-            sql_insert = f"""
-                INSERT INTO {schema}.{tabela} ({cols_insert})
-                VALUES ({placeholders})
-                ON CONFLICT (id_original) DO UPDATE SET {update_set}
-            """
-            cursor.execute(sql_insert, valores)
-            
-        conn.commit()
-        return {"status": "sucesso", "tabela": tabela, "qtd": len(dados)}
+            resultado = aplicar(cursor)
+            cursor.execute("RELEASE SAVEPOINT releitura_cache")
+            return resultado
+        except (errors.UndefinedTable, errors.UndefinedColumn):
+            cursor.execute("ROLLBACK TO SAVEPOINT releitura_cache")
+            for tabela in tabelas: schema_cache.invalidar(schema, tabela)
+            if tentativa: raise
+
+def depois_do_commit(schema: str):
+    """ Lote gravado (direto ou pela fila): confere em segundo plano o que ele criou ou corrigiu. """
+    integridade.agendar(schema)
+
+def executar_em_transacao(schema: str, tabelas: List[str], aplicar, chave: str = None):
+    """
+    Executa aplicar(cursor) -> dict numa única transação e faz o commit.
+    Com chave de idempotência, um reenvio do mesmo lote devolve o resultado
+    gravado sem tocar nas tabelas.
+    """
+    with conexao() as conn:
+        cursor = conn.cursor()
+        try:
+            if chave:
+                anterior = idempotencia.reservar(cursor, schema, chave)
+                if anterior is not None:
+                    conn.rollback()
+                    return anterior
+            resultado = aplicar_com_releitura(cursor, schema, tabelas, aplicar)
+            if chave: idempotencia.registrar(cursor, schema, chave, resultado)
+            conn.commit()
+            depois_do_commit(schema)
+            return resultado
+        except Exception:
+            conn.rollback()
+            for tabela in tabelas: schema_cache.invalidar(schema, tabela)
+            raise
+
+def somar_resultados(total: dict, parcial: dict):
+    """ Acumula os contadores de blocos de um mesmo lote (streaming). """
+    for k, v in parcial.items():
+        if isinstance(v, int) and not isinstance(v, bool): total[k] = total.get(k, 0) + v
+        else: total.setdefault(k, v)
+    return total
+
+def dados_alterados(cursor, schema: str, dias=None):
+    """
+    Dias de venda alterados na transação: refaz o resumo diário, sobe a
+    versão dos dias (cache de relatórios) e avisa os painéis abertos (SSE,
+    entregue no commit). dias=None: cadastro alterado, sobe a versão global.
+    """
+    if dias is not None: resumos.recalcular_dias(cursor, schema, dias)
+    cache_relatorios.marcar_alterados(cursor, schema, dias)
+    eventos.publicar_alteracao(cursor, schema, dias)
+
+# --- UPSERT INTELIGENTE ---
+def aplicar_tabela(cursor, schema: str, tabela: str, dados: List[dict]):
+    preparar_tabela(cursor, schema, tabela, dados)
+    # Valores malformados em colunas tipadas não derrubam o lote
+    validos, rejeitados = tipos_colunas.separar_validos(schema_cache.obter_tabela(cursor, schema, tabela), dados)
+    qtd_rejeitados = tipos_colunas.gravar_rejeitados(cursor, schema, tabela, rejeitados)
+    venda = tabela in TABELAS_VENDA
+    if venda: dias = resumos.dias_afetados(cursor, schema, tabela, validos)
+    # Lote inteiro em uma única operação (COPY para staging + merge)
+    contadores = aplicar_lote(cursor, schema, tabela, validos)
+    # Reenvio sem mudança (tudo 'ignorados') não mexe em resumo nem em versão
+    if contadores["inseridos"] + contadores["atualizados"]:
+        if venda: dados_alterados(cursor, schema, dias | resumos.dias_afetados(cursor, schema, tabela, validos))
+        else: dados_alterados(cursor, schema)
+    return {"status": "sucesso", "tabela": tabela, "qtd": len(dados), **contadores, "rejeitados": qtd_rejeitados}
+
+def upsert_generico(schema: str, tabela: str, dados: List[dict], chave: str = None):
+    if not dados: return {"status": "vazio"}
+
+    try:
+        return executar_em_transacao(schema, [tabela], lambda cursor: aplicar_tabela(cursor, schema, tabela, dados), chave)
     except Exception as e:
-        conn.rollback()
         print(f"Erro Sync {tabela}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally: conn.close()
 
-# --- ROTA DE DELEÇÃO ---
-@router.post("/sync/deletar-venda")
-def deletar_venda(dados: DeleteVendaSchema, schema: str = Depends(validar_token)):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+# --- DOCUMENTO DE VENDA (SAIDA + ITENS + PAGAMENTOS) ---
+TABELAS_VENDA = ["saida", "saida_produto", "saida_formapag"]
+
+def _substituir_filhos(cursor, schema: str, tabela: str, ids_venda: List[str], linhas: List[dict]):
+    """
+    O documento é a versão completa da venda: filhos que não vieram mais
+    (item excluído no PDV, pagamento refeito) são removidos, o resto é upsert.
+    A capa das vendas que perderam filhos tem o modificado_em tocado, para a
+    verificação de integridade (que anda por modificado_em) revê-las.
+    """
+    if linhas:
+        preparar_tabela(cursor, schema, tabela, linhas)
+    elif schema_cache.obter_tabela(cursor, schema, tabela) is None:
+        return dict(aplicar_lote(cursor, schema, tabela, []), removidos=0)
+
+    ids_filhos = [l.get('id_original') for l in linhas if l.get('id_original') is not None]
+    # Filho sem id_original também sai: NOT (NULL = ANY(...)) seria NULL e o manteria
+    cursor.execute(f"""
+        DELETE FROM {schema}.{tabela}
+        WHERE id_saida = ANY(%s) AND (id_original IS NULL OR NOT (id_original = ANY(%s)))
+        RETURNING id_saida
+    """, (ids_venda, ids_filhos))
+    afetadas = {linha[0] for linha in cursor.fetchall()}
+    removidos = cursor.rowcount
+    if afetadas and schema_cache.existe(cursor, schema, "saida", "modificado_em"):
+        cursor.execute(f"UPDATE {schema}.saida SET modificado_em = NOW() WHERE id_original = ANY(%s)", (list(afetadas),))
+    return dict(aplicar_lote(cursor, schema, tabela, linhas), removidos=removidos)
+
+def _validar_documentos(cursor, schema: str, documentos: List[dict]):
+    """
+    Um valor malformado em qualquer parte rejeita o documento inteiro: aplicar
+    só parte dos itens apagaria os outros em _substituir_filhos.
+    """
+    tipadas = {t: tipos_colunas.colunas_tipadas(schema_cache.obter_tabela(cursor, schema, t)) for t in TABELAS_VENDA}
+    validos, rejeitados = [], []
+    for d in documentos:
+        try:
+            validos.append(dict(d,
+                saida=tipos_colunas.validar_registro(tipadas["saida"], d["saida"]),
+                itens=[tipos_colunas.validar_registro(tipadas["saida_produto"], i) for i in d.get("itens") or []],
+                pagamentos=[tipos_colunas.validar_registro(tipadas["saida_formapag"], p) for p in d.get("pagamentos") or []]))
+        except tipos_colunas.ValorInvalido as e:
+            rejeitados.append((d["saida"].get("id_original"), d, str(e)))
+    return validos, rejeitados
+
+def aplicar_vendas(cursor, schema: str, documentos: List[dict]):
+    """
+    Aplica documentos completos de venda no cursor do chamador: capa, itens e
+    pagamentos na mesma transação.
+    """
+    preparar_tabela(cursor, schema, "saida", [d["saida"] for d in documentos])
+    for tabela, parte in (("saida_produto", "itens"), ("saida_formapag", "pagamentos")):
+        linhas = [l for d in documentos for l in d.get(parte) or []]
+        if linhas: preparar_tabela(cursor, schema, tabela, linhas)
+    documentos, rejeitados = _validar_documentos(cursor, schema, documentos)
+    qtd_rejeitados = tipos_colunas.gravar_rejeitados(cursor, schema, "saida", rejeitados)
+
+    saidas = [d["saida"] for d in documentos]
+    ids_venda = [str(s["id_original"]) for s in saidas]
+    itens = [dict(i, id_saida=i.get("id_saida") or s["id_original"]) for d, s in zip(documentos, saidas) for i in d.get("itens") or []]
+    pagamentos = [dict(p, id_saida=p.get("id_saida") or s["id_original"]) for d, s in zip(documentos, saidas) for p in d.get("pagamentos") or []]
+
+    resultado = {"status": "sucesso", "vendas": len(saidas), "itens": len(itens), "pagamentos": len(pagamentos),
+                 "rejeitados": qtd_rejeitados}
+    dias = resumos.dias_das_vendas(cursor, schema, ids_venda)
+    # Contadores somados das três tabelas
+    somar_resultados(resultado, aplicar_lote(cursor, schema, "saida", saidas))
+    somar_resultados(resultado, _substituir_filhos(cursor, schema, "saida_produto", ids_venda, itens))
+    somar_resultados(resultado, _substituir_filhos(cursor, schema, "saida_formapag", ids_venda, pagamentos))
+    if resultado["inseridos"] + resultado["atualizados"] + resultado["removidos"]:
+        dados_alterados(cursor, schema, dias | resumos.dias_das_vendas(cursor, schema, ids_venda))
+    return resultado
+
+def upsert_vendas(schema: str, documentos: List[dict], chave: str = None):
+    """
+    Capa, itens e pagamentos entram juntos ou nenhum entra.
+    """
+    if not documentos: return {"status": "vazio"}
+
     try:
-        cursor.execute(f"DELETE FROM {schema}.saida_produto WHERE id_saida = %s", (dados.id_original,))
-        cursor.execute(f"DELETE FROM {schema}.saida_formapag WHERE id_saida = %s", (dados.id_original,))
-        cursor.execute(f"DELETE FROM {schema}.saida WHERE id_original = %s", (dados.id_original,))
-        conn.commit()
-        return {"status": "deletado", "id": dados.id_original}
+        return executar_em_transacao(schema, TABELAS_VENDA, lambda cursor: aplicar_vendas(cursor, schema, documentos), chave)
     except Exception as e:
-        conn.rollback()
-        if "undefined table" in str(e): return {"status": "ignorado"}
-        print(f"Erro ao deletar venda {dados.id_original}: {e}")
+        print(f"Erro Sync vendas: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally: conn.close()
+
+# --- RECEBIMENTO DOS LOTES (JSON ARRAY OU NDJSON EM STREAMING) ---
+def _upsert_corpo(schema: str, tabela: str, corpo: bytes, chave: str):
+    return upsert_generico(schema, tabela, json.loads(corpo), chave)
+
+def _upsert_vendas_corpo(schema: str, corpo: bytes, chave: str):
+    return upsert_vendas(schema, json.loads(corpo), chave)
+
+def _resultado_gravado(schema: str, chave: str):
+    """ Resultado de um lote com esta chave já aplicado (transação curta, só leitura). """
+    with conexao() as conn:
+        anterior = idempotencia.reservar(conn.cursor(), schema, chave)
+        conn.rollback()
+        return anterior
+
+def _aplicar_bloco(schema: str, tabelas: List[str], aplicar, linhas: List[bytes], acumulado: dict, chave: str = None):
+    """
+    Bloco já lido por inteiro: parse e transação própria. A conexão só é
+    tomada aqui, nunca enquanto se espera o upload do agente. Devolve o
+    acumulado do lote com este bloco (é o que fica gravado na chave).
+    """
+    dados = [json.loads(l) for l in linhas]
+    return executar_em_transacao(schema, tabelas,
+                                 lambda cursor: somar_resultados(dict(acumulado), aplicar(cursor, schema, dados)), chave)
+
+async def receber_stream(request: Request, schema: str, tabelas: List[str], aplicar, chave: str = None):
+    """
+    NDJSON (gzip/zstd opcional) aplicado em blocos de tamanho fixo: a memória
+    não cresce com o tamanho do lote e um agente lento não segura conexão do
+    pool. Cada bloco é lido e só então aplicado numa transação própria
+    (executar_em_transacao); um documento de venda nunca fica dividido entre
+    blocos. Se o lote falhar no meio, os blocos anteriores ficam gravados e o
+    reenvio do agente os encontra iguais (ignorados). A chave de idempotência
+    é gravada com o último bloco. aplicar(cursor, schema, dados) -> dict por bloco.
+    """
+    async with executor_sync.fila_loja(schema):
+        try:
+            if chave:
+                anterior = await executor_sync.rodar(_resultado_gravado, schema, chave)
+                if anterior is not None: return anterior
+            # Um bloco de atraso: o último é aplicado junto com o registro da chave
+            resultado, pendente = {}, None
+            async for linhas in ingest_stream.iterar_blocos(request):
+                if pendente is not None:
+                    resultado = await executor_sync.rodar(_aplicar_bloco, schema, tabelas, aplicar, pendente, resultado)
+                pendente = linhas
+            if pendente is None: return {"status": "vazio"}
+            return await executor_sync.rodar(_aplicar_bloco, schema, tabelas, aplicar, pendente, resultado, chave)
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Erro Sync stream {', '.join(tabelas)}: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+# --- MODO ASSÍNCRONO (FILA DURÁVEL) ---
+def modo_assincrono(request: Request) -> bool:
+    """ 'Prefer: respond-async' (RFC 7240) ou ?modo=async. """
+    return ("respond-async" in request.headers.get("prefer", "").lower()
+            or request.query_params.get("modo") == "async")
+
+async def enfileirar_lote(request: Request, schema: str, tipo: str, chave: str = None):
+    """
+    Grava o corpo como veio (ainda comprimido) na fila durável e responde 202.
+    Fila cheia: 429 com Retry-After para o agente segurar o envio.
+    """
+    ingest_stream.conferir_encoding(request)
+    corpo = await request.body()
+    try:
+        id_lote = await executor_sync.rodar(fila_ingestao.enfileirar, schema, tipo, corpo,
+                                            request.headers.get("content-type", ""),
+                                            request.headers.get("content-encoding", ""), chave)
+    except fila_ingestao.FilaCheiaError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    return JSONResponse(status_code=202, content={"status": "aceito", "id_lote": id_lote},
+                        headers={"Location": f"/api/sync/lotes/{id_lote}"})
+
+def _aplicar_da_fila(cursor, schema: str, tipo: str, dados: List[dict], chave: str = None):
+    if chave:
+        anterior = idempotencia.reservar(cursor, schema, chave)
+        if anterior is not None: return anterior
+    if tipo == "vendas":
+        resultado = aplicar_com_releitura(cursor, schema, TABELAS_VENDA, lambda c: aplicar_vendas(c, schema, dados))
+    else:
+        resultado = aplicar_com_releitura(cursor, schema, [tipo], lambda c: aplicar_tabela(c, schema, tipo, dados))
+    if chave: idempotencia.registrar(cursor, schema, chave, resultado)
+    return resultado
+
+fila_ingestao.registrar_aplicador(_aplicar_da_fila, depois_do_commit)
+
+async def receber_lote(request: Request, schema: str, tabela: str):
+    """
+    Lê o corpo no event loop e faz o parse + upsert no executor de sync,
+    na fila da loja. O loop fica livre para as outras requisições.
+    """
+    chave = idempotencia.chave_da_requisicao(request)
+    if modo_assincrono(request):
+        return await enfileirar_lote(request, schema, tabela, chave)
+    if ingest_stream.eh_ndjson(request):
+        return await receber_stream(request, schema, [tabela],
+                                    lambda cursor, schema, dados: aplicar_tabela(cursor, schema, tabela, dados), chave)
+    corpo = await ingest_stream.ler_corpo(request)
+    return await executor_sync.executar(schema, _upsert_corpo, schema, tabela, corpo, chave)
+
+# --- ROTA DE DELEÇÃO ---
+@router.post("/sync/deletar-venda")
+async def deletar_venda(dados: DeleteVendaSchema, schema: str = Depends(validar_token)):
+    # Mesma fila dos lotes: a deleção não passa na frente de um upsert da mesma venda
+    return await executor_sync.executar(schema, _deletar_venda, schema, dados)
+
+def _deletar_venda(schema: str, dados: DeleteVendaSchema):
+    with conexao() as conn:
+        cursor = conn.cursor()
+        try:
+            dias = resumos.dias_das_vendas(cursor, schema, [dados.id_original])
+            cursor.execute(f"DELETE FROM {schema}.saida_produto WHERE id_saida = %s", (dados.id_original,))
+            cursor.execute(f"DELETE FROM {schema}.saida_formapag WHERE id_saida = %s", (dados.id_original,))
+            cursor.execute(f"DELETE FROM {schema}.saida WHERE id_original = %s", (dados.id_original,))
+            dados_alterados(cursor, schema, dias)
+            conn.commit()
+            return {"status": "deletado", "id": dados.id_original}
+        except Exception as e:
+            conn.rollback()
+            if "undefined table" in str(e): return {"status": "ignorado"}
+            print(f"Erro ao deletar venda {dados.id_original}: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
 
 
 # Adicione ao final de server/routers/sync.py
@@ -99,91 +389,136 @@ def get_ultimos_ids(schema: str = Depends(validar_token)):
     """
     Retorna o maior id_original de cada tabela para controle de sincronização.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with conexao() as conn:
+        cursor = conn.cursor()
     
-    # Lista de tabelas para verificar
-    tabelas = [
-        'saida', 'saida_produto', 'saida_formapag', 
-        'cliente', 'vendedor', 'usuario_pdv', 
-        'produto', 'grupo', 'secao', 
-        'fabricante', 'familia', 'formapag'
-    ]
+        # Lista de tabelas para verificar
+        tabelas = [
+            'saida', 'saida_produto', 'saida_formapag', 
+            'cliente', 'vendedor', 'usuario_pdv', 
+            'produto', 'grupo', 'secao', 
+            'fabricante', 'familia', 'formapag'
+        ]
     
-    resultado = {}
+        resultado = {}
 
-    try:
-        for tabela in tabelas:
-            # 1. Verifica se a tabela existe no schema
-            cursor.execute(f"SELECT to_regclass('{schema}.{tabela}')")
-            if cursor.fetchone()[0]:
-                # 2. Busca o maior ID (MAX)
-                # OBS: Se seus IDs forem numéricos mas salvos como texto, 
-                # a ordenação pode ser alfabética (ex: '10' < '2'). 
-                # Se for esse o caso, avise para ajustarmos o cast.
-                cursor.execute(f"SELECT MAX(id_original) FROM {schema}.{tabela}")
-                max_id = cursor.fetchone()[0]
-                resultado[tabela] = max_id if max_id is not None else "0"
-            else:
-                # Tabela ainda não criada
-                resultado[tabela] = "0"
+        try:
+            for tabela in tabelas:
+                # 1. Verifica se a tabela existe no schema
+                cursor.execute(f"SELECT to_regclass('{schema}.{tabela}')")
+                if cursor.fetchone()[0]:
+                    # 2. Busca o maior ID (MAX)
+                    # OBS: Se seus IDs forem numéricos mas salvos como texto, 
+                    # a ordenação pode ser alfabética (ex: '10' < '2'). 
+                    # Se for esse o caso, avise para ajustarmos o cast.
+                    cursor.execute(f"SELECT MAX(id_original) FROM {schema}.{tabela}")
+                    max_id = cursor.fetchone()[0]
+                    resultado[tabela] = max_id if max_id is not None else "0"
+                else:
+                    # Tabela ainda não criada
+                    resultado[tabela] = "0"
         
-        return resultado
+            return resultado
 
-    except Exception as e:
-        print(f"Erro ao buscar ultimos IDs: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+        except Exception as e:
+            print(f"Erro ao buscar ultimos IDs: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+# --- RECONCILIAÇÃO ---
+@router.post("/sync/reconciliar")
+def reconciliar(dados: ReconciliarSchema, schema: str = Depends(validar_token)):
+    """
+    Compara os digestos do agente com os da nuvem no mesmo nível e período
+    (ver reconciliacao.py) e devolve só as chaves que não batem.
+    """
+    reconciliacao.validar(dados.nivel, dados.data_inicio, dados.data_fim, dados.digestos)
+    with conexao() as conn:
+        cursor = conn.cursor()
+        try:
+            remotos = reconciliacao.digestos(cursor, schema, dados.nivel, dados.data_inicio, dados.data_fim,
+                                             dados.id_de, dados.id_ate)
+        except Exception as e:
+            print(f"Erro ao reconciliar {schema}: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+    return {"nivel": dados.nivel, **reconciliacao.comparar(dados.digestos, remotos)}
+
+
+# --- STATUS DA FILA ASSÍNCRONA ---
+@router.get("/sync/lotes/{id_lote}")
+def get_status_lote(id_lote: int, schema: str = Depends(validar_token)):
+    status = fila_ingestao.status_lote(schema, id_lote)
+    if not status: raise HTTPException(status_code=404, detail="Lote não encontrado")
+    return status
+
+@router.get("/sync/fila")
+def get_fila(schema: str = Depends(validar_token)):
+    """ Lotes desta loja aguardando aplicação. """
+    return fila_ingestao.profundidade(schema)
 
 
 # --- ROTAS DE CADASTRO ---
 @router.post("/sync/cadastros/produto")
 async def sync_produto(request: Request, schema: str = Depends(validar_token)): 
-    return upsert_generico(schema, "produto", await request.json())
+    return await receber_lote(request, schema, "produto")
 
 @router.post("/sync/cadastros/cliente")
 async def sync_cliente(request: Request, schema: str = Depends(validar_token)): 
-    return upsert_generico(schema, "cliente", await request.json())
+    return await receber_lote(request, schema, "cliente")
 
 @router.post("/sync/cadastros/vendedor")
 async def sync_vendedor(request: Request, schema: str = Depends(validar_token)): 
-    return upsert_generico(schema, "vendedor", await request.json())
+    return await receber_lote(request, schema, "vendedor")
 
 @router.post("/sync/cadastros/grupo")
 async def sync_grupo(request: Request, schema: str = Depends(validar_token)): 
-    return upsert_generico(schema, "grupo", await request.json())
+    return await receber_lote(request, schema, "grupo")
 
 @router.post("/sync/cadastros/secao")
 async def sync_secao(request: Request, schema: str = Depends(validar_token)): 
-    return upsert_generico(schema, "secao", await request.json())
+    return await receber_lote(request, schema, "secao")
 
 @router.post("/sync/cadastros/formapag")
 async def sync_formapag(request: Request, schema: str = Depends(validar_token)): 
-    return upsert_generico(schema, "formapag", await request.json())
+    return await receber_lote(request, schema, "formapag")
 
 @router.post("/sync/cadastros/fabricante")
 async def sync_fabricante(request: Request, schema: str = Depends(validar_token)): 
-    return upsert_generico(schema, "fabricante", await request.json())
+    return await receber_lote(request, schema, "fabricante")
 
 @router.post("/sync/cadastros/familia")
 async def sync_familia(request: Request, schema: str = Depends(validar_token)): 
-    return upsert_generico(schema, "familia", await request.json())
+    return await receber_lote(request, schema, "familia")
 
 # --- NOVA ROTA: USUÁRIO PDV ---
 @router.post("/sync/cadastros/usuario_pdv")
 async def sync_usuario_pdv(request: Request, schema: str = Depends(validar_token)): 
-    return upsert_generico(schema, "usuario_pdv", await request.json())
+    return await receber_lote(request, schema, "usuario_pdv")
 
 # --- ROTAS DE MOVIMENTO ---
+@router.post("/sync/vendas")
+async def sync_vendas(request: Request, schema: str = Depends(validar_token)):
+    """
+    Lista de documentos {"saida": {...}, "itens": [...], "pagamentos": [...]}
+    aplicados atomicamente (substitui as três rotas abaixo para agentes novos).
+    Em NDJSON, cada linha é um documento.
+    """
+    chave = idempotencia.chave_da_requisicao(request)
+    if modo_assincrono(request):
+        return await enfileirar_lote(request, schema, "vendas", chave)
+    if ingest_stream.eh_ndjson(request):
+        return await receber_stream(request, schema, TABELAS_VENDA, aplicar_vendas, chave)
+    corpo = await ingest_stream.ler_corpo(request)
+    return await executor_sync.executar(schema, _upsert_vendas_corpo, schema, corpo, chave)
+
 @router.post("/sync/saida")
 async def sync_saida(request: Request, schema: str = Depends(validar_token)): 
-    return upsert_generico(schema, "saida", await request.json())
+    return await receber_lote(request, schema, "saida")
 
 @router.post("/sync/saida_produto")
 async def sync_saida_produto(request: Request, schema: str = Depends(validar_token)): 
-    return upsert_generico(schema, "saida_produto", await request.json())
+    return await receber_lote(request, schema, "saida_produto")
 
 @router.post("/sync/saida_formapag")
 async def sync_saida_formapag(request: Request, schema: str = Depends(validar_token)): 
-    return upsert_generico(schema, "saida_formapag", await request.json())
\ No newline at end of file
+    return await receber_lote(request, schema, "saida_formapag")
\ No newline at end of file
@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+
+import notificacoes
+
+# Arquivo: server/schema_cache.py
+# Cache em memória (por processo) das colunas e do índice único de cada
+# tabela de tenant. Evita consultar o catálogo e rodar DDL a cada lote.
+# O retrato da loja (quais tabelas/colunas existem) sai de uma só consulta
+# e responde existe() nos relatórios; o DDL do upsert avisa os workers.
+#
+# Entre workers: o cache só pode "achar que falta" algo que outro worker já
+# criou (o DDL é idempotente e roda de novo sem efeito). Para o caso raro de
+# uma tabela/schema recriado por fora, as entradas expiram após o TTL e o
+# upsert invalida a tabela ao receber UndefinedTable/UndefinedColumn.
+
+SCHEMA_CACHE_TTL = int(os.getenv("SCHEMA_CACHE_TTL", "300"))
+CANAL_SCHEMA = "schema_alterado"   # DDL feito por fora (migrar_tipos.py): payload = schema
+
+_cache = {}
+_schemas = {}   # schema -> (instante, {tabela: set(colunas)}): o que existe na loja
+_lock = threading.Lock()
+
+
+def carregar_tabela(cursor, schema: str, tabela: str):
+    """
+    Lê do catálogo as colunas (nome -> tipo), se o índice em id_original
+    existe e se a tabela é particionada. Retorna None se a tabela não existe.
+    """
+    cursor.execute("""
+        SELECT a.attname, format_type(a.atttypid, a.atttypmod),
+               to_regclass(%s) IS NOT NULL, c.relkind = 'p'
+        FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relname = %s
+          AND a.attnum > 0 AND NOT a.attisdropped
+    """, (f"{schema}.idx_{tabela}_id_original", schema, tabela))
+    linhas = cursor.fetchall()
+    if not linhas:
+        with _lock:
+            if schema in _schemas: _schemas[schema][1].pop(tabela, None)
+        return None
+
+    meta = {"colunas": {r[0]: r[1] for r in linhas}, "indice_id": linhas[0][2], "particionada": linhas[0][3]}
+    with _lock:
+        _cache[(schema, tabela)] = (time.monotonic(), meta)
+        if schema in _schemas: _schemas[schema][1][tabela] = set(meta["colunas"])
+    return meta
+
+
+def carregar_schema(cursor, schema: str):
+    """
+    Uma única consulta ao catálogo para todas as tabelas da loja: preenche
+    os metadados de cada uma e o retrato {tabela: colunas} usado por existe().
+    """
+    cursor.execute("""
+        SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod),
+               to_regclass(n.nspname || '.idx_' || c.relname || '_id_original') IS NOT NULL, c.relkind = 'p'
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+        WHERE n.nspname = %s AND c.relkind IN ('r', 'p') AND NOT c.relispartition
+    """, (schema,))
+    metas = {}
+    for tabela, coluna, tipo, indice_id, particionada in cursor.fetchall():
+        meta = metas.setdefault(tabela, {"colunas": {}, "indice_id": indice_id, "particionada": particionada})
+        meta["colunas"][coluna] = tipo
+
+    agora = time.monotonic()
+    retrato = {tabela: set(meta["colunas"]) for tabela, meta in metas.items()}
+    with _lock:
+        for chave in [k for k in _cache if k[0] == schema]:
+            del _cache[chave]
+        for tabela, meta in metas.items():
+            _cache[(schema, tabela)] = (agora, meta)
+        _schemas[schema] = (agora, retrato)
+    return retrato
+
+
+def _retrato(schema: str):
+    with _lock:
+        entrada = _schemas.get(schema)
+    if entrada and time.monotonic() - entrada[0] < SCHEMA_CACHE_TTL:
+        return entrada[1]
+    return None
+
+
+def existe(cursor, schema: str, tabela: str, coluna: str = None) -> bool:
+    """ A tabela (e a coluna) existe na loja? Sem consulta ao catálogo enquanto o retrato vale. """
+    retrato = _retrato(schema)
+    if retrato is None: retrato = carregar_schema(cursor, schema)
+    colunas = retrato.get(tabela)
+    return colunas is not None and (coluna is None or coluna in colunas)
+
+
+def publicar_alteracao(cursor, schema: str):
+    """ DDL na loja: os workers descartam o cache dela quando a transação fizer commit. """
+    notificacoes.publicar(cursor, CANAL_SCHEMA, schema)
+
+
+def obter_tabela(cursor, schema: str, tabela: str):
+    """
+    Metadados da tabela vindos do cache; consulta o catálogo apenas na
+    primeira vez ou após o TTL.
+    """
+    with _lock:
+        entrada = _cache.get((schema, tabela))
+    if entrada and time.monotonic() - entrada[0] < SCHEMA_CACHE_TTL:
+        return entrada[1]
+    # Tabela ausente no retrato da loja: não vai ao catálogo a cada chamada
+    retrato = _retrato(schema)
+    if retrato is not None and tabela not in retrato: return None
+    return carregar_tabela(cursor, schema, tabela)
+
+
+def invalidar(schema: str, tabela: str = None):
+    with _lock:
+        _schemas.pop(schema, None)
+        if tabela:
+            _cache.pop((schema, tabela), None)
+        else:
+            for chave in [k for k in _cache if k[0] == schema]:
+                del _cache[chave]
+
+
+def _ao_notificar(payload):
+    # None: listener reconectou e pode ter perdido avisos
+    if payload:
+        invalidar(payload)
+    else:
+        with _lock:
+            _cache.clear()
+            _schemas.clear()
+
+
+notificacoes.registrar(CANAL_SCHEMA, _ao_notificar)
@@ -1,8 +1,74 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
 from fastapi import Header, HTTPException
-from database_utils import get_db_connection
+from fastapi.concurrency import run_in_threadpool
+from database_utils import conexao
+import notificacoes
 
 # Arquivo: server/security.py
 
+# --- CACHE TOKEN -> SCHEMA ---
+# Revogação imediata via NOTIFY (admin.alterar_status_cliente / criar_cliente).
+# O TTL curto é a rede de segurança caso uma notificação se perca.
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", "30"))
+TOKEN_CACHE_MAX = int(os.getenv("TOKEN_CACHE_MAX", "5000"))
+CANAL_TOKENS = "tokens_invalidados"
+
+_tokens = OrderedDict()   # sha256 do token -> (validado_em, schema)
+_lock = threading.Lock()
+_geracao = 0              # Incrementa a cada invalidação (evita regravar um token revogado durante a consulta)
+
+
+def hash_token(token: str) -> str:
+    """ Chave do cache e do NOTIFY: o token em si não sai do worker nem vai para o log do Postgres. """
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _descartar(chave: str = None):
+    """ Remove do cache local o token com este hash (ou todos, se None). """
+    global _geracao
+    with _lock:
+        _geracao += 1
+        if chave is None: _tokens.clear()
+        else: _tokens.pop(chave, None)
+
+
+def invalidar_token(token: str = None):
+    """ Remove um token do cache local (ou todos, se token for None). """
+    _descartar(None if token is None else hash_token(token))
+
+
+def notificar_token_invalidado(cursor, token: str):
+    """
+    Avisa todos os workers (inclusive este) para descartar o token. Vai só
+    o hash. Entregue no commit da transação do cursor.
+    """
+    if token: notificacoes.publicar(cursor, CANAL_TOKENS, hash_token(token))
+
+
+notificacoes.registrar(CANAL_TOKENS, _descartar)
+
+
+def _buscar_schema(token):
+    with conexao() as conn:
+        cursor = conn.cursor()
+
+        # CORREÇÃO: Adicionado "AND ativo = TRUE" na consulta
+        cursor.execute("""
+            SELECT schema_name 
+            FROM lojas_sincronizadas 
+            WHERE api_token = %s AND ativo = TRUE
+        """, (token,))
+
+        resultado = cursor.fetchone()
+    return resultado[0] if resultado else None
+
+
 async def validar_token(authorization: str = Header(...)):
     """
     Verifica se o Token existe E se a loja está ativa.
@@ -11,22 +77,47 @@ async def validar_token(authorization: str = Header(...)):
         raise HTTPException(401, "Formato do token inválido (Use Bearer <token>)")
     
     token = authorization.replace("Bearer ", "")
+    chave = hash_token(token)
+
+    agora = time.monotonic()
+    with _lock:
+        entrada = _tokens.get(chave)
+        if entrada and agora - entrada[0] < TOKEN_CACHE_TTL:
+            _tokens.move_to_end(chave)
+            return entrada[1]
+        geracao = _geracao
+
+    # Consulta bloqueante fora do event loop
+    schema = await run_in_threadpool(_buscar_schema, token)
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # CORREÇÃO: Adicionado "AND ativo = TRUE" na consulta
-    cursor.execute("""
-        SELECT schema_name 
-        FROM lojas_sincronizadas 
-        WHERE api_token = %s AND ativo = TRUE
-    """, (token,))
-    
-    resultado = cursor.fetchone()
-    conn.close()
-    
-    if not resultado:
+    if not schema:
+        _descartar(chave)
         # Agora essa mensagem serve tanto para token errado quanto para loja inativa
         raise HTTPException(status_code=401, detail="Acesso negado: Token inválido ou Loja inativa")
+
+    with _lock:
+        if geracao != _geracao: return schema
+        _tokens[chave] = (agora, schema)
+        _tokens.move_to_end(chave)
+        while len(_tokens) > TOKEN_CACHE_MAX:
+            _tokens.popitem(last=False)
     
-    return resultado[0]
\ No newline at end of file
+    return schema
+
+
+# --- VÁRIAS LOJAS (RELATÓRIOS CONSOLIDADOS) ---
+CONSOLIDADO_MAX_LOJAS = int(os.getenv("CONSOLIDADO_MAX_LOJAS", "20"))
+
+
+async def validar_tokens(x_lojas: str = Header(..., alias="x-lojas")):
+    """
+    Tokens das lojas do consolidado, separados por vírgula (a web os tem
+    pelos vínculos do usuário em usuarios_lojas). Cada um passa pela mesma
+    validação de validar_token; um inválido ou inativo nega tudo. Devolve
+    os schemas na ordem dos tokens (repetidos são ignorados).
+    """
+    tokens = list(dict.fromkeys(t.strip() for t in x_lojas.split(",") if t.strip()))
+    if not tokens or len(tokens) > CONSOLIDADO_MAX_LOJAS:
+        raise HTTPException(status_code=400, detail=f"Informe de 1 a {CONSOLIDADO_MAX_LOJAS} lojas")
+    schemas = await asyncio.gather(*(validar_token(f"Bearer {t}") for t in tokens))
+    return list(schemas)
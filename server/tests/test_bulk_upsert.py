@@ -0,0 +1,71 @@
+"""
+Lote com linhas heterogêneas: cada linha só atualiza as colunas que trouxe.
+
+Uso (a partir de server/, sem banco):
+    python -m pytest -q tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bulk_upsert
+
+
+class CursorFalso:
+    """ Guarda os comandos; cada merge devolve (linhas do COPY, 0). """
+
+    def __init__(self):
+        self.comandos = []
+        self.copiadas = 0
+
+    def execute(self, sql, params=None):
+        self.comandos.append(sql)
+
+    def copy_expert(self, sql, buffer):
+        self.comandos.append(sql)
+        self.copiadas = len(buffer.getvalue().splitlines())
+
+    def fetchone(self):
+        return self.copiadas, 0
+
+
+def _merges(cursor):
+    return [c for c in cursor.comandos if "ON CONFLICT" in c]
+
+
+def test_grupos_por_conjunto_de_colunas():
+    linhas = [
+        {"id_original": "1", "nome": "A", "preco_venda": "10"},
+        {"id_original": "2", "nome": "B"},
+        {"id_original": "3", "preco_venda": "5", "nome": "C"},
+    ]
+    grupos = bulk_upsert.grupos_do_lote(linhas)
+    assert [(cols, [l["id_original"] for l in ls]) for cols, ls in grupos] == [
+        (["id_original", "nome", "preco_venda"], ["1", "3"]),
+        (["id_original", "nome"], ["2"]),
+    ]
+
+
+def test_coluna_ausente_nao_entra_no_update(monkeypatch):
+    monkeypatch.setattr(bulk_upsert.schema_cache, "obter_tabela", lambda cursor, schema, tabela: None)
+    monkeypatch.setattr(bulk_upsert, "SYNC_BULK_MODO", "copy")
+    cursor = CursorFalso()
+
+    resultado = bulk_upsert.aplicar_lote(cursor, "loja", "produto", [
+        {"id_original": "1", "nome": "A", "preco_venda": "10"},
+        {"id_original": "2", "nome": "B"},
+    ])
+
+    completo, parcial = _merges(cursor)
+    assert "preco_venda = EXCLUDED.preco_venda" in completo
+    assert "preco_venda" not in parcial
+    assert "nome = EXCLUDED.nome" in parcial
+    assert resultado == {"inseridos": 2, "atualizados": 0, "ignorados": 0}
+
+
+def test_lote_homogeneo_um_merge(monkeypatch):
+    monkeypatch.setattr(bulk_upsert.schema_cache, "obter_tabela", lambda cursor, schema, tabela: None)
+    cursor = CursorFalso()
+    bulk_upsert.aplicar_lote(cursor, "loja", "produto", [{"id_original": str(i), "nome": "X"} for i in range(10)])
+    assert len(_merges(cursor)) == 1
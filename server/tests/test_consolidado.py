@@ -0,0 +1,117 @@
+"""
+Consolidado de várias lojas: soma dos cards, junção dos rankings, loja com
+falha e 304 sem calcular nenhuma loja.
+
+Uso (a partir de server/, sem banco):
+    python -m pytest -q tests
+"""
+import os
+import sys
+from contextlib import contextmanager
+from datetime import date
+
+import pytest
+from fastapi import Response
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from routers import consolidado, reports
+
+INICIO, FIM = date(2026, 3, 1), date(2026, 3, 31)
+
+
+def _cards(fat, qtd, maior, menor, itens_pv, cmv):
+    return reports.metricas_cards(fat, qtd, maior, menor, itens_pv * qtd, cmv)
+
+
+class RequisicaoFalsa:
+    def __init__(self, if_none_match=""):
+        self.headers = {"if-none-match": if_none_match} if if_none_match else {}
+
+
+class ConexaoFalsa:
+    def cursor(self):
+        return None
+
+    def rollback(self):
+        pass
+
+
+@contextmanager
+def _conexao():
+    yield ConexaoFalsa()
+
+
+@pytest.fixture
+def lojas(monkeypatch):
+    """ Duas lojas com versão; 'quebrada' falha no cálculo. Devolve as lojas calculadas. """
+    calculadas = []
+    cards = {"a": _cards(1000, 10, 300, 20, 2, 600), "b": _cards(500, 40, 50, 5, 1, 200)}
+
+    def calcular_cards(cursor, schema, data_inicio, data_fim):
+        calculadas.append(schema)
+        if schema == "quebrada": raise RuntimeError("sem conexão")
+        return cards[schema]
+
+    monkeypatch.setattr(consolidado, "conexao", _conexao)
+    monkeypatch.setattr(consolidado, "_versoes", lambda schemas, data_inicio, data_fim: [f"1.{s}" for s in schemas])
+    monkeypatch.setattr(reports, "em_cache", lambda schema, chave, versao, calcular: calcular())
+    monkeypatch.setattr(reports, "calcular_cards", calcular_cards)
+    return calculadas
+
+
+def test_somar_cards_totais_e_ticket_ponderado():
+    soma = consolidado.somar_cards([_cards(1000, 10, 300, 20, 2, 600), _cards(500, 40, 50, 5, 1, 200), None])
+    assert soma["faturamento"] == 1500
+    assert soma["qtde_vendas"] == 50
+    assert soma["cmv"] == 800
+    # Ticket e itens do total, não a média dos tickets (100 e 12,5)
+    assert soma["ticket_medio"] == pytest.approx(30)
+    assert soma["itens_por_venda"] == pytest.approx(60 / 50)
+    assert soma["maior_venda"] == 300
+    assert soma["menor_venda"] == 5
+    assert soma["lucro_bruto_percent"] == pytest.approx(700 / 1500 * 100)
+
+
+def test_somar_cards_loja_sem_vendas_nao_zera_menor_venda():
+    soma = consolidado.somar_cards([_cards(0, 0, 0, 0, 0, 0), _cards(500, 40, 50, 5, 1, 200)])
+    assert soma["menor_venda"] == 5
+
+
+def test_juntar_rankings_soma_por_nome_e_refaz_corte():
+    loja_a = [{"nome": "Arroz", "total": 100.0, "qtd": 10}, {"nome": "Feijão", "total": 90.0, "qtd": 9},
+              {"nome": "Café", "total": 60.0, "qtd": 3}]
+    loja_b = [{"nome": "Café", "total": 80.0, "qtd": 4}, {"nome": "Feijão", "total": 5.0, "qtd": 1}]
+    top = consolidado.juntar_rankings("produto", [loja_a, loja_b, None], 2)
+    assert top == [{"nome": "Café", "total": 140.0, "qtd": 7.0}, {"nome": "Arroz", "total": 100.0, "qtd": 10.0}]
+
+
+def test_juntar_rankings_hora_e_dia_em_ordem_cronologica():
+    horas = consolidado.juntar_rankings("hora", [[{"nome": "10h", "total": 1, "qtd": 1}],
+                                                 [{"nome": "9h", "total": 5, "qtd": 1}]], 1)
+    assert [i["nome"] for i in horas] == ["9h", "10h"]
+    dias = consolidado.juntar_rankings("dia", [[{"nome": "02/03/2026", "total": 1, "qtd": 1},
+                                                {"nome": "28/02/2026", "total": 1, "qtd": 1}]], 1)
+    assert [i["nome"] for i in dias] == ["28/02/2026", "02/03/2026"]
+
+
+def test_loja_com_falha_resposta_parcial(lojas):
+    response = Response()
+    corpo = consolidado.get_cards_consolidado(INICIO, FIM, RequisicaoFalsa(), response, schemas=["a", "quebrada", "b"])
+    assert corpo["lojas"][1] is None
+    assert corpo["consolidado"]["faturamento"] == 1500
+    # Parcial: sem ETag, para o cliente não revalidar um resultado incompleto
+    assert "etag" not in response.headers
+    assert "no-store" in response.headers["cache-control"]
+
+
+def test_304_nao_calcula_nenhuma_loja(lojas):
+    response = Response()
+    consolidado.get_cards_consolidado(INICIO, FIM, RequisicaoFalsa(), response, schemas=["a", "b"])
+    tag = response.headers["etag"]
+    assert lojas == ["a", "b"]
+
+    lojas.clear()
+    resposta = consolidado.get_cards_consolidado(INICIO, FIM, RequisicaoFalsa(tag), Response(), schemas=["a", "b"])
+    assert resposta.status_code == 304
+    assert lojas == []
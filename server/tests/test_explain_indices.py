@@ -0,0 +1,43 @@
+"""
+Regressão de planos: cards e rankings pelas tabelas brutas leem saida,
+saida_produto e saida_formapag por índice no período (ver
+benchmarks/explain_indices.py, que roda o mesmo com mais volume).
+
+Precisa de um Postgres descartável nas variáveis DB_* (cria e apaga o schema
+'bench_indices'); sem elas o teste é pulado.
+
+Uso (a partir de server/):
+    DB_HOST=localhost DB_PASS=... python -m pytest -q tests
+"""
+import os
+import sys
+
+import psycopg2
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if not any(os.getenv(v) for v in ("DB_HOST", "DB_NAME", "DB_USER", "DB_PASS")):
+    pytest.skip("sem banco configurado nas variáveis DB_*", allow_module_level=True)
+
+import database_utils
+from benchmarks import explain_indices
+
+VENDAS = int(os.getenv("EXPLAIN_VENDAS", "100000"))
+
+
+@pytest.fixture(scope="module")
+def conn():
+    try:
+        conn = psycopg2.connect(database_utils.DB_DSN, connect_timeout=5)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"banco das variáveis DB_* inacessível: {e}")
+    yield conn
+    conn.close()
+
+
+def test_relatorios_sem_seq_scan(conn):
+    verificadas, falhas = explain_indices.verificar_planos(conn, VENDAS, 730)
+    assert verificadas
+    assert not falhas, "\n".join(
+        f"[{nome}] Seq Scan em {', '.join(seq)}: {' '.join(sql.split())[:300]}" for nome, sql, _, seq in falhas)
@@ -0,0 +1,115 @@
+"""
+Leitura dos lotes em streaming: corte das linhas NDJSON entre pedaços do
+corpo e teto da descompressão.
+
+Uso (a partir de server/, sem banco):
+    python -m pytest -q tests
+"""
+import asyncio
+import gzip
+import json
+import os
+import sys
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest_stream
+
+
+class RequisicaoFalsa:
+    """ Corpo entregue nos pedaços dados, como o request.stream() do Starlette. """
+
+    def __init__(self, pedacos, encoding=""):
+        self.headers = {"content-encoding": encoding}
+        self._pedacos = pedacos
+
+    async def stream(self):
+        for pedaco in self._pedacos:
+            yield pedaco
+
+
+def _fatiar(dados: bytes, tamanho: int):
+    return [dados[i:i + tamanho] for i in range(0, len(dados), tamanho)]
+
+
+def _blocos(requisicao, tamanho=1000):
+    async def coletar():
+        return [bloco async for bloco in ingest_stream.iterar_blocos(requisicao, tamanho)]
+    return asyncio.run(coletar())
+
+
+def _ndjson(qtd):
+    return b"\n".join(json.dumps({"id_original": str(i), "nome": "x" * (i % 7)}).encode() for i in range(qtd))
+
+
+def test_linhas_cortadas_entre_pedacos():
+    corpo = _ndjson(50)
+    blocos = _blocos(RequisicaoFalsa(_fatiar(corpo, 7)), tamanho=20)
+    assert [len(b) for b in blocos] == [20, 20, 10]
+    assert [json.loads(l)["id_original"] for b in blocos for l in b] == [str(i) for i in range(50)]
+
+
+def test_linha_longa_em_muitos_pedacos():
+    longa = json.dumps({"id_original": "1", "obs": "y" * 100000}).encode()
+    blocos = _blocos(RequisicaoFalsa(_fatiar(longa + b"\n\n" + longa, 100)))
+    assert blocos == [[longa, longa]]
+
+
+def test_gzip_em_pedacos():
+    corpo = _ndjson(3000)
+    blocos = _blocos(RequisicaoFalsa(_fatiar(gzip.compress(corpo), 1000), "gzip"))
+    assert sum(len(b) for b in blocos) == 3000
+
+
+def test_teto_gzip(monkeypatch):
+    monkeypatch.setattr(ingest_stream, "SYNC_MAX_DESCOMPRIMIDO", 100000)
+    bomba = gzip.compress(b"0" * 10_000_000)
+    with pytest.raises(HTTPException) as erro:
+        _blocos(RequisicaoFalsa([bomba], "gzip"))
+    assert erro.value.status_code == 413
+    with pytest.raises(HTTPException):
+        ingest_stream.decodificar_corpo(bomba, "application/json", "gzip")
+
+
+def test_teto_sem_compressao(monkeypatch):
+    monkeypatch.setattr(ingest_stream, "SYNC_MAX_DESCOMPRIMIDO", 1000)
+    with pytest.raises(HTTPException) as erro:
+        _blocos(RequisicaoFalsa(_fatiar(_ndjson(200), 100)))
+    assert erro.value.status_code == 413
+
+
+def test_teto_zstd(monkeypatch):
+    zstandard = pytest.importorskip("zstandard")
+    monkeypatch.setattr(ingest_stream, "SYNC_MAX_DESCOMPRIMIDO", 1_000_000)
+    bomba = zstandard.ZstdCompressor().compress(b"0" * 50_000_000)
+    lidos = []
+    ler_zstd = ingest_stream._ler_zstd
+
+    def registrar(descompressor, arquivo):
+        for parte in ler_zstd(descompressor, arquivo):
+            lidos.append(len(parte))
+            yield parte
+
+    monkeypatch.setattr(ingest_stream, "_ler_zstd", registrar)
+    with pytest.raises(HTTPException) as erro:
+        _blocos(RequisicaoFalsa([bomba], "zstd"))
+    assert erro.value.status_code == 413
+    # Saída lida em pedaços fixos: o teto barra a bomba logo depois de 1 MB
+    assert max(lidos) <= ingest_stream._SAIDA
+    assert sum(lidos) <= ingest_stream.SYNC_MAX_DESCOMPRIMIDO + ingest_stream._SAIDA
+
+
+def test_zstd_varios_frames():
+    zstandard = pytest.importorskip("zstandard")
+    compressor = zstandard.ZstdCompressor()
+    corpo = compressor.compress(_ndjson(10) + b"\n") + compressor.compress(_ndjson(5))
+    assert len(ingest_stream.decodificar_corpo(corpo, "application/x-ndjson", "zstd")) == 15
+
+
+def test_encoding_desconhecido():
+    with pytest.raises(HTTPException) as erro:
+        ingest_stream.conferir_encoding(RequisicaoFalsa([], "br"))
+    assert erro.value.status_code == 415
@@ -0,0 +1,50 @@
+"""
+Período de comparação dos relatórios: padrão de mesma duração logo antes do
+atual, período informado e validação.
+
+Uso (a partir de server/, sem banco):
+    python -m pytest -q tests
+"""
+import os
+import sys
+from datetime import date
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from routers import reports
+
+
+def test_padrao_mesma_duracao_imediatamente_antes():
+    assert reports.periodo_anterior(date(2026, 3, 10), date(2026, 3, 16)) == (date(2026, 3, 3), date(2026, 3, 9))
+
+
+def test_padrao_um_dia():
+    assert reports.periodo_anterior(date(2026, 3, 1), date(2026, 3, 1)) == (date(2026, 2, 28), date(2026, 2, 28))
+
+
+def test_padrao_atravessa_ano():
+    assert reports.periodo_anterior(date(2026, 1, 1), date(2026, 1, 31)) == (date(2025, 12, 1), date(2025, 12, 31))
+
+
+def test_periodo_informado():
+    anterior = reports.periodo_anterior(date(2026, 3, 1), date(2026, 3, 31), date(2025, 3, 1), date(2025, 3, 31))
+    assert anterior == (date(2025, 3, 1), date(2025, 3, 31))
+
+
+def test_so_um_limite_informado_usa_o_padrao():
+    assert reports.periodo_anterior(date(2026, 3, 10), date(2026, 3, 16), date(2025, 1, 1)) == (date(2026, 3, 3), date(2026, 3, 9))
+
+
+@pytest.mark.parametrize("args", [
+    (date(2026, 3, 16), date(2026, 3, 10)),                                      # atual invertido
+    (date(2026, 3, 1), date(2026, 3, 31), date(2025, 3, 31), date(2025, 3, 1)),  # anterior invertido
+    (date(2026, 3, 1), date(2026, 3, 31), date(2026, 2, 15), date(2026, 3, 1)),  # encosta no atual
+    (date(2026, 3, 1), date(2026, 3, 31), date(2026, 3, 5), date(2026, 3, 20)),  # dentro do atual
+])
+def test_periodo_invalido(args):
+    with pytest.raises(HTTPException) as erro:
+        reports.periodo_anterior(*args)
+    assert erro.value.status_code == 400
@@ -0,0 +1,65 @@
+"""
+Reconciliação por digestos: o que desce um nível, o que o agente reenvia e o
+que sobra na nuvem; validação da requisição.
+
+Uso (a partir de server/, sem banco):
+    python -m pytest -q tests
+"""
+import os
+import sys
+from datetime import date
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import reconciliacao
+
+
+def test_digestos_iguais():
+    digestos = {"2026-01": [10, 12345, "abc"], "2026-02": [3, 500, "def"]}
+    remotos = {k: list(v) for k, v in digestos.items()}
+    assert reconciliacao.comparar(digestos, remotos) == {"divergentes": [], "ausentes": [], "sobrando": []}
+
+
+def test_divergentes_ausentes_e_sobrando():
+    locais = {
+        "2026-03-02": [5, 1000, "aaa"],   # igual
+        "2026-03-01": [5, 1000, "bbb"],   # md5 diferente
+        "2026-03-03": [4, 1000, "ccc"],   # quantidade diferente
+        "2026-03-05": [1, 10, "ddd"],     # só no agente
+    }
+    remotos = {
+        "2026-03-02": [5, 1000, "aaa"],
+        "2026-03-01": [5, 1000, "xxx"],
+        "2026-03-03": [5, 1000, "ccc"],
+        "2026-03-04": [2, 20, "eee"],     # só na nuvem
+    }
+    assert reconciliacao.comparar(locais, remotos) == {
+        "divergentes": ["2026-03-01", "2026-03-03"],
+        "ausentes": ["2026-03-05"],
+        "sobrando": ["2026-03-04"],
+    }
+
+
+def test_digesto_do_agente_em_tupla():
+    # JSON chega como lista, mas o digesto local pode ser tupla
+    assert reconciliacao.comparar({"1": (1, 100, "a")}, {"1": [1, 100, "a"]})["divergentes"] == []
+
+
+def test_validar():
+    reconciliacao.validar("dia", date(2026, 1, 1), date(2026, 1, 31), {})
+    with pytest.raises(HTTPException) as erro:
+        reconciliacao.validar("ano", date(2026, 1, 1), date(2026, 1, 31), {})
+    assert erro.value.status_code == 400
+    with pytest.raises(HTTPException) as erro:
+        reconciliacao.validar("mes", date(2026, 1, 31), date(2026, 1, 1), {})
+    assert erro.value.status_code == 400
+    with pytest.raises(HTTPException) as erro:
+        reconciliacao.validar("mes", date(2024, 1, 1), date(2026, 1, 1), {})
+    assert erro.value.status_code == 400
+    with pytest.raises(HTTPException) as erro:
+        reconciliacao.validar("venda", date(2026, 1, 1), date(2026, 1, 1),
+                              {str(i): [1, 1, "x"] for i in range(reconciliacao.RECONCILIAR_MAX_CHAVES + 1)})
+    assert erro.value.status_code == 413
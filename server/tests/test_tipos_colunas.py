@@ -0,0 +1,93 @@
+"""
+Camada de tipos: normalização dos valores das colunas tipadas, separação dos
+registros malformados e expressões dos relatórios (coluna nativa ou TEXT).
+
+Uso (a partir de server/, sem banco):
+    python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tipos_colunas
+from tipos_colunas import ValorInvalido
+
+META_TIPADA = {"colunas": {"id_original": "character varying", "total": "numeric",
+                           "data": "timestamp without time zone", "hora": "time without time zone"}}
+META_TEXTO = {"colunas": {"id_original": "character varying", "total": "text", "data": "text", "hora": "text"}}
+
+
+def test_familia_tipo():
+    assert tipos_colunas.familia_tipo("numeric(15,2)") == "numeric"
+    assert tipos_colunas.familia_tipo("bigint") == "numeric"
+    assert tipos_colunas.familia_tipo("timestamp without time zone") == "timestamp"
+    assert tipos_colunas.familia_tipo("date") == "date"
+    assert tipos_colunas.familia_tipo("time without time zone") == "time"
+    assert tipos_colunas.familia_tipo("text") is None
+    assert tipos_colunas.familia_tipo(None) is None
+
+
+def test_converter_normaliza():
+    assert tipos_colunas._converter("numeric", "10,50") == "10.50"
+    assert tipos_colunas._converter("numeric", " 3 ") == "3"
+    assert tipos_colunas._converter("numeric", "") is None
+    assert tipos_colunas._converter("numeric", None) is None
+    assert tipos_colunas._converter("timestamp", "2026-01-02T10:20:30") == "2026-01-02T10:20:30"
+    assert tipos_colunas._converter("date", "2026-01-02T10:20:30") == "2026-01-02"
+    assert tipos_colunas._converter("time", "10:20") == "10:20:00"
+
+
+@pytest.mark.parametrize("familia, valor", [
+    ("numeric", "abc"),
+    ("numeric", "NaN"),
+    ("numeric", "Infinity"),
+    ("numeric", True),
+    ("timestamp", "02/01/2026"),
+    ("time", "25:00"),
+])
+def test_converter_rejeita(familia, valor):
+    with pytest.raises(ValorInvalido):
+        tipos_colunas._converter(familia, valor)
+
+
+def test_validar_registro_indica_coluna():
+    tipadas = tipos_colunas.colunas_tipadas(META_TIPADA)
+    assert tipadas == {"total": "numeric", "data": "timestamp", "hora": "time"}
+    with pytest.raises(ValorInvalido, match="^total: "):
+        tipos_colunas.validar_registro(tipadas, {"id_original": "1", "total": "x"})
+
+
+def test_validar_registro_nao_altera_original():
+    tipadas = tipos_colunas.colunas_tipadas(META_TIPADA)
+    item = {"id_original": "1", "total": "1,5", "obs": "livre"}
+    assert tipos_colunas.validar_registro(tipadas, item) == {"id_original": "1", "total": "1.5", "obs": "livre"}
+    assert item["total"] == "1,5"
+
+
+def test_separar_validos():
+    dados = [
+        {"id_original": "1", "total": "10", "data": "2026-01-02"},
+        {"id_original": "2", "total": "dez"},
+        {"id_original": "3", "hora": "99:99"},
+    ]
+    validos, rejeitados = tipos_colunas.separar_validos(META_TIPADA, dados)
+    assert validos == [{"id_original": "1", "total": "10", "data": "2026-01-02T00:00:00"}]
+    assert [(id_original, motivo.split(":")[0]) for id_original, _, motivo in rejeitados] == [("2", "total"), ("3", "hora")]
+
+
+def test_separar_validos_tabela_texto():
+    dados = [{"id_original": "1", "total": "dez"}]
+    assert tipos_colunas.separar_validos(META_TEXTO, dados) == (dados, [])
+    assert tipos_colunas.separar_validos(None, dados) == (dados, [])
+
+
+def test_expressoes_coluna_nativa_e_texto():
+    assert tipos_colunas.expr_numerica(META_TIPADA, "s", "total") == "s.total"
+    assert tipos_colunas.expr_numerica(META_TEXTO, "s", "total") == "NULLIF(s.total, '')::numeric"
+    assert tipos_colunas.expr_data(META_TIPADA, "s") == 's."data"'
+    assert tipos_colunas.expr_data(META_TEXTO, "s") == "NULLIF(s.\"data\", '')::timestamp"
+    assert tipos_colunas.expr_hora(META_TIPADA, "s") == "s.hora"
+    assert tipos_colunas.expr_hora(None, "") == "NULLIF(hora, '')::time"
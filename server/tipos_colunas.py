@@ -0,0 +1,176 @@
+from datetime import date, datetime, time
+from decimal import Decimal, InvalidOperation
+from typing import List
+
+from psycopg2.extras import Json
+
+import schema_cache
+
+# Arquivo: server/tipos_colunas.py
+# Camada de tipos das tabelas de tenant. O agente manda tudo como texto; as
+# colunas abaixo são gravadas com tipo nativo (numeric/timestamp/time) para
+# que os relatórios agreguem sem NULLIF(x, '')::numeric em cada linha.
+#
+# - Colunas novas criadas pelo upsert usam o tipo do mapa (o resto é TEXT).
+# - Valores das colunas tipadas são validados antes do COPY: o registro com
+#   valor malformado vai para {schema}.rejeitados_ingestao e o lote segue.
+# - Tenants antigos (colunas TEXT) são convertidos por migrar_tipos.py.
+
+TIPOS_COLUNAS = {
+    "saida": {"total": "NUMERIC", "data": "TIMESTAMP", "hora": "TIME"},
+    "saida_produto": {"quant": "NUMERIC", "total": "NUMERIC"},
+    "saida_formapag": {"valor": "NUMERIC"},
+    "produto": {"preco_venda": "NUMERIC", "custo_total": "NUMERIC"},
+    "vendedor": {"comissao": "NUMERIC"},
+}
+
+
+class ValorInvalido(ValueError):
+    pass
+
+
+def tipo_coluna(tabela: str, coluna: str) -> str:
+    """ Tipo usado ao criar a coluna no tenant. """
+    return TIPOS_COLUNAS.get(tabela, {}).get(coluna, "TEXT")
+
+
+def familia_tipo(tipo_banco: str):
+    """ 'numeric', 'timestamp', 'date', 'time' ou None (texto e afins). """
+    tipo_banco = (tipo_banco or "").lower()
+    if tipo_banco.startswith(("numeric", "integer", "bigint", "smallint", "double", "real")): return "numeric"
+    if tipo_banco.startswith("timestamp"): return "timestamp"
+    if tipo_banco == "date": return "date"
+    if tipo_banco.startswith("time"): return "time"
+    return None
+
+
+def _converter(familia: str, valor):
+    """ Normaliza o valor para o texto que o Postgres aceita no COPY. """
+    if valor is None: return None
+    if isinstance(valor, bool): raise ValorInvalido(f"booleano em coluna {familia}")
+    texto = str(valor).strip()
+    if texto == "": return None
+
+    try:
+        if familia == "numeric":
+            numero = Decimal(texto.replace(",", "."))
+            if not numero.is_finite(): raise ValorInvalido(texto)
+            return str(numero)
+        if familia == "timestamp":
+            return datetime.fromisoformat(texto).isoformat()
+        if familia == "date":
+            return date.fromisoformat(texto[:10]).isoformat()
+        if familia == "time":
+            return time.fromisoformat(texto).isoformat()
+    except (InvalidOperation, ValueError):
+        raise ValorInvalido(texto)
+    return texto
+
+
+def colunas_tipadas(meta) -> dict:
+    """ coluna -> família, só para as colunas com tipo nativo no banco. """
+    if not meta: return {}
+    tipadas = {}
+    for coluna, tipo in meta["colunas"].items():
+        familia = familia_tipo(tipo)
+        if familia: tipadas[coluna] = familia
+    return tipadas
+
+
+def validar_registro(tipadas: dict, item: dict):
+    """
+    Devolve uma cópia do registro com os valores tipados normalizados.
+    Levanta ValorInvalido (com a coluna) no primeiro valor malformado.
+    """
+    novo = dict(item)
+    for coluna, familia in tipadas.items():
+        if coluna not in novo or coluna == 'id_original': continue
+        try:
+            novo[coluna] = _converter(familia, novo[coluna])
+        except ValorInvalido as e:
+            raise ValorInvalido(f"{coluna}: valor '{e}' inválido para {familia}") from None
+    return novo
+
+
+def separar_validos(meta, dados: List[dict]):
+    """ (válidos normalizados, [(id_original, registro, motivo)]) """
+    tipadas = colunas_tipadas(meta)
+    if not tipadas: return dados, []
+
+    validos, rejeitados = [], []
+    for item in dados:
+        try:
+            validos.append(validar_registro(tipadas, item))
+        except ValorInvalido as e:
+            rejeitados.append((item.get("id_original"), item, str(e)))
+    return validos, rejeitados
+
+
+# --- REJEITADOS ---
+def sql_tabela_rejeitados(schema: str) -> str:
+    return f"""
+    CREATE TABLE IF NOT EXISTS {schema}.rejeitados_ingestao (
+        id BIGSERIAL PRIMARY KEY,
+        tabela VARCHAR(50) NOT NULL,
+        id_original VARCHAR(50),
+        motivo TEXT,
+        registro JSONB,
+        criado_em TIMESTAMP DEFAULT NOW()
+    );
+    CREATE INDEX IF NOT EXISTS idx_rejeitados_tabela ON {schema}.rejeitados_ingestao (tabela, id_original);
+    """
+
+
+def gravar_rejeitados(cursor, schema: str, tabela: str, rejeitados):
+    """
+    rejeitados: [(id_original, registro, motivo)]. Grava na transação do
+    lote: se o lote falhar, os rejeitados somem junto.
+    """
+    if not rejeitados: return 0
+    cursor.execute(sql_tabela_rejeitados(schema))
+    for id_original, registro, motivo in rejeitados:
+        cursor.execute(f"""
+            INSERT INTO {schema}.rejeitados_ingestao (tabela, id_original, motivo, registro)
+            VALUES (%s, %s, %s, %s)
+        """, (tabela, None if id_original is None else str(id_original), motivo, Json(registro)))
+    return len(rejeitados)
+
+
+# --- EXPRESSÕES PARA RELATÓRIOS ---
+def expr_numerica(meta, alias: str, coluna: str) -> str:
+    """ alias.coluna como numeric: direto se a coluna já é numérica. """
+    ref = f"{alias}.{coluna}" if alias else coluna
+    if meta and familia_tipo(meta["colunas"].get(coluna)) == "numeric": return ref
+    return f"NULLIF({ref}, '')::numeric"
+
+
+def expr_hora(meta, alias: str, coluna: str = "hora") -> str:
+    ref = f"{alias}.{coluna}" if alias else coluna
+    if meta and familia_tipo(meta["colunas"].get(coluna)) == "time": return ref
+    return f"NULLIF({ref}, '')::time"
+
+
+def expr_data(meta, alias: str, coluna: str = "data") -> str:
+    """ alias.coluna como timestamp: direto (usa o índice) se já é TIMESTAMP/DATE. """
+    ref = f'{alias}."{coluna}"' if alias else f'"{coluna}"'
+    if meta and familia_tipo(meta["colunas"].get(coluna)) in ("timestamp", "date"): return ref
+    return f"NULLIF({ref}, '')::timestamp"
+
+
+def expressoes_tipadas(cursor, schema):
+    """
+    Expressões de valor conforme o tipo real das colunas no tenant: direto
+    nas colunas já numéricas/TIME, NULLIF(x, '')::numeric nas ainda TEXT.
+    """
+    m = {t: schema_cache.obter_tabela(cursor, schema, t) for t in ('saida', 'saida_produto', 'saida_formapag', 'produto')}
+    return {
+        "total": expr_numerica(m['saida'], None, 'total'),
+        "s_total": expr_numerica(m['saida'], 's', 'total'),
+        "s_hora": expr_hora(m['saida'], 's'),
+        "data": expr_data(m['saida'], None),
+        "s_data": expr_data(m['saida'], 's'),
+        "sp_total": expr_numerica(m['saida_produto'], 'sp', 'total'),
+        "sp_quant": expr_numerica(m['saida_produto'], 'sp', 'quant'),
+        "sf_valor": expr_numerica(m['saida_formapag'], 'sf', 'valor'),
+        "p_custo": expr_numerica(m['produto'], 'p', 'custo_total'),
+    }
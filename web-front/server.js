@@ -93,6 +93,57 @@ function filtroDataExe(periodo, data_inicio, data_fim) {
     return { data_inicio: dIni, data_fim: dFim };
 }
 
+// --- RELATÓRIOS DA API COM REVALIDAÇÃO (ETag / If-None-Match) ---
+// Guarda o último corpo de cada URL+loja com o ETag recebido. Na próxima
+// chamada a API responde 304 (sem rodar o relatório) se não chegou venda
+// nova no período, e reaproveitamos o corpo guardado.
+const MAX_RELATORIOS_GUARDADOS = 500;
+const relatoriosGuardados = new Map(); // token|url -> { etag, dados }
+
+// apiToken pode ser a lista de tokens das lojas (relatórios consolidados).
+async function buscarRelatorio(url, apiToken) {
+    const chave = `${apiToken}|${url}`;
+    const guardado = relatoriosGuardados.get(chave);
+    const headers = Array.isArray(apiToken)
+        ? { 'X-Lojas': apiToken.join(',') }
+        : { 'Authorization': `Bearer ${apiToken}` };
+    if (guardado) headers['If-None-Match'] = guardado.etag;
+
+    const resposta = await axios.get(url, {
+        headers,
+        validateStatus: (status) => (status >= 200 && status < 300) || status === 304
+    });
+
+    if (resposta.status === 304 && guardado) {
+        // Renova a posição na ordem de descarte (mais antigo sai primeiro)
+        relatoriosGuardados.delete(chave);
+        relatoriosGuardados.set(chave, guardado);
+        return guardado.dados;
+    }
+
+    relatoriosGuardados.delete(chave);
+    const etag = resposta.headers['etag'];
+    if (etag) {
+        relatoriosGuardados.set(chave, { etag, dados: resposta.data });
+        if (relatoriosGuardados.size > MAX_RELATORIOS_GUARDADOS) {
+            relatoriosGuardados.delete(relatoriosGuardados.keys().next().value);
+        }
+    }
+    return resposta.data;
+}
+
+// Tokens de todas as lojas ativas do usuário (opção "Todas as lojas")
+async function tokensDoUsuario(usuarioId) {
+    const result = await pool.query(`
+        SELECT l.api_token
+        FROM lojas_sincronizadas l
+        JOIN usuarios_lojas ul ON l.id = ul.loja_id
+        WHERE ul.usuario_id = $1 AND l.ativo = TRUE
+        ORDER BY l.id ASC
+    `, [usuarioId]);
+    return result.rows.map(r => r.api_token);
+}
+
 // ==================================================================
 // 3. ROTAS DE AUTENTICAÇÃO
 // ==================================================================
@@ -212,17 +263,26 @@ app.get('/painel', authGuard, async (req, res) => {
             ORDER BY l.nome_fantasia ASC
         `, [req.session.usuario.id]);
 
-        const lojaRes = await pool.query("SELECT api_token, nome_fantasia, ativo FROM lojas_sincronizadas WHERE id = $1", [lojaId]);
-        if (lojaRes.rows.length === 0 || !lojaRes.rows[0].ativo) return res.redirect('/');
-
-        const { api_token, nome_fantasia: nomeLoja } = lojaRes.rows[0];
         const filtroData = filtroDataExe(periodo, data_inicio, data_fim);
-        
-        const urlApi = `${API_PYTHON_URL}/reports/dashboard-cards?data_inicio=${filtroData.data_inicio}&data_fim=${filtroData.data_fim}`;
-        const respostaApi = await axios.get(urlApi, { headers: { 'Authorization': `Bearer ${api_token}` } });
+        const periodoApi = `data_inicio=${filtroData.data_inicio}&data_fim=${filtroData.data_fim}`;
+        let dados, nomeLoja;
+
+        if (lojaId === 'todas') {
+            // Consolidado: a API calcula as lojas em paralelo e soma
+            const tokens = await tokensDoUsuario(req.session.usuario.id);
+            if (tokens.length === 0) return res.redirect('/');
+            nomeLoja = 'Todas as lojas';
+            dados = (await buscarRelatorio(`${API_PYTHON_URL}/reports/consolidado/dashboard-cards?${periodoApi}`, tokens)).consolidado;
+        } else {
+            const lojaRes = await pool.query("SELECT api_token, nome_fantasia, ativo FROM lojas_sincronizadas WHERE id = $1", [lojaId]);
+            if (lojaRes.rows.length === 0 || !lojaRes.rows[0].ativo) return res.redirect('/');
+
+            nomeLoja = lojaRes.rows[0].nome_fantasia;
+            dados = await buscarRelatorio(`${API_PYTHON_URL}/reports/dashboard-cards?${periodoApi}`, lojaRes.rows[0].api_token);
+        }
 
         res.render('relatorio', {
-            modo: 'painel', dados: respostaApi.data,
+            modo: 'painel', dados,
             lojaId, nomeLoja, periodo, dIni: filtroData.data_inicio, dFim: filtroData.data_fim, 
             todasLojas: todasLojas.rows, usuario: req.session.usuario
         });
@@ -249,7 +309,7 @@ app.get('/relatorios/:tipo', authGuard, async (req, res) => {
 
     try {
         const [lojaRes, todasLojas] = await Promise.all([
-            pool.query("SELECT id, api_token, nome_fantasia, ativo FROM lojas_sincronizadas WHERE id = $1", [lojaId]),
+            lojaId === 'todas' ? null : pool.query("SELECT id, api_token, nome_fantasia, ativo FROM lojas_sincronizadas WHERE id = $1", [lojaId]),
             pool.query(`
                 SELECT l.id, l.nome_fantasia 
                 FROM lojas_sincronizadas l 
@@ -259,16 +319,23 @@ app.get('/relatorios/:tipo', authGuard, async (req, res) => {
             `, [req.session.usuario.id])
         ]);
 
-        if (lojaRes.rows.length === 0 || !lojaRes.rows[0].ativo) return res.redirect('/');
-
-        const lojaAtual = lojaRes.rows[0];
         const filtroData = filtroDataExe(periodo, data_inicio, data_fim);
-        const urlApi = `${API_PYTHON_URL}/reports/ranking/${tipo}?data_inicio=${filtroData.data_inicio}&data_fim=${filtroData.data_fim}&limit=50`;
-
-        const respostaApi = await axios.get(urlApi, { headers: { 'Authorization': `Bearer ${lojaAtual.api_token}` } });
+        const parametros = `data_inicio=${filtroData.data_inicio}&data_fim=${filtroData.data_fim}&limit=50`;
+        let dados, lojaAtual;
+
+        if (lojaId === 'todas') {
+            const tokens = await tokensDoUsuario(req.session.usuario.id);
+            if (tokens.length === 0) return res.redirect('/');
+            lojaAtual = { id: 'todas', nome_fantasia: 'Todas as lojas' };
+            dados = (await buscarRelatorio(`${API_PYTHON_URL}/reports/consolidado/ranking/${tipo}?${parametros}`, tokens)).consolidado;
+        } else {
+            if (lojaRes.rows.length === 0 || !lojaRes.rows[0].ativo) return res.redirect('/');
+            lojaAtual = lojaRes.rows[0];
+            dados = await buscarRelatorio(`${API_PYTHON_URL}/reports/ranking/${tipo}?${parametros}`, lojaAtual.api_token);
+        }
 
         res.render('relatorio', {
-            tipo, tituloRelatorio: titulos[tipo], dados: respostaApi.data,
+            tipo, tituloRelatorio: titulos[tipo], dados,
             lojaId, lojaAtual, periodo: periodo || 'hoje', dIni: filtroData.data_inicio, dFim: filtroData.data_fim,
             todasLojas: todasLojas.rows, usuario: req.session.usuario
         });
@@ -279,6 +346,42 @@ app.get('/relatorios/:tipo', authGuard, async (req, res) => {
     }
 });
 
+// --- AVISOS AO VIVO (proxy do SSE da API) ---
+// O navegador não tem o token da loja: a web confere o vínculo do usuário
+// e repassa o stream de eventos da API como está.
+app.get('/eventos', authGuard, async (req, res) => {
+    const lojaId = req.query.loja_id;
+    if (!/^\d+$/.test(lojaId || '')) return res.sendStatus(400);
+
+    try {
+        const lojaRes = await pool.query(`
+            SELECT l.api_token
+            FROM lojas_sincronizadas l
+            JOIN usuarios_lojas ul ON l.id = ul.loja_id
+            WHERE l.id = $1 AND ul.usuario_id = $2 AND l.ativo = TRUE
+        `, [lojaId, req.session.usuario.id]);
+        if (lojaRes.rows.length === 0) return res.sendStatus(404);
+
+        const controle = new AbortController();
+        req.on('close', () => controle.abort());
+        const resposta = await axios.get(`${API_PYTHON_URL}/reports/eventos`, {
+            headers: { 'Authorization': `Bearer ${lojaRes.rows[0].api_token}` },
+            responseType: 'stream', signal: controle.signal
+        });
+
+        res.writeHead(200, {
+            'Content-Type': 'text/event-stream', 'Cache-Control': 'no-store',
+            'Connection': 'keep-alive', 'X-Accel-Buffering': 'no'
+        });
+        resposta.data.on('error', () => res.end());
+        resposta.data.pipe(res);
+    } catch (erro) {
+        if (axios.isCancel(erro)) return;
+        console.error('Erro eventos:', erro.message);
+        if (!res.headersSent) res.sendStatus(502);
+    }
+});
+
 // ==================================================================
 // 5. INICIALIZAÇÃO
 // ==================================================================